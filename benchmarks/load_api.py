@@ -0,0 +1,145 @@
+"""
+Compare API throughput when served through dynamicqr.wsgi and dynamicqr.asgi.
+
+Starts a stub shortener with a fixed latency, then for each mode runs the app
+in a single worker process against a throwaway SQLite database and fires
+concurrent create requests (POST /api/urls/), each of which queues an
+action for the outbox worker (two inserts). No worker is started, so the
+stub's latency doesn't enter into it. Run from the repository root:
+
+    python -m benchmarks.load_api --requests 200 --concurrency 50 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from tests.stubs import ShortenerHandler, StubServer
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(mode: str, port: int) -> list:
+    if mode == "wsgi":
+        return [
+            "gunicorn", "dynamicqr.wsgi", "--bind", f"127.0.0.1:{port}",
+            "--workers", "1", "--log-level", "warning",
+        ]  # fmt: skip
+    return [
+        "uvicorn", "dynamicqr.asgi:application", "--port", str(port),
+        "--workers", "1", "--log-level", "warning",
+    ]  # fmt: skip
+
+
+def wait_until_up(url: str, api_key: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, headers={"X-API-Key": api_key}, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def fire(
+    base: str, api_key: str, mode: str, num_requests: int, concurrency: int
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+
+        async def one(i):
+            nonlocal errors
+            body = {"key": f"bench-{mode}-{i}", "long_url": "https://example.com"}
+            async with semaphore:
+                start = time.monotonic()
+                response = await client.post(
+                    base + "/api/urls/", json=body, headers={"X-API-Key": api_key}
+                )
+                latencies.append(time.monotonic() - start)
+                errors += response.status_code != 202
+
+        start = time.monotonic()
+        await asyncio.gather(*(one(i) for i in range(num_requests)))
+        elapsed = time.monotonic() - start
+
+    latencies.sort()
+    return {
+        "requests": num_requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(num_requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="Upstream seconds")
+    parser.add_argument("--modes", nargs="+", default=["wsgi", "asgi"])
+    args = parser.parse_args()
+
+    results = {}
+    with StubServer(ShortenerHandler, latency=args.latency) as shortener:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{tmp}/bench.sqlite3",
+                SHORTENER_API_URL=shortener.url,
+            )
+            manage = [sys.executable, "manage.py"]
+            subprocess.run(manage + ["migrate", "-v0"], env=env, check=True)
+            subprocess.run(
+                manage + ["shell", "-c", (
+                    "from django.contrib.auth.models import User;"
+                    "User.objects.create_superuser('bench', 'bench@example.com', 'x')"
+                )],
+                env=env,
+                check=True,
+            )  # fmt: skip
+            api_key = subprocess.run(
+                manage + ["api_key", "create", "bench"],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+            for mode in args.modes:
+                port = free_port()
+                mode_env = dict(env, ASYNC_API="1" if mode == "asgi" else "")
+                server = subprocess.Popen(server_command(mode, port), env=mode_env)
+                try:
+                    base = f"http://127.0.0.1:{port}"
+                    wait_until_up(base + "/api/urls/bench/qr/", api_key)
+                    results[mode] = asyncio.run(
+                        fire(base, api_key, mode, args.requests, args.concurrency)
+                    )
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    results["upstream_latency_s"] = args.latency
+    results["concurrency"] = args.concurrency
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
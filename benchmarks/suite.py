@@ -0,0 +1,409 @@
+"""
+Time the app's hot paths against local stand-ins for every upstream.
+
+Starts stub servers for the shortener (api.aws3.link), quickchart.io and
+ip-api.com with the given latency and error rate, sets the app up in this
+process against a throwaway SQLite database, and times:
+
+- generate_qr_pdf for each --pdf-sizes, rendered locally and fetched from the
+  quickchart stub, with a cold and then a warm image cache
+- DetailView for a key with each --hits, on first view (syncing the hits from
+  upstream) and on later views
+- MostRecentView and AllView with each --rows actions
+- the outbox worker draining queued actions
+- each /api/ endpoint
+
+Results are JSON, written to stdout or --out. Given the JSON of an earlier run
+as --baseline, each result also gets `p50_ratio`, its median over the
+baseline's, so regressions between commits stand out. Run from the repository
+root:
+
+    python -m benchmarks.suite --quick --out bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from tests.stubs import GeoHandler, QuickChartHandler, ShortenerHandler, StubServer
+
+
+def measure(func: Callable, repeat: int = 5, ok: Optional[Callable] = None) -> dict:
+    """
+    Call `func` `repeat` times and summarize how long the calls took.
+
+    A call counts as an error if it raises or `ok` returns false for its result.
+    """
+    seconds = []
+    errors = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = func()
+        except Exception:
+            errors += 1
+        else:
+            errors += ok is not None and not ok(result)
+        seconds.append(time.perf_counter() - start)
+    seconds.sort()
+    return {
+        "runs": repeat,
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(seconds) * 1000, 2),
+        "p50_ms": round(statistics.median(seconds) * 1000, 2),
+        "p95_ms": round(seconds[max(int(len(seconds) * 0.95) - 1, 0)] * 1000, 2),
+        "min_ms": round(seconds[0] * 1000, 2),
+        "max_ms": round(seconds[-1] * 1000, 2),
+    }
+
+
+def status_is(*codes):
+    return lambda response: response.status_code in codes
+
+
+def fake_hits(count: int) -> list:
+    """Upstream-style hits, one a minute back from now, from count // 4 IPs"""
+    now = datetime.now(timezone.utc)
+    hits = []
+    for i in range(count):
+        when = now - timedelta(minutes=i)
+        ip = i % max(count // 4, 1)
+        hits.append(
+            {
+                "date": when.strftime("%Y-%m-%d"),
+                "time": when.strftime("%H:%M:%S"),
+                "ip": f"10.{ip // 65536 % 256}.{ip // 256 % 256}.{ip % 256}",
+                "user": {"os": {"name": "Linux"}, "browser": {"name": "Firefox"}},
+            }
+        )
+    return hits
+
+
+def setup_django(database: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dynamicqr.settings")
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.DEBUG = False  # no debug toolbar or query log
+    settings.ALLOWED_HOSTS.append("testserver")
+    call_command("migrate", verbosity=0)
+
+
+def bench_pdf(sizes, quickchart_url: str, repeat: int) -> dict:
+    from unittest.mock import patch
+
+    from utils import qr
+    from utils.qrcache import QrImageCache
+
+    def fetch_from_stub(url):
+        return fetch_qr(url.replace("https://quickchart.io", quickchart_url))
+
+    fetch_qr = qr.fetch_qr
+    results = {}
+    for renderer in ("local", "quickchart"):
+        for size in sizes:
+            urls = [qr.gen_qr(f"https://aws3.link/bench{i}") for i in range(size)]
+            with tempfile.TemporaryDirectory() as tmp, patch.multiple(
+                qr,
+                QR_RENDERER=renderer,
+                qr_cache=QrImageCache(os.path.join(tmp, "cache")),
+                fetch_qr=fetch_from_stub,
+            ):
+                out = os.path.join(tmp, "out.pdf")
+                quiet = io.StringIO()
+                with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(
+                    quiet
+                ):
+                    name = f"generate_qr_pdf.{renderer}.{size}"
+                    results[f"{name}.cold"] = measure(
+                        lambda: qr.generate_qr_pdf(urls, out), repeat=1
+                    )
+                    results[f"{name}.warm"] = measure(
+                        lambda: qr.generate_qr_pdf(urls, out),
+                        repeat=repeat if size <= 1000 else 1,
+                    )
+    return results
+
+
+def bench_detail(counts, shortener, client, user, repeat: int) -> dict:
+    from url.models import UrlAction
+
+    results = {}
+    for count in counts:
+        key = f"detail{count}"
+        shortener.state.setdefault("hits", {})[key] = fake_hits(count)
+        action = UrlAction.objects.create(
+            user=user,
+            action_type="create",
+            url_key=key,
+            long_url="https://example.com",
+            status="succeeded",
+            response_code=200,
+        )
+        path = action.get_absolute_url()
+        ok = status_is(200)
+        results[f"DetailView.{count}_hits.first"] = measure(
+            lambda: client.get(path), repeat=1, ok=ok
+        )
+        results[f"DetailView.{count}_hits"] = measure(
+            lambda: client.get(path), repeat=repeat, ok=ok
+        )
+    return results
+
+
+def bench_lists(counts, client_for, repeat: int) -> dict:
+    from django.contrib.auth.models import User
+
+    from url.models import UrlAction
+
+    results = {}
+    for count in counts:
+        user = User.objects.create_user(f"lists{count}")
+        # two actions per key, so AllView and MostRecentView have work to do
+        actions = UrlAction.objects.bulk_create(
+            UrlAction(
+                user=user,
+                action_type="create" if i % 2 == 0 else "update",
+                url_key=f"list{i // 2}",
+                long_url=f"https://example.com/{i}",
+                status="succeeded",
+                response_code=200,
+            )
+            for i in range(count)
+        )
+        UrlAction.refresh_states(actions)
+        client = client_for(user)
+        results[f"MostRecentView.{count}_rows"] = measure(
+            lambda: client.get("/"), repeat=repeat, ok=status_is(200)
+        )
+        results[f"AllView.{count}_rows"] = measure(
+            lambda: client.get("/history/"), repeat=repeat, ok=status_is(200)
+        )
+    return results
+
+
+def bench_outbox(user, count: int) -> dict:
+    from django.core.management import call_command
+
+    from url import outbox
+    from url.models import UrlAction
+
+    outbox.enqueue_many(
+        [
+            UrlAction(
+                user=user,
+                action_type="create",
+                url_key=f"outbox{i}",
+                long_url="https://example.com",
+            )
+            for i in range(count)
+        ]
+    )
+    stats = measure(
+        lambda: call_command("outbox_worker", "--once", stdout=io.StringIO()),
+        repeat=1,
+    )
+    stats["actions"] = count
+    stats["failed_actions"] = UrlAction.objects.filter(
+        url_key__startswith="outbox"
+    ).exclude(status="succeeded").count()
+    return {"outbox_worker.drain": stats}
+
+
+def bench_api(shortener, user, repeat: int, hits: int) -> dict:
+    from django.test import Client
+
+    from url import keys
+    from url.models import ApiKey, UrlAction
+
+    _, api_key = ApiKey.generate(user, "benchmark")
+    client = Client(headers={"X-API-Key": api_key})
+    key = "apibench"
+    shortener.state.setdefault("hits", {})[key] = fake_hits(hits)
+    UrlAction.objects.create(
+        user=user,
+        action_type="create",
+        url_key=key,
+        long_url="https://example.com",
+        status="succeeded",
+        response_code=200,
+    )
+    keys.mark_live([key])
+    counter = iter(range(10**9))
+
+    def create():
+        body = {"key": f"api{next(counter)}", "long_url": "https://example.com"}
+        return client.post("/api/urls/", body, content_type="application/json")
+
+    def bulk():
+        operations = [
+            {"action": "create", "key": f"bulk{i}", "long_url": "https://example.com"}
+            for i in itertools.islice(counter, 100)
+        ]
+        body = {"operations": operations}
+        return client.post("/api/urls/bulk/", body, content_type="application/json")
+
+    def sheet():
+        body = {"prefix": "sheet", "start": 0, "count": 48}
+        response = client.post("/api/sheets/", body, content_type="application/json")
+        b"".join(response.streaming_content)
+        return response
+
+    def streamed(path):
+        def get():
+            response = client.get(path)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            return response
+
+        return get
+
+    cases = {
+        "GET /api/urls/": (streamed("/api/urls/"), 200),
+        "POST /api/urls/": (create, 202),
+        "POST /api/urls/bulk/ (100 operations)": (bulk, 202),
+        "GET /api/urls/<key>/": (streamed(f"/api/urls/{key}/"), 200),
+        "PUT /api/urls/<key>/": (
+            lambda: client.put(
+                f"/api/urls/{key}/",
+                {"long_url": "https://example.com/new"},
+                content_type="application/json",
+            ),
+            202,
+        ),
+        "DELETE /api/urls/<key>/": (lambda: client.delete(f"/api/urls/{key}/"), 202),
+        f"GET /api/urls/<key>/track/ ({hits} hits)": (
+            lambda: client.get(f"/api/urls/{key}/track/"),
+            200,
+        ),
+        f"GET /api/urls/<key>/stats/ ({hits} hits)": (
+            lambda: client.get(f"/api/urls/{key}/stats/"),
+            200,
+        ),
+        "GET /api/urls/<key>/qr/": (lambda: client.get(f"/api/urls/{key}/qr/"), 200),
+        "GET /api/urls/<key>/qr.png": (
+            lambda: client.get(f"/api/urls/{key}/qr.png"),
+            200,
+        ),
+        "GET /api/urls/<key>/qr.svg": (
+            lambda: client.get(f"/api/urls/{key}/qr.svg"),
+            200,
+        ),
+        "POST /api/sheets/ (48 codes)": (sheet, 200),
+    }
+    return {
+        name: measure(func, repeat=repeat, ok=status_is(status))
+        for name, (func, status) in cases.items()
+    }
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Add each result's p50 relative to the baseline run's"""
+    for name, stats in results.items():
+        before = baseline.get("results", {}).get(name, {}).get("p50_ms")
+        if before and "p50_ms" in stats:
+            stats["p50_ratio"] = round(stats["p50_ms"] / before, 3)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.02, help="Upstream seconds")
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Share of upstream calls failing"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case")
+    parser.add_argument(
+        "--pdf-sizes", type=int, nargs="+", default=[48, 1000, 10000]
+    )
+    parser.add_argument("--hits", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the largest sizes, run 3 times"
+    )
+    parser.add_argument("--out", help="File to write the results to")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare to")
+    args = parser.parse_args()
+    if args.quick:
+        args.pdf_sizes = [n for n in args.pdf_sizes if n <= 1000]
+        args.hits = [n for n in args.hits if n <= 1000]
+        args.rows = [n for n in args.rows if n <= 1000]
+        args.repeat = min(args.repeat, 3)
+
+    started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    stub = dict(latency=args.latency, error_rate=args.error_rate)
+    with StubServer(ShortenerHandler, **stub) as shortener, StubServer(
+        GeoHandler, **stub
+    ) as geo, StubServer(
+        QuickChartHandler, **stub
+    ) as quickchart, tempfile.TemporaryDirectory() as tmp:
+        # read by utils.url and utils.geo when they are imported
+        os.environ["SHORTENER_API_URL"] = shortener.url
+        os.environ["GEO_API_URL"] = geo.url
+        os.environ["QR_CACHE_DIR"] = os.path.join(tmp, "qr_cache")
+        setup_django(os.path.join(tmp, "bench.sqlite3"))
+        from django.contrib.auth.models import User
+        from django.test import Client
+
+        def client_for(user):
+            client = Client()
+            client.force_login(user)
+            return client
+
+        user = User.objects.create_user("bench")
+        results = {}
+        results.update(bench_pdf(args.pdf_sizes, quickchart.url, args.repeat))
+        results.update(
+            bench_detail(args.hits, shortener, client_for(user), user, args.repeat)
+        )
+        results.update(bench_lists(args.rows, client_for, args.repeat))
+        results.update(bench_outbox(user, 50))
+        results.update(bench_api(shortener, user, args.repeat, max(args.hits)))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started": started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "upstream_latency_s": args.latency,
+            "upstream_error_rate": args.error_rate,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
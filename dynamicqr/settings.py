@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 import dj_database_url
 from dotenv import load_dotenv
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "url.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -129,7 +132,40 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-if DEBUG:
+# IP geolocation of tracking hits (see url/geo.py)
+GEO_CACHE_TTL = timedelta(days=int(os.getenv("GEO_CACHE_TTL_DAYS", 30)))
+GEO_MAX_LOOKUPS_PER_REQUEST = int(os.getenv("GEO_MAX_LOOKUPS_PER_REQUEST", 300))
+
+# route /api/ to the async views in url/async_api.py; set when serving
+# dynamicqr.asgi (see readme)
+ASYNC_API = os.getenv("ASYNC_API", "").lower() in ("1", "true", "yes")
+
+# how long a url_key's local copy of its hits is served before re-syncing
+HIT_SYNC_TTL = timedelta(seconds=int(os.getenv("HIT_SYNC_TTL_SECONDS", 300)))
+
+# outbox of shortener calls drained by `manage.py outbox_worker` (see url/outbox.py)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF = timedelta(seconds=float(os.getenv("OUTBOX_BACKOFF_SECONDS", 2)))
+OUTBOX_MAX_BACKOFF = timedelta(seconds=float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 300)))
+# how long a claimed item is held by a worker before it is due again; longer
+# than a call with all its client-side retries can take
+OUTBOX_LEASE = timedelta(seconds=float(os.getenv("OUTBOX_LEASE_SECONDS", 120)))
+
+# API keys are checked against the database at most once per TTL per process
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", 1024))
+API_KEY_CACHE_TTL = timedelta(seconds=float(os.getenv("API_KEY_CACHE_TTL_SECONDS", 60)))
+
+# in-memory filter of taken url_keys in front of LiveKey (see url/keys.py); keys
+# taken in other processes are picked up within KEY_FILTER_REFRESH
+KEY_FILTER_CAPACITY = int(os.getenv("KEY_FILTER_CAPACITY", 1_000_000))
+KEY_FILTER_ERROR_RATE = float(os.getenv("KEY_FILTER_ERROR_RATE", 0.01))
+KEY_FILTER_REFRESH = timedelta(seconds=float(os.getenv("KEY_FILTER_REFRESH_SECONDS", 2)))
+
+# bearer token /metrics requires of scrapers; closed when unset (see url/metrics.py)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# the toolbar middleware is sync-only and would serialize async requests
+if DEBUG and not ASYNC_API:
     try:
         import debug_toolbar  # noqa: F401
 
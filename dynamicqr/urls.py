@@ -3,10 +3,13 @@ from django.conf import settings
 from django.urls import include, path
 from django.contrib.auth import views as auth_views
 
+from url.metrics import metrics
+
 urlpatterns = [
     path("api/", include("url.api_urls")),
     path("", include("url.urls")),
     path("admin/", admin.site.urls),
+    path("metrics", metrics, name="metrics"),
     path(
         "accounts/login/", auth_views.LoginView.as_view(next_page="most_recent"), name="login"
     ),
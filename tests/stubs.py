@@ -0,0 +1,215 @@
+"""Local stand-ins for the upstream HTTP services, for offline tests."""
+
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _record(self) -> bool:
+        """Log the call and wait out the latency; fail it at the error rate"""
+        with self.server.lock:
+            self.server.calls.append((self.command, self.path))
+            failed = self.server.random.random() < self.server.error_rate
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if failed:
+            self._send_json({"error": "Injected failure"}, status=503)
+        return failed
+
+
+def fake_location(ip: str) -> dict:
+    """Deterministic ip-api.com style payload for an IP address"""
+    return {
+        "status": "success",
+        "country": "United States",
+        "countryCode": "US",
+        "region": "CA",
+        "regionName": "California",
+        "city": f"City {ip.split('.')[-1]}",
+        "query": ip,
+    }
+
+
+class GeoHandler(StubHandler):
+    """Stand-in for ip-api.com's /json/<ip> and /batch endpoints"""
+
+    def do_GET(self):
+        if self._record():
+            return
+        if not self.path.startswith("/json/"):
+            return self._send_json({"status": "fail"}, status=404)
+        self._send_json(fake_location(self.path[len("/json/") :]))
+
+    def do_POST(self):
+        if self._record():
+            return
+        if self.path != "/batch":
+            return self._send_json({"status": "fail"}, status=404)
+        ips = self._read_json()
+        if len(ips) > 100:
+            return self._send_json({"message": "too many IPs"}, status=422)
+        self._send_json([fake_location(ip) for ip in ips])
+
+
+class ShortenerHandler(StubHandler):
+    """
+    Stand-in for the api.aws3.link /shorten, /remove and /track endpoints.
+
+    GET /<key> redirects like aws3.link does, so one server plays both. With
+    `state["hang_up"]` set, POSTs are carried out but the connection is closed
+    instead of answering, as if it was reset once the request was sent.
+    """
+
+    def do_GET(self):
+        if self._record():
+            return
+        target = self.server.state.get("links", {}).get(self.path[1:])
+        if target is None:
+            return self._send_json({"error": "Not found"}, 404)
+        self.send_response(301)
+        self.send_header("Location", target)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        if self._record():
+            return
+        body = self._read_json() or {}
+        links = self.server.state.setdefault("links", {})
+        if self.path == "/shorten":
+            key = body.get("customSlug")
+            with self.server.lock:
+                if key in links:
+                    return self._send_json({"error": "Slug already in use"}, 409)
+                links[key] = body.get("longUrl")
+            if self.server.state.get("hang_up"):
+                self.close_connection = True
+                return
+            return self._send_json({"shortUrl": f"https://aws3.link/{key}"})
+        if self.path == "/remove":
+            with self.server.lock:
+                if links.pop(body.get("slug"), None) is None:
+                    return self._send_json({"error": "Not found"}, 404)
+            return self._send_json({"message": "Deleted"})
+        if self.path == "/track":
+            hits = self.server.state.get("hits", {}).get(body.get("slug"), [])
+            return self._send_json({"totalHits": len(hits), "hits": hits})
+        self._send_json({"error": "Not found"}, 404)
+
+
+@lru_cache(maxsize=None)
+def blank_png(size: int) -> bytes:
+    """A white 8-bit grayscale PNG of size x size pixels"""
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    rows = (b"\x00" + b"\xff" * size) * size
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+class QuickChartHandler(StubHandler):
+    """Stand-in for quickchart.io's /qr endpoint, serving blank images"""
+
+    def do_GET(self):
+        if self._record():
+            return
+        parts = urlsplit(self.path)
+        if parts.path != "/qr":
+            return self._send_json({"error": "Not found"}, 404)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        size = int(params.get("size", 150))
+        if params.get("format") == "svg":
+            svg = '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d"/>'
+            svg %= (size, size)
+            body, content_type = svg.encode(), "image/svg+xml"
+        else:
+            body, content_type = blank_png(size), "image/png"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default of 5 resets connections under load
+
+
+class StubServer:
+    """
+    Run a stub handler on a free local port in a background thread.
+
+    Use as a context manager; `url` is the server's base URL and `calls` a
+    list of (method, path) tuples for every request received. Each request
+    is delayed by `latency` seconds, a random `error_rate` share of them
+    fail with a 503 (reproducibly for a given `seed`), and handlers may keep
+    data in `state`.
+    """
+
+    def __init__(
+        self,
+        handler=GeoHandler,
+        latency: float = 0,
+        port: int = 0,
+        error_rate: float = 0,
+        seed: int = 0,
+    ):
+        self.httpd = _Server(("127.0.0.1", port), handler)
+        self.httpd.calls = []
+        self.httpd.lock = threading.Lock()
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.random = random.Random(seed)
+        self.httpd.state = {}
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,96 @@
+from ..utils.analytics import HitArrays, summarize
+
+import unittest
+from datetime import datetime, timezone
+
+
+def ts(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+LOCATIONS = {
+    "1.1.1.1": {"countryCode": "US", "regionName": "California"},
+    "2.2.2.2": {"countryCode": "US", "regionName": "Oregon"},
+    "3.3.3.3": {"countryCode": "CA", "regionName": "Ontario"},
+}
+
+
+class TestSummarize(unittest.TestCase):
+
+    def setUp(self):
+        self.hits = HitArrays(
+            [
+                ts(2024, 1, 1, 9, 15),  # Monday
+                ts(2024, 1, 1, 9, 45),
+                ts(2024, 1, 1, 17, 0),
+                ts(2024, 1, 3, 9, 5),
+                ts(2024, 1, 8, 12, 0),  # the next Monday
+            ],
+            ["1.1.1.1", "1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4"],
+            LOCATIONS,
+        )
+
+    def test_counts(self):
+        summary = summarize(self.hits)
+        self.assertEqual(summary["total_hits"], 5)
+        self.assertEqual(summary["unique_ips"], 4)
+        self.assertEqual(summary["first_hit"], "2024-01-01T09:15:00")
+        self.assertEqual(summary["last_hit"], "2024-01-08T12:00:00")
+
+    def test_time_series(self):
+        summary = summarize(self.hits)
+        self.assertEqual(
+            summary["hourly"][:2],
+            [
+                {"hour": "2024-01-01T09:00", "hits": 2},
+                {"hour": "2024-01-01T17:00", "hits": 1},
+            ],
+        )
+        self.assertEqual(
+            summary["daily"],
+            [
+                {"date": "2024-01-01", "hits": 3},
+                {"date": "2024-01-03", "hits": 1},
+                {"date": "2024-01-08", "hits": 1},
+            ],
+        )
+        self.assertEqual(
+            summary["weekly"],
+            [
+                {"week_of": "2024-01-01", "hits": 4},
+                {"week_of": "2024-01-08", "hits": 1},
+            ],
+        )
+
+    def test_peak_hours(self):
+        summary = summarize(self.hits)
+        self.assertEqual(summary["hours_of_day"][9], 3)
+        self.assertEqual(summary["peak_hours"], [9, 12, 17])
+
+    def test_time_zone(self):
+        summary = summarize(self.hits, tz="America/Los_Angeles")
+        self.assertEqual(summary["first_hit"], "2024-01-01T01:15:00")
+        self.assertEqual(summary["daily"][0], {"date": "2024-01-01", "hits": 3})
+        self.assertEqual(summary["peak_hours"][0], 1)
+
+    def test_top_locations(self):
+        summary = summarize(self.hits, top=2)
+        self.assertEqual(
+            summary["top_countries"],
+            [{"country": "US", "hits": 3}, {"country": "CA", "hits": 1}],
+        )
+        self.assertEqual(
+            summary["top_regions"],
+            [
+                {"region": "California, US", "hits": 2},
+                {"region": "Ontario, CA", "hits": 1},
+            ],
+        )
+
+    def test_no_hits(self):
+        summary = summarize(HitArrays([], []))
+        self.assertEqual(summary["total_hits"], 0)
+        self.assertIsNone(summary["first_hit"])
+        self.assertEqual(summary["daily"], [])
+        self.assertEqual(summary["peak_hours"], [])
+        self.assertEqual(summary["top_countries"], [])
@@ -0,0 +1,28 @@
+from ..utils.bloom import BloomFilter
+
+import unittest
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_added_keys_are_members(self):
+        bloom = BloomFilter(capacity=1000)
+        keys = [f"llqrv{i}" for i in range(1000)]
+        bloom.update(keys)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+        bloom.update(f"taken{i}" for i in range(10_000))
+        false_positives = sum(f"free{i}" in bloom for i in range(10_000))
+        self.assertLess(false_positives, 200)
+
+    def test_counts_distinct_keys(self):
+        bloom = BloomFilter(capacity=100)
+        bloom.update(["a", "b", "a"])
+        self.assertEqual(len(bloom), 2)
+        self.assertNotIn("c", bloom)
+
+
+if __name__ == "__main__":
+    unittest.main()
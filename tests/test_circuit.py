@@ -0,0 +1,68 @@
+from ..utils.circuit import CircuitBreaker
+
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            failure_threshold=3, reset_timeout=30, clock=self.clock
+        )
+
+    def trip(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failed()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failed()
+        self.breaker.failed()
+        self.breaker.succeeded()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.trip()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_in(), 30)
+
+    def test_lets_one_trial_through_after_reset_timeout(self):
+        self.trip()
+        self.clock.now = 30
+        self.assertEqual(self.breaker.retry_in(), 0)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.succeeded()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        self.trip()
+        self.clock.now = 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failed()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 59
+        self.assertFalse(self.breaker.allow())
+        self.clock.now = 60
+        self.assertTrue(self.breaker.allow())
+
+    def test_unreported_trial_is_given_up_on(self):
+        self.trip()
+        self.clock.now = 30
+        self.assertTrue(self.breaker.allow())
+        self.clock.now = 60
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+from ..utils import geo
+from .stubs import StubServer
+
+import unittest
+from unittest.mock import patch
+
+
+class TestLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        patcher = patch.object(geo, "GEO_API_URL", self.server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def test_lookup_batches_requests(self):
+        ips = [f"10.0.{i // 256}.{i % 256}" for i in range(250)]
+        locations = geo.lookup(ips)
+        self.assertEqual(set(locations), set(ips))
+        self.assertEqual(locations["10.0.0.7"]["city"], "City 7")
+        self.assertEqual(self.server.calls, [("POST", "/batch")] * 3)
+
+    def test_lookup_deduplicates(self):
+        locations = geo.lookup(["1.2.3.4", "1.2.3.4", "5.6.7.8"], batch_size=2)
+        self.assertEqual(set(locations), {"1.2.3.4", "5.6.7.8"})
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_failed_batches_are_left_out(self):
+        self.server.httpd.error_rate = 1
+        self.assertEqual(geo.lookup(["1.2.3.4"]), {})
+
+    def test_lookup_empty(self):
+        self.assertEqual(geo.lookup([]), {})
+        self.assertEqual(self.server.calls, [])
+
+    def test_failed_batch_is_skipped(self):
+        # the stub rejects batches larger than ip-api.com allows
+        ips = [f"10.0.0.{i}" for i in range(101)]
+        self.assertEqual(geo.lookup(ips, batch_size=101), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+from ..utils import metrics
+from ..utils.metrics import Registry
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def files(self):
+        return sorted(n for n in os.listdir(self.tmp.name) if n.endswith(".json"))
+
+    def test_counter(self):
+        registry = Registry(directory=None)
+        calls = registry.counter("calls_total", "Calls")
+        calls.inc(endpoint="/a")
+        calls.inc(2, endpoint="/a")
+        calls.inc(endpoint='/b"')
+        lines = registry.render().splitlines()
+        self.assertEqual(
+            lines[:2], ["# HELP calls_total Calls", "# TYPE calls_total counter"]
+        )
+        self.assertIn('calls_total{endpoint="/a"} 3', lines)
+        self.assertIn('calls_total{endpoint="/b\\""} 1', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry(directory=None)
+        latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            latency.observe(value, view="home")
+        lines = registry.render().splitlines()
+        self.assertEqual(
+            lines[2:],
+            [
+                'latency_seconds_bucket{view="home",le="0.1"} 1',
+                'latency_seconds_bucket{view="home",le="1"} 3',
+                'latency_seconds_bucket{view="home",le="+Inf"} 4',
+                'latency_seconds_sum{view="home"} 6.05',
+                'latency_seconds_count{view="home"} 4',
+            ],
+        )
+
+    def test_processes_are_added_up(self):
+        registries = [Registry(directory=self.tmp.name) for _ in range(2)]
+        for i, registry in enumerate(registries, 1):
+            registry.counter("calls_total", "Calls").inc(i)
+            registry.histogram("latency_seconds", "Latency", buckets=(1,)).observe(i)
+            registry.flush()
+        lines = registries[0].render().splitlines()
+        self.assertIn("calls_total 3", lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 1', lines)
+        self.assertIn("latency_seconds_count 2", lines)
+        self.assertEqual(len(self.files()), 2)
+
+    def test_changes_are_flushed_in_the_background(self):
+        registry = Registry(directory=self.tmp.name, flush_interval=0.05)
+        calls = registry.counter("calls_total", "Calls")
+        with patch.object(metrics, "_write", wraps=metrics._write) as write:
+            calls.inc()
+            calls.inc()
+            # nothing is written by the thread that made the change
+            write.assert_not_called()
+            deadline = time.monotonic() + 5
+            while not write.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(
+            metrics._read(registry._path)["counters"], [["calls_total", {}, 2]]
+        )
+        # nothing changed, so nothing more is written
+        with patch.object(metrics, "_write") as write:
+            time.sleep(0.2)
+        write.assert_not_called()
+
+    def test_forked_child_starts_from_zero(self):
+        registry = Registry(directory=self.tmp.name)
+        calls = registry.counter("calls_total", "Calls")
+        calls.inc(5)
+        registry.flush()
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            calls.inc()
+            self.assertEqual(registry.snapshot()["counters"], [["calls_total", {}, 1]])
+            registry.flush()
+        # the parent's file is kept alongside the child's
+        self.assertIn("calls_total 6", registry.render().splitlines())
+
+
+    def exited_process(self, calls, pid=None):
+        """Write the file a process that has since exited would have left"""
+        with patch("os.getpid", return_value=pid or _exited_pid()):
+            registry = Registry(directory=self.tmp.name)
+            registry.counter("calls_total", "Calls").inc(calls)
+            registry.histogram("latency_seconds", "Latency", buckets=(1,)).observe(2)
+            registry.flush()
+
+    def reader(self):
+        registry = Registry(directory=self.tmp.name)
+        registry.counter("calls_total", "Calls").inc()
+        registry.histogram("latency_seconds", "Latency", buckets=(1,))
+        registry.flush()
+        return registry
+
+    def test_files_of_exited_processes_are_merged(self):
+        self.exited_process(2)
+        self.exited_process(3)
+        reader = self.reader()
+        for _ in range(2):
+            lines = reader.render().splitlines()
+            self.assertIn("calls_total 6", lines)
+            self.assertIn("latency_seconds_count 2", lines)
+            self.assertEqual(
+                self.files(), sorted(["exited.json", os.path.basename(reader._path)])
+            )
+        # later exits are added to the earlier ones
+        self.exited_process(4)
+        self.assertIn("calls_total 10", reader.render().splitlines())
+        self.assertEqual(len(self.files()), 2)
+
+    def test_files_of_running_processes_are_kept(self):
+        other = Registry(directory=self.tmp.name)
+        with patch("os.getpid", return_value=os.getppid()):
+            other.counter("calls_total", "Calls").inc(5)
+            other.flush()
+        reader = self.reader()
+        self.assertIn("calls_total 6", reader.render().splitlines())
+        self.assertEqual(len(self.files()), 2)
+        self.assertNotIn("exited.json", self.files())
+
+    def test_interrupted_merge_is_not_counted_twice(self):
+        pid = _exited_pid()
+        self.exited_process(2, pid)
+        reader = self.reader()
+        # stopped after writing exited.json, before removing what it merged
+        with patch.object(metrics, "_remove"):
+            reader.merge_exited()
+        self.assertEqual(len(self.files()), 3)
+        self.exited_process(3)
+        self.assertIn("calls_total 6", reader.render().splitlines())
+        self.assertEqual(len(self.files()), 2)
+
+    def test_leftover_temporary_files_are_removed(self):
+        pid = _exited_pid()
+        path = os.path.join(self.tmp.name, f"{pid}-0123abcd.json.tmp")
+        with open(path, "w") as f:
+            f.write("{")
+        self.reader().render()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
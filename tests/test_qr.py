@@ -0,0 +1,196 @@
+from ..utils import qr
+from ..utils.qrcache import QrImageCache
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def test_results_keep_input_order(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x % 5))
+            return x * x
+
+        expected = [x * x for x in range(20)]
+        self.assertEqual(list(qr.prefetch(slow_square, range(20), 4)), expected)
+
+    def test_in_flight_calls_are_bounded(self):
+        started = []
+        release = threading.Event()
+
+        def wait(x):
+            started.append(x)
+            release.wait()
+            return x
+
+        results = qr.prefetch(wait, range(100), 2)
+        consumer = threading.Thread(target=lambda: list(results))
+        consumer.start()
+        time.sleep(0.1)
+        self.assertLessEqual(len(started), 4)
+        release.set()
+        consumer.join()
+        self.assertEqual(len(started), 100)
+
+
+class TestGenerateQrPdf(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = patch.object(qr, "qr_cache", QrImageCache(cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_and_images_without_temp_files(self):
+        urls = [qr.gen_qr(f"https://aws3.link/llqrv{i}") for i in range(60)]
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                qr.generate_qr_pdf(urls, "out.pdf")
+            finally:
+                os.chdir(cwd)
+            self.assertEqual(os.listdir(tmp), ["out.pdf"])
+            with open(os.path.join(tmp, "out.pdf"), "rb") as f:
+                content = f.read()
+        self.assertIn(b"/Count 2", content)
+        self.assertEqual(len(re.findall(rb"/Subtype /Image", content)), 60)
+
+
+class TestParallelQrPdf(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = patch.object(qr, "qr_cache", QrImageCache(cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        out_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(out_dir.cleanup)
+        self.dir = out_dir.name
+        self.urls = [qr.gen_qr(f"https://aws3.link/llqrv{i}") for i in range(100)]
+        self.descriptions = [str(i) for i in range(100)]
+
+    def generate(self, filename, workers):
+        path = os.path.join(self.dir, filename)
+        with patch.object(qr, "PDF_CHUNK_PAGES", 1):
+            qr.generate_qr_pdf(
+                self.urls, path, descriptions=self.descriptions, workers=workers
+            )
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_same_file_as_serial(self):
+        parallel = self.generate("parallel.pdf", 2)
+        self.assertEqual(parallel, self.generate("serial.pdf", 1))
+        self.assertEqual(sorted(os.listdir(self.dir)), ["parallel.pdf", "serial.pdf"])
+
+    def test_resumes_from_finished_chunks(self):
+        lay_out_chunk = qr._lay_out_chunk
+
+        def crash_after_first_chunk(path, *args):
+            if not path.endswith("000000.pickle"):
+                raise RuntimeError("crashed")
+            lay_out_chunk(path, *args)
+
+        # threads, so the patched functions are the ones called
+        with patch.object(qr, "ProcessPoolExecutor", qr.ThreadPoolExecutor):
+            with patch.object(qr, "_lay_out_chunk", crash_after_first_chunk):
+                with self.assertRaises(RuntimeError):
+                    self.generate("out.pdf", 2)
+            with patch.object(qr, "_lay_out_chunk", wraps=lay_out_chunk) as resumed:
+                content = self.generate("out.pdf", 2)
+        self.assertEqual(
+            sorted(os.path.basename(c.args[0]) for c in resumed.call_args_list),
+            ["000001.pickle", "000002.pickle"],
+        )
+        self.assertEqual(content, self.generate("serial.pdf", 1))
+
+    def test_identical_jobs_at_once(self):
+        def crash(path, *args):
+            raise RuntimeError("crashed")
+
+        with patch.object(qr, "ProcessPoolExecutor", qr.ThreadPoolExecutor):
+            with patch.object(qr, "_lay_out_chunk", crash):
+                with self.assertRaises(RuntimeError):
+                    self.generate("out.pdf", 2)
+            # as if that run were still going
+            (busy_dir,) = [d for d in os.listdir(self.dir) if ".parts-" in d]
+            lock = qr._lock_parts_dir(os.path.join(self.dir, busy_dir))
+            self.addCleanup(os.close, lock)
+            content = self.generate("out.pdf", 2)
+        self.assertEqual(content, self.generate("serial.pdf", 1))
+        self.assertEqual(
+            sorted(os.listdir(self.dir)), sorted([busy_dir, "out.pdf", "serial.pdf"])
+        )
+
+    def test_command_line(self):
+        env = dict(
+            os.environ,
+            QR_CACHE_DIR=os.path.join(self.dir, "cache"),
+            QR_RENDERER="local",
+            PDF_CHUNK_PAGES="1",
+        )
+        contents = []
+        for workers in ("1", "2"):
+            path = os.path.join(self.dir, f"{workers}.pdf")
+            # run the way the readme says, from outside the repo
+            subprocess.run(
+                [sys.executable, qr.__file__, "aws3.link/llqrv", "0", "100"]
+                + ["--filename", path, "--workers", workers],
+                cwd=self.dir,
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        self.assertEqual(contents[0], contents[1])
+        self.assertEqual(len(re.findall(rb"/Subtype /Image", contents[0])), 100)
+
+
+class TestStreamQrPdf(unittest.TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = patch.object(qr, "qr_cache", QrImageCache(cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_are_yielded_as_they_are_laid_out(self):
+        rendered = []
+
+        def urls():
+            for i in range(1000):
+                rendered.append(i)
+                yield qr.gen_qr(f"https://aws3.link/llqrv{i}")
+
+        chunks = qr.stream_qr_pdf(urls(), (str(i) for i in range(1000)))
+        self.assertTrue(next(chunks).startswith(b"%PDF-"))
+        first_page = next(chunks)
+        self.assertEqual(len(re.findall(rb"/Subtype /Image", first_page)), 48)
+        self.assertLess(len(rendered), 100)
+
+    def test_cross_reference_table_points_at_objects(self):
+        urls = [qr.gen_qr(f"https://aws3.link/llqrv{i}") for i in range(50)]
+        content = b"".join(qr.stream_qr_pdf(urls))
+        self.assertIn(b"/Count 2", content)
+        startxref = int(content.rsplit(b"startxref", 1)[1].split()[0])
+        self.assertTrue(content[startxref:].startswith(b"xref"))
+        entries = re.findall(rb"(\d{10}) 00000 n ", content[startxref:])
+        for n, offset in enumerate(entries, 1):
+            self.assertTrue(content[int(offset):].startswith(b"%d 0 obj" % n))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+from ..utils import qrcache
+from ..utils.qrcache import QrImageCache, cache_key
+
+import os
+import tempfile
+import unittest
+from unittest.mock import call, patch
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def test_parameter_order_is_ignored(self):
+        self.assertEqual(
+            cache_key("https://quickchart.io/qr?size=100&text=aws3.link/a"),
+            cache_key("https://quickchart.io/qr?text=aws3.link/a&size=100"),
+        )
+
+    def test_parameters_are_distinguished(self):
+        self.assertNotEqual(
+            cache_key("https://quickchart.io/qr?size=100&text=aws3.link/a"),
+            cache_key("https://quickchart.io/qr?size=70&text=aws3.link/a"),
+        )
+
+    def test_variants_are_distinguished(self):
+        url = "https://quickchart.io/qr?size=100&text=aws3.link/a"
+        self.assertNotEqual(cache_key(url, "local"), cache_key(url, "quickchart"))
+
+
+class TestQrImageCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_hits_and_misses(self):
+        cache = QrImageCache(self.directory)
+        self.assertIsNone(cache.get("abc"))
+        cache.set("abc", b"png")
+        self.assertEqual(cache.get("abc"), b"png")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_lookups_are_counted_in_metrics(self):
+        cache = QrImageCache(self.directory)
+        with patch.object(qrcache.cache_lookups, "inc") as inc:
+            cache.get("abc")
+            cache.set("abc", b"png")
+            cache.get("abc")
+        self.assertEqual(inc.call_args_list, [call(result="miss"), call(result="hit")])
+
+    def test_variants_are_stored_apart(self):
+        cache = QrImageCache(self.directory)
+        url = "https://quickchart.io/qr?size=100&text=aws3.link/a"
+        self.assertEqual(cache.get_or_set(url, lambda: b"local", "local"), b"local")
+        self.assertEqual(
+            cache.get_or_set(url, lambda: b"remote", "quickchart"), b"remote"
+        )
+        self.assertEqual(cache.get_or_set(url, lambda: b"other", "local"), b"local")
+
+    def test_shared_between_instances(self):
+        QrImageCache(self.directory).set("abc", b"png")
+        self.assertEqual(QrImageCache(self.directory).get("abc"), b"png")
+
+    def test_failed_create_is_not_stored(self):
+        cache = QrImageCache(self.directory)
+
+        def fail():
+            raise IOError("upstream error")
+
+        with self.assertRaises(IOError):
+            cache.get_or_set("https://example.com/qr.png", fail)
+        self.assertEqual(
+            cache.get_or_set("https://example.com/qr.png", lambda: b"png"), b"png"
+        )
+        self.assertEqual(
+            cache.get_or_set("https://example.com/qr.png", lambda: b"other"), b"png"
+        )
+
+    def test_least_recently_used_are_evicted(self):
+        cache = QrImageCache(self.directory, max_bytes=300)
+        for i, key in enumerate(["a0", "b0", "c0"]):
+            cache.set(key, b"x" * 100)
+            os.utime(cache._path(key), (i, i))
+        cache.get("a0")  # now the most recently used
+        cache.set("d0", b"x" * 100)
+        self.assertIsNone(cache.get("b0"))
+        self.assertIsNone(cache.get("c0"))
+        self.assertIsNotNone(cache.get("a0"))
+        self.assertIsNotNone(cache.get("d0"))
+        self.assertLessEqual(cache.stats()["bytes"], 300)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_overwrites_replace_their_size(self):
+        cache = QrImageCache(self.directory, max_bytes=300)
+        for _ in range(5):
+            cache.set("a0", b"x" * 100)
+        self.assertEqual(cache.stats()["bytes"], 100)
+        self.assertEqual(cache.stats()["evictions"], 0)
+
+    def test_writes_of_other_processes_are_counted(self):
+        # two processes sharing the directory, each under the bound on its own
+        first = QrImageCache(self.directory, max_bytes=300, recount_interval=0)
+        second = QrImageCache(self.directory, max_bytes=300, recount_interval=0)
+        for i in range(2):
+            first.set(f"a{i}", b"x" * 100)
+            second.set(f"b{i}", b"x" * 100)
+        self.assertLessEqual(second._disk_usage(), 300)
+        self.assertGreater(first.evictions + second.evictions, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+from ..utils.qrencode import encode, to_png, to_svg
+from ..utils.qrcache import QrImageCache
+from ..utils import qr
+
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest.mock import patch
+
+
+def read_format_bits(modules):
+    """Decode (level bits, mask) from the format info next to the top-left finder"""
+    coords = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)]
+    coords += [(14 - i, 8) for i in range(9, 15)]
+    bits = sum(modules[y][x] << i for i, (x, y) in enumerate(coords)) ^ 0x5412
+    return bits >> 13, (bits >> 10) & 7
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_smallest_version_is_used(self):
+        self.assertEqual(len(encode("https://aws3.link/abc")), 25)  # version 2
+        self.assertEqual(len(encode("a" * 100, "H")), 57)  # version 10
+
+    def test_finder_patterns(self):
+        modules = encode("https://aws3.link/llqrv1")
+        size = len(modules)
+        for x0, y0 in ((0, 0), (size - 7, 0), (0, size - 7)):
+            ring = [modules[y0][x0 + i] for i in range(7)]
+            self.assertEqual(ring, [True] * 7)
+            self.assertTrue(modules[y0 + 3][x0 + 3])
+            self.assertFalse(modules[y0 + 1][x0 + 1])
+
+    def test_format_bits_record_error_correction_level(self):
+        for level, bits in (("L", 1), ("M", 0), ("Q", 3), ("H", 2)):
+            level_bits, mask = read_format_bits(encode("hello", level))
+            self.assertEqual(level_bits, bits)
+            self.assertIn(mask, range(8))
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            encode("hello", "X")
+        with self.assertRaises(ValueError):
+            encode("a" * 3000)
+
+
+class TestWriters(unittest.TestCase):
+
+    def test_png(self):
+        png = to_png(encode("hello"), size=120)
+        self.assertTrue(png.startswith(b"\x89PNG\r\n\x1a\n"))
+        width, height = struct.unpack(">II", png[16:24])
+        self.assertEqual((width, height), (120, 120))
+        idat_length = struct.unpack(">I", png[33:37])[0]
+        raw = zlib.decompress(png[41 : 41 + idat_length])
+        self.assertEqual(len(raw), 120 * (1 + 120 // 8))
+        # quiet zone is white
+        self.assertEqual(raw[1], 0xFF)
+
+    def test_svg(self):
+        svg = to_svg(encode("hello"), size=64, border=2)
+        self.assertIn(b'width="64"', svg)
+        self.assertIn(b'viewBox="0 0 25 25"', svg)
+
+
+class TestQrImage(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = patch.object(qr, "qr_cache", QrImageCache(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(qr, "fetch_qr")
+    def test_quickchart_urls_render_locally(self, mock_fetch):
+        image = qr.qr_image(qr.gen_qr("https://aws3.link/abc", 70))
+        mock_fetch.assert_not_called()
+        self.assertEqual(struct.unpack(">II", image[16:24]), (70, 70))
+
+    @patch.object(qr, "fetch_qr")
+    def test_other_urls_are_fetched(self, mock_fetch):
+        mock_fetch.return_value = b"image"
+        self.assertEqual(qr.qr_image("https://example.com/qr.png"), b"image")
+        self.assertEqual(qr.qr_image("https://example.com/qr.png"), b"image")
+        mock_fetch.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
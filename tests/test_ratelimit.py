@@ -0,0 +1,158 @@
+from ..utils.ratelimit import TokenBucket, parse_retry_after
+from ..utils import metrics, url
+from ..utils.url import ShortenerClient
+
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+
+
+class FakeClock:
+    """Clock whose sleep just moves time forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestParseRetryAfter(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+
+    def test_http_date(self):
+        now = datetime(2024, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        self.assertEqual(
+            parse_retry_after("Mon, 01 Jan 2024 00:00:05 GMT", now=now), 5.0
+        )
+
+    def test_missing_or_malformed(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def bucket(self, **kwargs):
+        return TokenBucket(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_burst_then_rate(self):
+        bucket = self.bucket(rate=10, burst=5)
+        waits = [bucket.acquire() for _ in range(7)]
+        self.assertEqual(waits[:5], [0] * 5)
+        self.assertAlmostEqual(waits[5], 0.1)
+        self.assertAlmostEqual(waits[6], 0.1)
+        self.assertAlmostEqual(self.clock.now, 0.2)
+        self.assertEqual(bucket.stats()["waits"], 2)
+
+    def test_concurrent_reservations_queue_up(self):
+        bucket = self.bucket(rate=10, burst=1)
+        waits = [bucket._reserve() for _ in range(3)]
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 0.1)
+        self.assertAlmostEqual(waits[2], 0.2)
+
+    def test_throttling_halves_rate_once_per_cooldown(self):
+        bucket = self.bucket(rate=8, cooldown=1)
+        bucket.throttled()
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 4)
+        self.clock.now += 1
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 2)
+        self.assertEqual(bucket.stats()["throttles"], 3)
+
+    def test_rate_recovers_up_to_max(self):
+        bucket = self.bucket(rate=8, increase=3)
+        bucket.throttled()
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 7)
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 8)
+
+    def test_retry_after_holds_callers(self):
+        bucket = self.bucket(rate=100, burst=10)
+        bucket.throttled(retry_after=2)
+        self.assertAlmostEqual(bucket.acquire(), 2)
+
+    def test_callers_held_by_retry_after_resume_at_the_rate(self):
+        bucket = self.bucket(rate=20, burst=10)
+        bucket.throttled(retry_after=2)
+        waits = [bucket._reserve() for _ in range(4)]
+        # the rate is halved to 10 a second
+        for wait, expected in zip(waits, [2, 2.1, 2.2, 2.3]):
+            self.assertAlmostEqual(wait, expected)
+        # a caller arriving once the pause is over queues behind them
+        self.clock.now = 2.05
+        self.assertAlmostEqual(bucket._reserve(), 0.35)
+
+    def test_no_tokens_are_earned_during_a_pause(self):
+        bucket = self.bucket(rate=10, burst=5, cooldown=0)
+        bucket.throttled(retry_after=1)
+        self.clock.now = 0.5
+        bucket.throttled(retry_after=1)
+        self.clock.now = 1.5
+        self.assertEqual(bucket._reserve(), 0)
+        self.assertAlmostEqual(bucket._reserve(), 0.4)
+        # and the bucket fills up again afterwards
+        self.clock.now = 10
+        self.assertEqual([bucket._reserve() for _ in range(5)], [0] * 5)
+
+    def test_on_wait(self):
+        waits = []
+        bucket = self.bucket(rate=10, burst=1, on_wait=waits.append)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(len(waits), 2)
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 0.1)
+
+    def test_async_acquire(self):
+        bucket = TokenBucket(rate=1000, burst=1)
+        waits = asyncio.run(self._acquire_twice(bucket))
+        self.assertEqual(waits[0], 0)
+        self.assertGreater(waits[1], 0)
+
+    async def _acquire_twice(self, bucket):
+        return [await bucket.aacquire(), await bucket.aacquire()]
+
+
+class TestShortenerClientLimiting(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = TokenBucket(
+            rate=10, burst=10, clock=self.clock, sleep=self.clock.sleep
+        )
+        self.client = ShortenerClient(
+            base_url="https://shortener.test", backoff=0, limiter=self.limiter
+        )
+
+    @patch("requests.Session.post")
+    def test_honors_retry_after(self, mock_post):
+        throttled = Mock(status_code=429, headers={"Retry-After": "3"})
+        ok = Mock(status_code=200, headers={})
+        mock_post.side_effect = [throttled, ok]
+        self.assertIs(self.client.post("/shorten", {}), ok)
+        self.assertAlmostEqual(self.clock.now, 3)
+        self.assertEqual(self.limiter.stats()["throttles"], 1)
+
+    @patch("requests.Session.post")
+    def test_slows_down_on_503(self, mock_post):
+        mock_post.return_value = Mock(status_code=503, headers={})
+        self.client.post("/track", {"slug": "abc"})
+        self.assertLess(self.limiter.rate, 10)
+
+    def test_waits_are_exported(self):
+        with patch.object(metrics.limiter_wait_seconds, "observe") as observe:
+            url.limiter.on_wait(0.25)
+        observe.assert_called_once_with(0.25, limiter="shortener")
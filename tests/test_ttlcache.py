@@ -0,0 +1,49 @@
+from ..utils.ttlcache import TTLCache
+
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_get_and_set(self):
+        cache = TTLCache(ttl=10, clock=self.clock)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=10, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 9.9
+        self.assertEqual(cache.get("a"), 1)
+        self.clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_pop(self):
+        cache = TTLCache(clock=self.clock)
+        cache.set("a", 1)
+        cache.pop("a")
+        cache.pop("missing")
+        self.assertIsNone(cache.get("a"))
@@ -1,79 +1,257 @@
-from ..utils.url import update, delete, create
+from ..utils import url
+from ..utils.circuit import CircuitBreaker
+from .stubs import ShortenerHandler, StubServer
+from ..utils.url import (
+    update,
+    delete,
+    create,
+    client,
+    track,
+    ShortenerClient,
+    TrackingUnavailable,
+    response_fields,
+)
 
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 import json
+import socket
 
-headers = {
-    "x-api-key": "oeOkrE9AOw5jsUOEpz1OIai4N0kf8c4uZj75jPh8",
-    "Content-Type": "application/json",
-}
+import requests
 
 
 class TestCreateFunction(unittest.TestCase):
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_with_long_url_and_target(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
             "shortUrl": "https://example.com/s/abc123"
         }
         result = create("https://www.example.com/very/long/url", "custom_key")
-        self.assertEqual(json.loads(result['response_json']), {"shortUrl": "https://example.com/s/abc123"})
+        self.assertEqual(result['response_json'], {"shortUrl": "https://example.com/s/abc123"})
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_with_long_url_only(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
             "shortUrl": "https://example.com/s/def456"
         }
         result = create("https://www.example.com/another/long/url", None)
-        self.assertEqual(json.loads(result['response_json']), {"shortUrl": "https://example.com/s/def456"})
+        self.assertEqual(result['response_json'], {"shortUrl": "https://example.com/s/def456"})
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_with_target_only(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
             "shortUrl": "https://example.com/s/ghi789"
         }
         result = create(None, "custom_key")
-        self.assertEqual(json.loads(result['response_json']), {"shortUrl": "https://example.com/s/ghi789"})
+        self.assertEqual(result['response_json'], {"shortUrl": "https://example.com/s/ghi789"})
 
 
 class TestDeleteFunction(unittest.TestCase):
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_delete_valid_key(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
             "message": "Key deleted successfully"
         }
         key = "valid_key"
         response = delete(key)
         mock_post.assert_called_once_with(
-            "https://api.aws3.link/remove",
-            headers=headers,
-            data=json.dumps({"key": key}),
+            f"{client.base_url}/remove",
+            data=json.dumps({"slug": key}),
+            timeout=client.timeout,
         )
-        self.assertEqual(json.loads(response['response_json']), {"message": "Key deleted successfully"})
+        self.assertEqual(response['response_json'], {"message": "Key deleted successfully"})
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_delete_invalid_key(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {"error": "Invalid key"}
         key = "invalid_key"
         response = delete(key)
         mock_post.assert_called_once_with(
-            "https://api.aws3.link/remove",
-            headers=headers,
-            data=json.dumps({"key": key}),
+            f"{client.base_url}/remove",
+            data=json.dumps({"slug": key}),
+            timeout=client.timeout,
         )
-        self.assertEqual(json.loads(response['response_json']), {"error": "Invalid key"})
+        self.assertEqual(response['response_json'], {"error": "Invalid key"})
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_response_format(self, mock_post):
+        mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
             "message": "Key deleted successfully"
         }
         key = "valid_key"
         response = delete(key)
         self.assertIsInstance(response, dict)
-        self.assertIsInstance(json.loads(response['response_json']), dict)
+        self.assertIsInstance(response['response_json'], dict)
+
+
+class TestShortenerClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = ShortenerClient(base_url="https://shortener.test", backoff=0)
+
+    @patch("requests.Session.post")
+    def test_retries_server_errors(self, mock_post):
+        error = Mock(status_code=503)
+        ok = Mock(status_code=200)
+        mock_post.side_effect = [error, ok]
+        self.assertIs(self.client.post("/track", {"slug": "abc"}), ok)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch("requests.Session.post")
+    def test_does_not_retry_client_errors(self, mock_post):
+        mock_post.return_value.status_code = 409
+        self.assertEqual(self.client.post("/shorten", {}).status_code, 409)
+        mock_post.assert_called_once()
+
+    @patch("requests.Session.post")
+    def test_raises_after_repeated_connection_errors(self, mock_post):
+        mock_post.side_effect = requests.ConnectTimeout("timed out")
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post("/track", {"slug": "abc"})
+        self.assertEqual(mock_post.call_count, self.client.retries + 1)
+
+    def test_retries_refused_connections(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]  # nothing listens once it's closed
+        client = ShortenerClient(base_url=f"http://127.0.0.1:{port}", backoff=0)
+        with patch.object(
+            client.session, "post", wraps=client.session.post
+        ) as post, self.assertRaises(requests.ConnectionError):
+            client.post("/shorten", {"customSlug": "abc"})
+        self.assertEqual(post.call_count, client.retries + 1)
+
+    def test_does_not_resend_after_connection_reset(self):
+        # the create went through upstream; sending it again would get a 409
+        with StubServer(ShortenerHandler) as server:
+            server.state["hang_up"] = True
+            client = ShortenerClient(base_url=server.url, backoff=0)
+            with self.assertRaises(requests.ConnectionError):
+                client.post("/shorten", {"customSlug": "abc", "longUrl": "x"})
+        self.assertEqual(server.calls, [("POST", "/shorten")])
+
+    @patch("requests.Session.post")
+    def test_reports_latency(self, mock_post):
+        calls = []
+        self.client.on_call = lambda *args: calls.append(args)
+        mock_post.return_value.status_code = 200
+        self.client.post("/track", {"slug": "abc"})
+        self.assertEqual(calls[0][:2], ("/track", 200))
+        self.assertGreaterEqual(self.client.last_latency, 0)
+
+    def test_session_reuses_headers(self):
+        self.assertEqual(self.client.session.headers["Content-Type"], "application/json")
+
+
+class TestTrack(unittest.TestCase):
+
+    def setUp(self):
+        breaker = patch.object(url, "track_breaker", CircuitBreaker(2, 30))
+        self.breaker = breaker.start()
+        self.addCleanup(breaker.stop)
+
+    @patch("requests.Session.post")
+    def test_returns_payload(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"totalHits": 0, "hits": []}
+        self.assertEqual(track("abc"), {"totalHits": 0, "hits": []})
+
+    @patch("requests.Session.post")
+    def test_non_json_error_page(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.side_effect = ValueError("Expecting value")
+        with self.assertRaises(TrackingUnavailable):
+            track("abc")
+
+    @patch("requests.Session.post")
+    def test_opens_after_repeated_failures(self, mock_post):
+        mock_post.side_effect = requests.ReadTimeout("timed out")
+        for _ in range(2):
+            with self.assertRaises(TrackingUnavailable):
+                track("abc")
+        with self.assertRaises(TrackingUnavailable):
+            track("abc")
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertFalse(url.tracking_available())
+
+    @patch("requests.Session.post")
+    def test_client_errors_are_not_failures(self, mock_post):
+        mock_post.return_value.status_code = 404
+        mock_post.return_value.json.return_value = {"message": "not found"}
+        for _ in range(3):
+            self.assertEqual(track("abc"), {"message": "not found"})
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    @patch("requests.Session.post")
+    def test_result_keeps_non_json_body(self, mock_post):
+        mock_post.return_value.status_code = 502
+        mock_post.return_value.json.side_effect = ValueError("Expecting value")
+        mock_post.return_value.text = "<html>Bad gateway</html>"
+        result = delete("abc")
+        self.assertEqual(
+            result["response_json"], {"message": "<html>Bad gateway</html>"}
+        )
+
+
+class TestResponseFields(unittest.TestCase):
+
+    def test_create(self):
+        self.assertEqual(
+            response_fields({"shortUrl": "https://aws3.link/abc"}, 200),
+            ("https://aws3.link/abc", ""),
+        )
+
+    def test_error(self):
+        for payload, code, error in [
+            ({"error": "Invalid key"}, 400, "Invalid key"),
+            ({"message": "Bad gateway"}, 502, "Bad gateway"),
+            ({"error": "Timed out"}, None, "Timed out"),  # no response at all
+        ]:
+            self.assertEqual(response_fields(payload, code), ("", error))
+
+    def test_message_of_success_is_not_an_error(self):
+        self.assertEqual(response_fields({"message": "Deleted"}, 200), ("", ""))
+
+    def test_update(self):
+        payload = [{"message": "Deleted"}, {"shortUrl": "https://aws3.link/abc"}]
+        self.assertEqual(response_fields(payload, 200), ("https://aws3.link/abc", ""))
+        payload = [{"message": "Deleted"}, {"error": "Key taken"}]
+        self.assertEqual(response_fields(payload, 409), ("", "Key taken"))
+        payload = [{"message": "Deleted"}, {"message": "Key taken"}]
+        self.assertEqual(response_fields(payload, 409), ("", "Key taken"))
+
+    def test_unexpected_payload(self):
+        self.assertEqual(response_fields(None, 200), ("", ""))
+        self.assertEqual(response_fields("oops", 500), ("", ""))
+
+
+class TestResolveMany(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(ShortenerHandler).__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        patcher = patch.object(url, "SHORT_URL_BASE", self.server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_redirect_targets(self):
+        self.server.state["links"] = {"a": "https://example.com/a"}
+        self.assertEqual(
+            url.resolve_many(["a", "b"], max_workers=2),
+            {"a": (301, "https://example.com/a"), "b": (404, None)},
+        )
+
+    def test_unreachable_keys(self):
+        with patch.object(url, "SHORT_URL_BASE", "http://127.0.0.1:1"):
+            self.assertEqual(url.resolve_many(["a"]), {"a": (None, None)})
 
 
 if __name__ == "__main__":
@@ -1,6 +1,13 @@
 from django.contrib import admin
 
-from .models import UrlAction
+from .models import ApiKey, OutboxItem, UrlAction
 
 # Register your models here.
 admin.site.register(UrlAction)
+admin.site.register(OutboxItem)
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = ["prefix", "user", "name", "created", "revoked_at"]
+    readonly_fields = ["prefix", "key_hash"]
@@ -1,78 +1,207 @@
+import hashlib
 import json
 import logging
-import os
 import re
 from functools import wraps
+from itertools import tee
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from django.contrib.auth.models import User
-from django.http import JsonResponse
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
-from utils.qr import gen_qr
-from utils.url import create, delete, track, update
-
-from .models import UrlAction
+from utils.qr import gen_qr, qr_image, stream_qr_pdf
+from . import keys as live_keys, outbox
+from .auth import aauthenticate, authenticate
+from .hits import hit_stats, tracking_data
+from .models import LinkState, UrlAction
 
 logger = logging.getLogger(__name__)
 
 URL_KEY_RE = re.compile(r"^[a-zA-Z0-9-]+$")
+KEY_TAKEN = "key is already taken"
+KEY_NOT_FOUND = "key not found"
+
+# page sizes for the list and history endpoints
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+BULK_MAX_OPERATIONS = 5000
+
+# QR image sizes in pixels
+QR_SIZE = 100
+QR_MIN_SIZE = 50
+QR_MAX_SIZE = 1000
+QR_CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# seconds browsers and proxies may reuse a QR image without revalidating it
+QR_MAX_AGE = 3600
+
+# most QR codes in one sticker sheet PDF
+SHEET_MAX_LABELS = 10000
+
+
+INVALID_KEY = {"error": "Invalid or missing API key"}
 
 
 def require_api_key(view_func):
+    """Reject requests without a valid X-API-Key; set request.api_user otherwise."""
+    if iscoroutinefunction(view_func):
+
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            request.api_user = await aauthenticate(request.headers.get("X-API-Key"))
+            if request.api_user is None:
+                return JsonResponse(INVALID_KEY, status=401)
+            return await view_func(request, *args, **kwargs)
+
+        return async_wrapper
+
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        api_key = os.getenv("API_KEY")
-        if not api_key:
-            return JsonResponse({"error": "API_KEY not configured on server"}, status=500)
-        provided = request.headers.get("X-API-Key", "")
-        if provided != api_key:
-            return JsonResponse({"error": "Invalid or missing API key"}, status=401)
+        request.api_user = authenticate(request.headers.get("X-API-Key"))
+        if request.api_user is None:
+            return JsonResponse(INVALID_KEY, status=401)
         return view_func(request, *args, **kwargs)
 
     return wrapper
 
 
-def _get_api_user():
-    user_id = os.getenv("API_USER_ID")
-    if user_id:
-        return User.objects.get(pk=int(user_id))
-    return User.objects.filter(is_superuser=True).first()
+def _serialize_action(action):
+    return {
+        "id": action.id,
+        "action_type": action.action_type,
+        "url_key": action.url_key,
+        "long_url": action.long_url,
+        "response_code": action.response_code,
+        "success": action.was_successfull(),
+        "status": action.status,
+        "short_url": action.short_url,
+        "error": action.error,
+        "timestamp": action.timestamp.isoformat(),
+    }
+
+
+def _page_params(request):
+    """
+    Read the `limit` and `before` query parameters of a paginated request.
+
+    `limit` defaults to PAGE_SIZE and is capped at MAX_PAGE_SIZE. `before` is
+    the cursor: only actions with a lower pk are returned. Raises ValueError
+    for malformed values.
+    """
+    limit = int(request.GET.get("limit", PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit, MAX_PAGE_SIZE)
+    before = request.GET.get("before")
+    return limit, None if before is None else int(before)
+
+
+def _page_queryset(queryset, limit, before):
+    """Order by -pk from the cursor, with one row past the page to detect a next one"""
+    # pages are serialized from the typed columns; the payloads stay unread
+    queryset = queryset.defer("response_json")
+    if before is not None:
+        queryset = queryset.filter(pk__lt=before)
+    queryset = queryset.order_by("-pk")
+    return queryset[: limit + 1]
+
+
+def _next_url(request, limit, last_pk):
+    params = request.GET.copy()
+    params["limit"] = limit
+    params["before"] = last_pk
+    return request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+
+
+def _page_open(fields, list_name):
+    """Start of a streamed page: the leading fields and the opening of the list"""
+    head = "".join(f"{json.dumps(k)}: {json.dumps(v)}, " for k, v in fields.items())
+    return "{" + head + json.dumps(list_name) + ": ["
+
+
+def _page_close(next_url):
+    return "], " + json.dumps("next") + ": " + json.dumps(next_url) + "}"
+
+
+def _stream_page(request, queryset, limit, list_name, fields=None):
+    """
+    Stream one page of serialized actions as a JSON object.
+
+    The object has `fields`, the actions under `list_name`, and `next`: the
+    URL of the following page, or null on the last one. Rows are read with
+    .iterator() so memory use doesn't grow with the size of the page.
+    """
+
+    def content():
+        yield _page_open(fields or {}, list_name)
+        count, last_pk = 0, None
+        for action in queryset.iterator(chunk_size=500):
+            if count == limit:
+                yield _page_close(_next_url(request, limit, last_pk))
+                return
+            yield ("," if count else "") + json.dumps(_serialize_action(action))
+            count, last_pk = count + 1, action.pk
+        yield _page_close(None)
+
+    return StreamingHttpResponse(content(), content_type="application/json")
+
+
+def _owned_keys(user, keys) -> set:
+    """
+    The keys among `keys` that `user` can update or delete.
+
+    A key is the user's while their latest action on it is neither a failed
+    create, e.g. of a key someone else had, nor a delete that went through.
+    """
+    return set(
+        LinkState.objects.filter(user=user, url_key__in=keys)
+        .exclude(action__action_type="create", action__status="failed")
+        .exclude(action__action_type="delete", action__status="succeeded")
+        .values_list("url_key", flat=True)
+    )
 
 
-def _save_action(result, user):
-    """Save a UrlAction from a utils.url result dict."""
-    action = UrlAction.objects.create(
-        action_type=result["action_type"],
-        long_url=result.get("long_url"),
-        response_json=result["response_json"],
-        response_code=result["response_code"],
-        url_key=result["url_key"],
+def _build_action(action_type, key, user, long_url=None):
+    """Build an unsaved UrlAction, for the outbox to carry out."""
+    return UrlAction(
+        action_type=action_type,
+        long_url=long_url,
+        url_key=key,
         user=user,
     )
-    return action
+
+
+def _queued_data(action):
+    data = _serialize_action(action)
+    if action.action_type != "delete" and not data["short_url"]:
+        data["short_url"] = f"https://aws3.link/{action.url_key}"
+    return data
+
+
+def _queued_response(action):
+    """202 response for an action left to the outbox worker."""
+    return JsonResponse(_queued_data(action), status=202)
 
 
 @csrf_exempt
 @require_api_key
 @require_http_methods(["GET", "POST"])
 def url_list(request):
-    """GET: list recent actions. POST: create a shortened URL."""
+    """GET: the user's recent actions, paginated. POST: queue a URL's creation."""
     if request.method == "GET":
-        actions = UrlAction.objects.order_by("-pk")[:50]
-        data = [
-            {
-                "id": a.id,
-                "action_type": a.action_type,
-                "url_key": a.url_key,
-                "long_url": a.long_url,
-                "response_code": a.response_code,
-                "success": a.was_successfull(),
-                "timestamp": a.timestamp.isoformat(),
-            }
-            for a in actions
-        ]
-        return JsonResponse({"results": data})
+        try:
+            limit, before = _page_params(request)
+        except ValueError:
+            return JsonResponse(
+                {"error": "limit and before must be positive integers"}, status=400
+            )
+        actions = UrlAction.objects.filter(user=request.api_user)
+        actions = _page_queryset(actions, limit, before)
+        return _stream_page(request, actions, limit, "results")
 
     # POST — create
     try:
@@ -93,59 +222,157 @@ def url_list(request):
             status=400,
         )
 
-    user = _get_api_user()
-    if not user:
-        return JsonResponse({"error": "No API user available"}, status=500)
+    if live_keys.is_taken(key):
+        return JsonResponse({"error": KEY_TAKEN}, status=409)
+
+    user = request.api_user
+    action = outbox.enqueue(_build_action("create", key, user, long_url))
+    return _queued_response(action)
+
+
+def _validate_operation(item):
+    """Return an error message for an invalid bulk operation, else None."""
+    if not isinstance(item, dict):
+        return "operation must be an object"
+    action = item.get("action")
+    if action not in ("create", "update", "delete"):
+        return "action must be one of create, update, delete"
+    key = item.get("key")
+    if not isinstance(key, str) or not key.strip():
+        return "key is required"
+    if not URL_KEY_RE.match(key.strip()):
+        return "key can only contain letters, numbers, and hyphens"
+    long_url = item.get("long_url")
+    if action != "delete" and (not isinstance(long_url, str) or not long_url.strip()):
+        return "long_url is required"
+    return None
+
+
+@csrf_exempt
+@require_api_key
+@require_http_methods(["POST"])
+def url_bulk(request):
+    """
+    POST: create, update or delete many keys at once.
+
+    Body: {"operations": [{"action": "create", "key": ..., "long_url": ...}]}.
+    Every operation is validated and the valid ones are queued for the outbox
+    worker in one transaction; invalid ones, and updates or deletes of keys
+    the user doesn't have, are reported and skipped. The response has one
+    result per operation, in order.
+    """
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return JsonResponse(
+            {"error": "operations must be a non-empty list"}, status=400
+        )
+    if len(operations) > BULK_MAX_OPERATIONS:
+        return JsonResponse(
+            {"error": f"At most {BULK_MAX_OPERATIONS} operations per request"},
+            status=400,
+        )
 
-    result = create(long_url, key)
-    action = _save_action(result, user)
+    user = request.api_user
+    results = [None] * len(operations)
+    valid = []
+    seen_keys = set()
+    taken = live_keys.taken(
+        item["key"].strip()
+        for item in operations
+        if isinstance(item, dict)
+        and item.get("action") == "create"
+        and isinstance(item.get("key"), str)
+    )
+    owned = _owned_keys(
+        user,
+        [
+            item["key"].strip()
+            for item in operations
+            if isinstance(item, dict)
+            and item.get("action") in ("update", "delete")
+            and isinstance(item.get("key"), str)
+        ],
+    )
+    for index, item in enumerate(operations):
+        error = _validate_operation(item)
+        if not error:
+            item = dict(item, key=item["key"].strip())
+            if item["action"] != "delete":
+                item["long_url"] = item["long_url"].strip()
+            if item["key"] in seen_keys:
+                error = "key appears more than once in this request"
+            elif item["action"] == "create" and item["key"] in taken:
+                error = KEY_TAKEN
+            elif item["action"] != "create" and item["key"] not in owned:
+                error = KEY_NOT_FOUND
+            seen_keys.add(item["key"])
+        if error:
+            results[index] = {"index": index, "success": False, "error": error}
+        else:
+            valid.append((index, item))
+
+    actions = outbox.enqueue_many(
+        [
+            _build_action(item["action"], item["key"], user, item.get("long_url"))
+            for _, item in valid
+        ]
+    )
+    for (index, _), action in zip(valid, actions):
+        results[index] = dict(_queued_data(action), index=index)
 
     return JsonResponse(
         {
-            "id": action.id,
-            "action_type": action.action_type,
-            "url_key": action.url_key,
-            "long_url": action.long_url,
-            "response_code": action.response_code,
-            "success": action.was_successfull(),
-            "short_url": f"https://aws3.link/{key}",
+            "results": results,
+            "queued": len(actions),
+            "rejected": len(results) - len(actions),
         },
-        status=201,
+        status=202,
     )
 
 
+@require_api_key
+@require_http_methods(["GET"])
+def key_available(request, key):
+    """Whether a key can be created, checked against the local registry only."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse(
+            {"error": "key can only contain letters, numbers, and hyphens"},
+            status=400,
+        )
+    return JsonResponse({"key": key, "available": not live_keys.is_taken(key)})
+
+
 @csrf_exempt
 @require_api_key
 @require_http_methods(["GET", "PUT", "DELETE"])
 def url_detail(request, key):
-    """GET: detail + history. PUT: update target. DELETE: delete."""
+    """GET: detail + history. PUT: queue a target update. DELETE: queue a delete."""
     if not URL_KEY_RE.match(key):
         return JsonResponse(
             {"error": "Invalid key format"}, status=400
         )
 
     if request.method == "GET":
-        actions = UrlAction.objects.filter(url_key=key).order_by("-pk")
+        try:
+            limit, before = _page_params(request)
+        except ValueError:
+            return JsonResponse(
+                {"error": "limit and before must be positive integers"}, status=400
+            )
+        actions = UrlAction.objects.filter(url_key=key, user=request.api_user)
         if not actions.exists():
             return JsonResponse({"error": "No actions found for this key"}, status=404)
-        data = [
-            {
-                "id": a.id,
-                "action_type": a.action_type,
-                "url_key": a.url_key,
-                "long_url": a.long_url,
-                "response_code": a.response_code,
-                "success": a.was_successfull(),
-                "timestamp": a.timestamp.isoformat(),
-            }
-            for a in actions
-        ]
-        return JsonResponse({"url_key": key, "history": data})
-
-    user = _get_api_user()
-    if not user:
-        return JsonResponse({"error": "No API user available"}, status=500)
+        actions = _page_queryset(actions, limit, before)
+        return _stream_page(request, actions, limit, "history", {"url_key": key})
 
+    user = request.api_user
+    if not _owned_keys(user, [key]):
+        return JsonResponse({"error": KEY_NOT_FOUND}, status=404)
     if request.method == "PUT":
         try:
             body = json.loads(request.body)
@@ -156,41 +383,12 @@ def url_detail(request, key):
         if not long_url:
             return JsonResponse({"error": "long_url is required"}, status=400)
 
-        results = update(key, long_url)
-        # update() returns [delete_result, create_result]
-        response_code = max(r["response_code"] for r in results)
-        action = UrlAction.objects.create(
-            action_type="update",
-            long_url=long_url,
-            response_json=[r["response_json"] for r in results],
-            response_code=response_code,
-            url_key=key,
-            user=user,
-        )
-        return JsonResponse(
-            {
-                "id": action.id,
-                "action_type": "update",
-                "url_key": key,
-                "long_url": long_url,
-                "response_code": response_code,
-                "success": action.was_successfull(),
-                "short_url": f"https://aws3.link/{key}",
-            }
-        )
+        action = outbox.enqueue(_build_action("update", key, user, long_url))
+        return _queued_response(action)
 
     # DELETE
-    result = delete(key)
-    action = _save_action(result, user)
-    return JsonResponse(
-        {
-            "id": action.id,
-            "action_type": "delete",
-            "url_key": key,
-            "response_code": action.response_code,
-            "success": action.was_successfull(),
-        }
-    )
+    action = outbox.enqueue(_build_action("delete", key, user))
+    return _queued_response(action)
 
 
 @require_api_key
@@ -200,10 +398,36 @@ def url_track(request, key):
     if not URL_KEY_RE.match(key):
         return JsonResponse({"error": "Invalid key format"}, status=400)
 
-    data = track(key)
+    data = tracking_data(key)
     return JsonResponse({"url_key": key, "tracking": data})
 
 
+def _stats_params(request):
+    """Read the `tz` and `top` parameters of a stats request; raise ValueError if bad"""
+    tz = request.GET.get("tz", "UTC")
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {tz}")
+    top = request.GET.get("top", "10")
+    if not top.isdigit() or not 0 < int(top) <= 100:
+        raise ValueError("top must be an integer from 1 to 100")
+    return tz, int(top)
+
+
+@require_api_key
+@require_http_methods(["GET"])
+def url_stats(request, key):
+    """Get hit analytics for a key: counts over time, peak hours, top locations."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+    try:
+        tz, top = _stats_params(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(hit_stats(key, tz=tz, top=top))
+
+
 @require_api_key
 @require_http_methods(["GET"])
 def url_qr(request, key):
@@ -213,4 +437,114 @@ def url_qr(request, key):
 
     short_url = f"https://aws3.link/{key}"
     qr_url = gen_qr(short_url)
-    return JsonResponse({"url_key": key, "short_url": short_url, "qr_url": qr_url})
+    return JsonResponse(
+        {
+            "url_key": key,
+            "short_url": short_url,
+            "qr_url": qr_url,
+            **_qr_links(request, key),
+        }
+    )
+
+
+def _qr_links(request, key):
+    return {
+        f"{fmt}_url": request.build_absolute_uri(
+            reverse(f"api_url_qr_{fmt}", args=[key])
+        )
+        for fmt in QR_CONTENT_TYPES
+    }
+
+
+@require_http_methods(["GET", "HEAD"])
+def url_qr_image(request, key, fmt):
+    """
+    Get a key's QR code as a PNG or SVG image, sized by a `size` parameter.
+
+    No API key is needed, so pages can use it in <img> tags; the image only
+    encodes the public short URL. Only keys in use get one, so the image
+    cache can't be filled with made-up keys. Images have a strong ETag, so
+    conditional requests get a 304, and may be cached for QR_MAX_AGE: a key
+    can be deleted, or its image change with QR_RENDERER. Rendered images
+    are kept in utils.qr.qr_cache.
+    """
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+    if not live_keys.is_taken(key):
+        return JsonResponse({"error": KEY_NOT_FOUND}, status=404)
+    try:
+        size = int(request.GET.get("size", QR_SIZE))
+    except ValueError:
+        return JsonResponse({"error": "size must be an integer"}, status=400)
+    size = min(max(size, QR_MIN_SIZE), QR_MAX_SIZE)
+
+    qr_url = gen_qr(f"https://aws3.link/{key}", size)
+    if fmt != "png":
+        qr_url += f"&format={fmt}"
+    data = qr_image(qr_url)
+    etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(data, content_type=QR_CONTENT_TYPES[fmt])
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={QR_MAX_AGE}"
+    return response
+
+
+def _sheet_keys(body):
+    """Read the keys of a sheet request; raise ValueError if bad"""
+    if not isinstance(body, dict):
+        raise ValueError("Body must be an object")
+    if "keys" in body:
+        keys = body["keys"]
+        if not isinstance(keys, list) or not keys:
+            raise ValueError("keys must be a non-empty list")
+        if len(keys) > SHEET_MAX_LABELS:
+            raise ValueError(f"At most {SHEET_MAX_LABELS} keys per sheet")
+        if not all(isinstance(key, str) and URL_KEY_RE.match(key) for key in keys):
+            raise ValueError("keys can only contain letters, numbers, and hyphens")
+        return keys
+    prefix, start, count = body.get("prefix"), body.get("start"), body.get("count")
+    if not isinstance(prefix, str) or not URL_KEY_RE.match(prefix):
+        raise ValueError("Give keys, or a prefix with start and count")
+    if not isinstance(start, int) or start < 0:
+        raise ValueError("start must be a non-negative integer")
+    if not isinstance(count, int) or not 0 < count <= SHEET_MAX_LABELS:
+        raise ValueError(f"count must be an integer from 1 to {SHEET_MAX_LABELS}")
+    return (f"{prefix}{i}" for i in range(start, start + count))
+
+
+def _sheet_content(keys):
+    """The sheet PDF's bytes, a page at a time, with each code labelled by its key"""
+    url_keys, descriptions = tee(keys)
+    urls = (gen_qr(f"https://aws3.link/{key}") for key in url_keys)
+    return stream_qr_pdf(urls, descriptions)
+
+
+def _sheet_response(content):
+    response = StreamingHttpResponse(content, content_type="application/pdf")
+    response["Content-Disposition"] = 'attachment; filename="qr_codes.pdf"'
+    return response
+
+
+@csrf_exempt
+@require_api_key
+@require_http_methods(["POST"])
+def url_sheet(request):
+    """
+    POST: get a printable sheet of QR codes as a PDF.
+
+    Body: {"keys": [...]}, or {"prefix": "llqrv", "start": 1, "count": 100}
+    for llqrv1 to llqrv100. Codes are laid out as by utils.qr.generate_qr_pdf
+    and the PDF is streamed a page at a time as it is laid out, so large
+    sheets start downloading at once and memory use doesn't grow with them.
+    """
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    try:
+        keys = _sheet_keys(body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return _sheet_response(_sheet_content(keys))
@@ -1,10 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
-from . import api
+from . import api, async_api
+
+# the async views only pay off when served through dynamicqr.asgi
+views = async_api if settings.ASYNC_API else api
 
 urlpatterns = [
-    path("urls/", api.url_list, name="api_url_list"),
-    path("urls/<str:key>/", api.url_detail, name="api_url_detail"),
-    path("urls/<str:key>/track/", api.url_track, name="api_url_track"),
-    path("urls/<str:key>/qr/", api.url_qr, name="api_url_qr"),
+    path("urls/", views.url_list, name="api_url_list"),
+    path("urls/bulk/", api.url_bulk, name="api_url_bulk"),
+    path("sheets/", views.url_sheet, name="api_sheet"),
+    path("keys/<str:key>/available", api.key_available, name="api_key_available"),
+    path("urls/<str:key>/", views.url_detail, name="api_url_detail"),
+    path("urls/<str:key>/track/", views.url_track, name="api_url_track"),
+    path("urls/<str:key>/stats/", views.url_stats, name="api_url_stats"),
+    path("urls/<str:key>/qr/", views.url_qr, name="api_url_qr"),
+    # public, unlike the rest of the API, so pages can embed the images
+    path(
+        "urls/<str:key>/qr.png",
+        api.url_qr_image,
+        {"fmt": "png"},
+        name="api_url_qr_png",
+    ),
+    path(
+        "urls/<str:key>/qr.svg",
+        api.url_qr_image,
+        {"fmt": "svg"},
+        name="api_url_qr_svg",
+    ),
 ]
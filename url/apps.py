@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UrlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'url'
+
+    def ready(self):
+        from . import auth  # noqa: F401 (connects the ApiKey cache signals)
+        from . import metrics  # noqa: F401 (counts queries on new connections)
@@ -0,0 +1,223 @@
+"""
+Async versions of the url.api views, for serving through dynamicqr.asgi.
+
+Tracking calls use utils.url's httpx-based async client and database access
+uses Django's async ORM, so a slow shortener call no longer ties up a worker.
+They are routed in place of the sync views when ASYNC_API is set; see
+url/api_urls.py.
+"""
+
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from utils.qr import gen_qr
+
+from . import keys as live_keys
+from .api import (
+    KEY_NOT_FOUND,
+    KEY_TAKEN,
+    URL_KEY_RE,
+    _build_action,
+    _next_url,
+    _owned_keys,
+    _page_close,
+    _page_open,
+    _page_params,
+    _page_queryset,
+    _qr_links,
+    _queued_response,
+    _serialize_action,
+    _sheet_content,
+    _sheet_keys,
+    _sheet_response,
+    _stats_params,
+    require_api_key,
+)
+from .hits import async_tracking_data, hit_stats
+from .models import UrlAction
+from .outbox import enqueue
+
+logger = logging.getLogger(__name__)
+
+aenqueue = sync_to_async(enqueue)
+
+
+def _stream_page(request, queryset, limit, list_name, fields=None):
+    """Async version of api._stream_page, reading rows with .aiterator()"""
+
+    async def content():
+        yield _page_open(fields or {}, list_name)
+        count, last_pk = 0, None
+        async for action in queryset.aiterator(chunk_size=500):
+            if count == limit:
+                yield _page_close(_next_url(request, limit, last_pk))
+                return
+            yield ("," if count else "") + json.dumps(_serialize_action(action))
+            count, last_pk = count + 1, action.pk
+        yield _page_close(None)
+
+    return StreamingHttpResponse(content(), content_type="application/json")
+
+
+@csrf_exempt
+@require_api_key
+@require_http_methods(["GET", "POST"])
+async def url_list(request):
+    """GET: the user's recent actions, paginated. POST: queue a URL's creation."""
+    if request.method == "GET":
+        try:
+            limit, before = _page_params(request)
+        except ValueError:
+            return JsonResponse(
+                {"error": "limit and before must be positive integers"}, status=400
+            )
+        actions = UrlAction.objects.filter(user=request.api_user)
+        actions = _page_queryset(actions, limit, before)
+        return _stream_page(request, actions, limit, "results")
+
+    # POST — create
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+
+    long_url = body.get("long_url", "").strip()
+    key = body.get("key", "").strip()
+
+    if not long_url:
+        return JsonResponse({"error": "long_url is required"}, status=400)
+    if not key:
+        return JsonResponse({"error": "key is required"}, status=400)
+    if not URL_KEY_RE.match(key):
+        return JsonResponse(
+            {"error": "key can only contain letters, numbers, and hyphens"},
+            status=400,
+        )
+
+    if await sync_to_async(live_keys.is_taken)(key):
+        return JsonResponse({"error": KEY_TAKEN}, status=409)
+
+    user = request.api_user
+    action = await aenqueue(_build_action("create", key, user, long_url))
+    return _queued_response(action)
+
+
+@csrf_exempt
+@require_api_key
+@require_http_methods(["GET", "PUT", "DELETE"])
+async def url_detail(request, key):
+    """GET: detail + history. PUT: queue a target update. DELETE: queue a delete."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+
+    if request.method == "GET":
+        try:
+            limit, before = _page_params(request)
+        except ValueError:
+            return JsonResponse(
+                {"error": "limit and before must be positive integers"}, status=400
+            )
+        actions = UrlAction.objects.filter(url_key=key, user=request.api_user)
+        if not await actions.aexists():
+            return JsonResponse({"error": "No actions found for this key"}, status=404)
+        actions = _page_queryset(actions, limit, before)
+        return _stream_page(request, actions, limit, "history", {"url_key": key})
+
+    user = request.api_user
+    if not await sync_to_async(_owned_keys)(user, [key]):
+        return JsonResponse({"error": KEY_NOT_FOUND}, status=404)
+    if request.method == "PUT":
+        try:
+            body = json.loads(request.body)
+        except (json.JSONDecodeError, ValueError):
+            return JsonResponse({"error": "Invalid JSON body"}, status=400)
+
+        long_url = body.get("long_url", "").strip()
+        if not long_url:
+            return JsonResponse({"error": "long_url is required"}, status=400)
+
+        action = await aenqueue(_build_action("update", key, user, long_url))
+        return _queued_response(action)
+
+    # DELETE
+    action = await aenqueue(_build_action("delete", key, user))
+    return _queued_response(action)
+
+
+@require_api_key
+@require_http_methods(["GET"])
+async def url_track(request, key):
+    """Get tracking/hit data for a key."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+
+    data = await async_tracking_data(key)
+    return JsonResponse({"url_key": key, "tracking": data})
+
+
+@require_api_key
+@require_http_methods(["GET"])
+async def url_stats(request, key):
+    """Get hit analytics for a key: counts over time, peak hours, top locations."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+    try:
+        tz, top = _stats_params(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    # the summary is CPU-bound NumPy work on top of sync ORM and geo calls
+    return JsonResponse(await sync_to_async(hit_stats)(key, tz=tz, top=top))
+
+
+@require_api_key
+@require_http_methods(["GET"])
+async def url_qr(request, key):
+    """Get QR code URL for a key."""
+    if not URL_KEY_RE.match(key):
+        return JsonResponse({"error": "Invalid key format"}, status=400)
+
+    short_url = f"https://aws3.link/{key}"
+    qr_url = gen_qr(short_url)
+    return JsonResponse(
+        {
+            "url_key": key,
+            "short_url": short_url,
+            "qr_url": qr_url,
+            **_qr_links(request, key),
+        }
+    )
+
+
+@csrf_exempt
+@require_api_key
+@require_http_methods(["POST"])
+async def url_sheet(request):
+    """
+    Async version of api.url_sheet.
+
+    Laying out and rendering is blocking work, so each page is produced on a
+    worker thread; a sync iterator would instead be read in full before
+    anything is sent.
+    """
+    try:
+        body = json.loads(request.body)
+    except (json.JSONDecodeError, ValueError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    try:
+        keys = _sheet_keys(body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    pages = _sheet_content(keys)
+    next_page = sync_to_async(next, thread_sensitive=False)
+
+    async def content():
+        while (page := await next_page(pages, None)) is not None:
+            yield page
+
+    return _sheet_response(content())
@@ -0,0 +1,59 @@
+"""
+API key authentication for the /api/ endpoints.
+
+Keys are looked up by hash in ApiKey and the key's user is cached in-process
+for API_KEY_CACHE_TTL, so most requests don't touch the database. Saving or
+deleting an ApiKey, e.g. revoking it, drops it from this process's cache;
+other processes stop accepting it once their entry expires.
+"""
+
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from utils.ttlcache import TTLCache
+
+from .models import ApiKey
+
+key_cache = TTLCache(
+    maxsize=settings.API_KEY_CACHE_SIZE,
+    ttl=settings.API_KEY_CACHE_TTL.total_seconds(),
+)
+
+
+def _lookup(key_hash: str) -> Optional[User]:
+    api_key = (
+        ApiKey.objects.select_related("user")
+        .filter(key_hash=key_hash, revoked_at__isnull=True, user__is_active=True)
+        .first()
+    )
+    if api_key is None:
+        return None
+    key_cache.set(key_hash, api_key.user)
+    return api_key.user
+
+
+def authenticate(key: str) -> Optional[User]:
+    """Return the user an API key belongs to, or None if it isn't valid"""
+    if not key:
+        return None
+    key_hash = ApiKey.hash_key(key)
+    return key_cache.get(key_hash) or _lookup(key_hash)
+
+
+async def aauthenticate(key: str) -> Optional[User]:
+    """Async version of authenticate"""
+    if not key:
+        return None
+    key_hash = ApiKey.hash_key(key)
+    return key_cache.get(key_hash) or await sync_to_async(_lookup)(key_hash)
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def _invalidate(sender, instance, **kwargs):
+    key_cache.pop(instance.key_hash)
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from utils.geo import lookup
+
+from .models import IpLocation
+
+# IPs per cache query, well within SQLite's limit on query parameters
+QUERY_CHUNK = 500
+
+
+def locate(ips: Iterable[str], max_lookups: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Get location data for IP addresses, looking up only those not cached.
+
+    Cached entries older than GEO_CACHE_TTL are looked up again. At most
+    `max_lookups` addresses (GEO_MAX_LOOKUPS_PER_REQUEST by default) are sent
+    upstream per call; the rest are left out of the result until a later call.
+    """
+    if max_lookups is None:
+        max_lookups = settings.GEO_MAX_LOOKUPS_PER_REQUEST
+    ips = list(dict.fromkeys(ips))
+    fresh_since = timezone.now() - settings.GEO_CACHE_TTL
+    locations = {}
+    for start in range(0, len(ips), QUERY_CHUNK):
+        locations.update(
+            IpLocation.objects.filter(
+                ip__in=ips[start : start + QUERY_CHUNK], updated__gte=fresh_since
+            ).values_list("ip", "data")
+        )
+    misses = [ip for ip in ips if ip not in locations][:max_lookups]
+    if misses:
+        fetched = lookup(misses)
+        IpLocation.objects.bulk_create(
+            [IpLocation(ip=ip, data=data) for ip, data in fetched.items()],
+            update_conflicts=True,
+            unique_fields=["ip"],
+            update_fields=["data", "updated"],
+        )
+        locations.update(fetched)
+    return locations
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import BigIntegerField, Func, Max
+from django.utils import timezone
+
+from utils.analytics import HitArrays, summarize
+from utils.url import (
+    TrackingUnavailable,
+    atrack,
+    track,
+    track_breaker,
+    tracking_available,
+)
+
+from .geo import locate
+from .models import Hit, HitRollup, HitSync
+
+logger = logging.getLogger(__name__)
+
+DT_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_hit(key: str, data: dict) -> Hit:
+    """Build an unsaved Hit from one entry of the upstream `hits` list"""
+    timestamp = datetime.strptime(f"{data['date']} {data['time']}", DT_FMT)
+    fingerprint = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return Hit(
+        url_key=key,
+        timestamp=timestamp.replace(tzinfo=dt_timezone.utc),
+        ip=data.get("ip", ""),
+        fingerprint=fingerprint,
+        data=data,
+    )
+
+
+class EpochSeconds(Func):
+    """Seconds since the epoch of a datetime column, computed by the database"""
+
+    output_field = BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            template="EXTRACT(EPOCH FROM %(expressions)s)::bigint",
+            **extra_context,
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            # %%%% survives both the template and the query's parameter substitution
+            template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)",
+            **extra_context,
+        )
+
+
+def _is_fresh(state: Optional[HitSync], ttl) -> bool:
+    return bool(state and state.synced_at and state.synced_at > timezone.now() - ttl)
+
+
+def _store_hits(key: str, tracking_data: dict) -> List[Hit]:
+    """
+    Add the hits in an upstream `track` payload that aren't stored yet.
+
+    Upstream always returns the full history, so only hits at or after the
+    latest stored timestamp are considered, and of those only ones not
+    already stored are added. New hits are also counted into the key's
+    HitRollup rows. Must run inside a transaction holding the key's HitSync
+    row lock, so concurrent syncs don't insert the same hits.
+    """
+    if "hits" not in tracking_data:
+        logger.warning("track(%s) returned no hits: %s", key, tracking_data)
+        return []
+
+    stored = Hit.objects.filter(url_key=key)
+    latest = stored.aggregate(latest=Max("timestamp"))["latest"]
+    hits = [parse_hit(key, data) for data in tracking_data["hits"]]
+    if latest is not None:
+        hits = [hit for hit in hits if hit.timestamp >= latest]
+        seen = Counter(
+            stored.filter(timestamp__gte=latest).values_list("fingerprint", flat=True)
+        )
+        new_hits = []
+        for hit in hits:
+            if seen[hit.fingerprint]:
+                seen[hit.fingerprint] -= 1
+            else:
+                new_hits.append(hit)
+        hits = new_hits
+
+    Hit.objects.bulk_create(hits)
+    HitRollup.add(hits)
+    HitSync.objects.filter(url_key=key).update(synced_at=timezone.now())
+    return hits
+
+
+def sync_hits(key: str, ttl=None) -> List[Hit]:
+    """
+    Fetch a key's hits from upstream if the local copy is older than `ttl`.
+
+    Syncs of the same key are serialized, so a request that waited on
+    another's sync doesn't call upstream again.
+
+    Args:
+    key (str): The url_key to sync.
+    ttl (timedelta): Maximum age of the local copy. Defaults to HIT_SYNC_TTL.
+
+    Returns:
+    list: The hits added.
+
+    Raises:
+    TrackingUnavailable: If upstream is failing; see utils.url.track.
+    """
+    if ttl is None:
+        ttl = settings.HIT_SYNC_TTL
+    if _is_fresh(HitSync.objects.filter(url_key=key).first(), ttl):
+        return []
+    if not tracking_available():
+        # don't wait on the row lock while another request's call times out
+        raise TrackingUnavailable("track is failing; not calling it for now")
+
+    with transaction.atomic():
+        state, _ = HitSync.objects.select_for_update().get_or_create(url_key=key)
+        if _is_fresh(state, ttl):
+            return []  # synced by another request while we waited
+        return _store_hits(key, track(key))
+
+
+@transaction.atomic
+def _lock_and_store_hits(key: str, tracking_data: dict) -> List[Hit]:
+    HitSync.objects.select_for_update().get_or_create(url_key=key)
+    return _store_hits(key, tracking_data)
+
+
+async def async_sync_hits(key: str, ttl=None) -> List[Hit]:
+    """
+    Async version of sync_hits.
+
+    The upstream call doesn't hold the row lock, so concurrent requests for a
+    stale key may each fetch it; storing is still serialized and deduplicated.
+    """
+    if ttl is None:
+        ttl = settings.HIT_SYNC_TTL
+    if _is_fresh(await HitSync.objects.filter(url_key=key).afirst(), ttl):
+        return []
+    payload = await atrack(key)
+    return await sync_to_async(_lock_and_store_hits)(key, payload)
+
+
+class Refresher:
+    """
+    Syncs keys in a background thread once upstream is available again.
+
+    Keys scheduled while track_breaker is open wait for it to let a trial
+    call through; a key that fails again is retried after `retry_delay`
+    seconds at the earliest. The thread exits when no keys are left.
+    """
+
+    def __init__(self, retry_delay: float = 1.0):
+        self.retry_delay = retry_delay
+        self.pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, key: str):
+        with self._lock:
+            self.pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self._thread = None
+                    return
+                key = self.pending.pop()
+            try:
+                sync_hits(key, ttl=timedelta(0))
+            except TrackingUnavailable:
+                with self._lock:
+                    self.pending.add(key)
+                time.sleep(max(track_breaker.retry_in(), self.retry_delay))
+            except Exception:
+                logger.exception("Background sync of %s failed", key)
+            finally:
+                close_old_connections()
+
+
+refresher = Refresher()
+
+
+def refresh_hits(key: str) -> bool:
+    """
+    Sync a key's hits like sync_hits, but serve the stored ones if upstream fails.
+
+    Returns:
+    bool: Whether the stored hits are current. If not, the key is synced in
+        the background once upstream recovers.
+    """
+    try:
+        sync_hits(key)
+    except TrackingUnavailable as e:
+        logger.warning("Serving stored hits of %s: %s", key, e)
+        refresher.schedule(key)
+        return False
+    return True
+
+
+async def async_refresh_hits(key: str) -> bool:
+    """Async version of refresh_hits"""
+    try:
+        await async_sync_hits(key)
+    except TrackingUnavailable as e:
+        logger.warning("Serving stored hits of %s: %s", key, e)
+        refresher.schedule(key)
+        return False
+    return True
+
+
+def tracking_data(key: str) -> dict:
+    """
+    Sync a key's hits if stale and return them in the upstream `track` shape.
+
+    Returns:
+    dict: `totalHits` and `hits`, newest first, and `stale`, true if
+        upstream failed and the stored hits were returned as they are.
+    """
+    current = refresh_hits(key)
+    hits = [
+        hit.data
+        for hit in Hit.objects.filter(url_key=key).order_by("-timestamp", "-pk")
+    ]
+    return {"totalHits": len(hits), "hits": hits, "stale": not current}
+
+
+def hit_stats(key: str, tz: str = "UTC", top: int = 10) -> dict:
+    """
+    Sync a key's hits if stale and summarize them with utils.analytics.
+
+    Hits are read as (ip, epoch seconds) rows straight from the database
+    cursor rather than as model instances, and located through url.geo like
+    DetailView does.
+    """
+    current = refresh_hits(key)
+    columns = (
+        Hit.objects.filter(url_key=key)
+        .annotate(epoch=EpochSeconds("timestamp"))
+        .values_list("ip", "epoch")  # fields come before annotations in the SQL
+    )
+    # a raw cursor skips the ORM's per-value converters
+    sql, params = columns.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ips, timestamps = list(zip(*cursor.fetchall())) or ((), ())
+    hits = HitArrays(timestamps, ips, locate(set(ips)))
+    return dict(summarize(hits, tz=tz, top=top), url_key=key, stale=not current)
+
+
+async def async_tracking_data(key: str) -> dict:
+    """Async version of tracking_data"""
+    current = await async_refresh_hits(key)
+    hits = [
+        data
+        async for data in Hit.objects.filter(url_key=key)
+        .order_by("-timestamp", "-pk")
+        .values_list("data", flat=True)
+    ]
+    return {"totalHits": len(hits), "hits": hits, "stale": not current}
@@ -0,0 +1,166 @@
+"""
+Registry of url_keys in use upstream, to refuse taken keys before calling it.
+
+LiveKey holds every key known to be live: it is written when a create or
+update is queued, when an outbox call finishes, and by reconcile. Each
+process keeps a BloomFilter of the LiveKey rows, topped up with the rows
+changed since its last look at most every KEY_FILTER_REFRESH, so a key that
+isn't taken is answered from memory; only a key that is (or is a false
+positive) costs an indexed lookup. A key taken in another process within
+the refresh interval may still reach upstream, which then refuses it as
+before.
+"""
+
+import threading
+import time
+from datetime import timedelta
+from typing import Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.bloom import BloomFilter
+
+from .models import LinkState, LiveKey, UrlAction
+
+# rows are stamped before their transaction commits, and by app servers whose
+# clocks may differ a little, so each top-up looks this far further back
+OVERLAP = timedelta(seconds=10)
+
+
+class KeyFilter:
+    """A BloomFilter of LiveKey rows, loaded on first use and topped up"""
+
+    def __init__(
+        self,
+        capacity: int = settings.KEY_FILTER_CAPACITY,
+        error_rate: float = settings.KEY_FILTER_ERROR_RATE,
+        refresh: float = settings.KEY_FILTER_REFRESH.total_seconds(),
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh = refresh
+        self.bloom: Optional[BloomFilter] = None
+        self.synced_to = None
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        bloom = BloomFilter(
+            max(self.capacity, 2 * LiveKey.objects.count()), self.error_rate
+        )
+        self.synced_to = timezone.now() - OVERLAP
+        bloom.update(
+            LiveKey.objects.values_list("url_key", flat=True).iterator(chunk_size=5000)
+        )
+        self.bloom = bloom
+
+    def _top_up(self):
+        since, self.synced_to = self.synced_to, timezone.now() - OVERLAP
+        self.bloom.update(
+            LiveKey.objects.filter(updated__gte=since).values_list(
+                "url_key", flat=True
+            )
+        )
+
+    def current(self) -> BloomFilter:
+        """The filter, loaded or topped up first if due"""
+        bloom = self.bloom
+        if bloom is not None and time.monotonic() - self.refreshed_at < self.refresh:
+            return bloom
+        # one thread refreshes; the others keep using the filter they have
+        if not self._lock.acquire(blocking=bloom is None):
+            return bloom
+        try:
+            if self.bloom is None or len(self.bloom) > self.bloom.capacity:
+                self._load()  # past capacity the false positive rate climbs
+            elif time.monotonic() - self.refreshed_at >= self.refresh:
+                self._top_up()
+            self.refreshed_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.bloom
+
+    def add(self, keys: Iterable[str]):
+        if self.bloom is not None:
+            self.bloom.update(keys)
+
+
+key_filter = KeyFilter()
+
+
+def taken(keys: Iterable[str]) -> Set[str]:
+    """The given keys that are in use upstream, as far as is known here"""
+    bloom = key_filter.current()
+    candidates = [key for key in keys if key in bloom]
+    if not candidates:
+        return set()
+    return set(
+        LiveKey.objects.filter(url_key__in=candidates).values_list("url_key", flat=True)
+    )
+
+
+def is_taken(key: str) -> bool:
+    return key in key_filter.current() and LiveKey.objects.filter(url_key=key).exists()
+
+
+def mark_live(keys: Iterable[str]):
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+    now = timezone.now()
+    LiveKey.objects.bulk_create(
+        [LiveKey(url_key=key, updated=now) for key in keys],
+        update_conflicts=True,
+        unique_fields=["url_key"],
+        update_fields=["updated"],
+    )
+    key_filter.add(keys)
+
+
+def mark_gone(keys: Iterable[str]):
+    # the filter keeps them; lookups fall through to LiveKey and miss
+    keys = list(keys)
+    if keys:
+        LiveKey.objects.filter(url_key__in=keys).delete()
+
+
+def reserve(actions: List[UrlAction]):
+    """Mark the keys of queued creates and updates live, so they aren't reused"""
+    mark_live(a.url_key for a in actions if a.action_type in ("create", "update"))
+
+
+def _held_by_others(action: UrlAction) -> bool:
+    """Whether another user's latest action on the key may leave it theirs"""
+    return (
+        LinkState.objects.filter(url_key=action.url_key)
+        .exclude(user_id=action.user_id)
+        .exclude(action__action_type="delete", action__status="succeeded")
+        # creates that failed other than as taken never had the key
+        .exclude(
+            Q(action__action_type="create", action__status="failed")
+            & ~Q(action__response_code=409)
+        )
+        .exists()
+    )
+
+
+def record(actions: List[UrlAction]):
+    """Update the registry with the outcome of finished actions"""
+    live, gone = [], []
+    for action in actions:
+        if action.status == "succeeded":
+            (gone if action.action_type == "delete" else live).append(action.url_key)
+        elif action.response_code == 409:
+            # someone else has the key
+            if action.action_type == "create" or action.target_removed:
+                live.append(action.url_key)
+        elif action.target_removed:
+            # the update removed the old target and failed to recreate it
+            gone.append(action.url_key)
+        elif action.action_type == "create" and not _held_by_others(action):
+            # it wasn't created; the key stays taken if another user has it
+            gone.append(action.url_key)
+    mark_live(live)
+    mark_gone(gone)
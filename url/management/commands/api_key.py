@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from url.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = "Create, list or revoke API keys"
+
+    def add_arguments(self, parser):
+        commands = parser.add_subparsers(dest="command", required=True)
+        create = commands.add_parser("create", help="Create a key for a user")
+        create.add_argument("username")
+        create.add_argument("--name", default="", help="What the key is for")
+        commands.add_parser("list", help="List keys")
+        revoke = commands.add_parser("revoke", help="Revoke a key")
+        revoke.add_argument("prefix", help="The key's prefix, as shown by list")
+
+    def handle(self, *args, command, **options):
+        getattr(self, f"_{command}")(**options)
+
+    def _create(self, username, name, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {username}")
+        _, key = ApiKey.generate(user, name)
+        self.stdout.write(key)
+
+    def _list(self, **options):
+        for api_key in ApiKey.objects.select_related("user").order_by("pk"):
+            status = "revoked" if api_key.revoked_at else "active"
+            self.stdout.write(
+                f"{api_key.prefix}  {api_key.user.username}  {status}  {api_key.name}"
+            )
+
+    def _revoke(self, prefix, **options):
+        api_keys = list(ApiKey.objects.filter(prefix=prefix, revoked_at__isnull=True))
+        if len(api_keys) != 1:
+            raise CommandError(f"{len(api_keys)} active keys match {prefix}")
+        api_keys[0].revoke()
+        self.stdout.write(f"Revoked {prefix}")
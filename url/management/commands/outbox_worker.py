@@ -0,0 +1,64 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+
+from url import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Make queued shortener calls and record their results"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Upstream calls in flight at once",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between checks when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no items are due instead of waiting for more",
+        )
+
+    def handle(self, *args, concurrency, poll, once, **options):
+        processed = 0
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                free = concurrency - len(in_flight)
+                if free:
+                    try:
+                        items = outbox.claim(free)
+                    except DatabaseError:
+                        # e.g. SQLite busy with a result being saved; try again
+                        logger.warning("Could not claim outbox items", exc_info=True)
+                        items = []
+                    in_flight |= {pool.submit(outbox.process, item) for item in items}
+                if not in_flight:
+                    if once:
+                        break
+                    time.sleep(poll)
+                    continue
+                done, in_flight = wait(
+                    in_flight, timeout=poll, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    processed += 1
+                    try:
+                        future.result()
+                    except Exception:
+                        # the item's lease expires and it is retried
+                        logger.exception("Outbox item could not be processed")
+        self.stdout.write(f"Made {processed} attempt(s)")
@@ -0,0 +1,123 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import URLValidator
+
+from url import keys as live_keys, outbox
+from url.models import LinkState, OutboxItem, UrlAction
+
+
+def _needs_create(state) -> bool:
+    """Whether a key with this LinkState (None if it has none) is still to create"""
+    if state is None:
+        return True
+    action = state.action
+    if action.status == "failed":
+        # tried again; keys that failed as someone else has them are skipped
+        # as taken, since LiveKey has them
+        return action.action_type == "create"
+    # a create or update that is queued or done is never repeated
+    return action.action_type == "delete" and action.status == "succeeded"
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the keys <prefix><start> to <prefix><start + count - 1> upstream,"
+        " as printed by gen_qr_range; rerun to resume an interrupted run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("prefix", help="Key prefix, e.g. llqrv")
+        parser.add_argument("start", type=int, help="First key number")
+        parser.add_argument("count", type=int, help="Number of keys")
+        parser.add_argument(
+            "--long-url", required=True, help="URL every key redirects to"
+        )
+        parser.add_argument(
+            "--user", required=True, help="Username the actions are recorded for"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Upstream calls in flight at once",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Keys queued and recorded per database round trip",
+        )
+
+    def handle(
+        self,
+        *args,
+        prefix,
+        start,
+        count,
+        long_url,
+        user,
+        concurrency,
+        batch_size,
+        **options,
+    ):
+        try:
+            URLValidator()(long_url)
+        except ValidationError:
+            raise CommandError(f"Not a valid URL: {long_url}")
+        try:
+            user = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {user}")
+
+        keys = [f"{prefix}{n}" for n in range(start, start + count)]
+        queued = created = failed = taken = left = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i : i + batch_size]
+            states = {
+                state.url_key: state
+                for state in LinkState.objects.select_related("action").filter(
+                    user=user, url_key__in=batch
+                )
+            }
+            todo = [key for key in batch if _needs_create(states.get(key))]
+            # in use by someone else; upstream would only refuse them
+            other = live_keys.taken(todo)
+            taken += len(other)
+            # queued and committed before any call is made, so an interrupted
+            # run leaves them in the outbox rather than half-recorded
+            actions = outbox.enqueue_many(
+                [
+                    UrlAction(
+                        action_type="create", long_url=long_url, url_key=key, user=user
+                    )
+                    for key in todo
+                    if key not in other
+                ]
+            )
+            queued += len(actions)
+            # includes items queued by an earlier, interrupted run
+            items = outbox.claim(
+                len(batch), action__user=user, action__url_key__in=batch
+            )
+            outbox.process_many(items, concurrency)
+            left += OutboxItem.objects.filter(
+                action__user=user, action__url_key__in=batch
+            ).count()
+            created += sum(item.action.status == "succeeded" for item in items)
+            failed += sum(item.action.status == "failed" for item in items)
+            self.stdout.write(
+                f"{min(i + batch_size, len(keys))}/{len(keys)} keys:"
+                f" {created} created, {failed} failed"
+            )
+
+        self.stdout.write(
+            f"Queued {queued} key(s); {created} created, {failed} failed."
+            f" Skipped {taken} taken by others and"
+            f" {len(keys) - queued - taken} existing or queued before."
+        )
+        if left:
+            self.stdout.write(
+                f"{left} call(s) will be retried by outbox_worker, or rerun to retry"
+                " those that are due."
+            )
@@ -0,0 +1,114 @@
+from django.core.management.base import BaseCommand
+
+from url import keys as live_keys, outbox
+from url.models import OutboxItem, UrlAction
+from utils.url import resolve_many, target_url
+
+# what to queue to make upstream match the latest successful action
+REPAIRS = {"missing": "create", "mismatched": "update", "orphaned": "delete"}
+LIVE = (301, 302, 307, 308)
+GONE = (404, 410)
+
+
+def _latest_successful(keys=None):
+    """The latest successful UrlAction of each key, across users, by key"""
+    actions = UrlAction.objects.filter(status="succeeded").only(
+        "action_type", "long_url", "url_key", "user_id"
+    )
+    if keys:
+        actions = actions.filter(url_key__in=keys)
+    latest = {}
+    # the (url_key, -id) index serves this order
+    for action in actions.order_by("url_key", "-id").iterator(chunk_size=2000):
+        latest.setdefault(action.url_key, action)
+    return latest
+
+
+def _check(action: UrlAction, status, location) -> str:
+    """How upstream's answer for a key compares with its latest successful action"""
+    live = status in LIVE
+    if not live and status not in GONE:
+        return "unreachable"  # no answer, an error or throttled; try again later
+    if action.action_type == "delete":
+        return "orphaned" if live else "ok"
+    if not live:
+        return "missing"
+    if location in (target_url(action.long_url), action.long_url):
+        return "ok"
+    return "mismatched"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare what aws3.link serves for each key with its latest successful"
+        " action, and report or repair the differences"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "keys", nargs="*", help="url_keys to check; defaults to every key"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=32,
+            help="Short links requested at once",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Keys probed, and repairs queued, per batch",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Queue the actions that fix each difference in the outbox",
+        )
+
+    def handle(self, *args, keys, concurrency, batch_size, repair, **options):
+        latest = _latest_successful(keys)
+        # the outbox will change these anyway, so their state is not settled
+        queued = set(
+            OutboxItem.objects.values_list("action__url_key", flat=True).distinct()
+        )
+        to_check = [key for key in latest if key not in queued]
+        counts = {}
+        repaired = 0
+        for i in range(0, len(to_check), batch_size):
+            batch = to_check[i : i + batch_size]
+            repairs = []
+            resolved = resolve_many(batch, concurrency)
+            # what upstream serves is the best word on which keys are taken
+            statuses = {key: status for key, (status, _) in resolved.items()}
+            live_keys.mark_gone(k for k, status in statuses.items() if status in GONE)
+            live_keys.mark_live(k for k, status in statuses.items() if status in LIVE)
+            for key, (status, location) in resolved.items():
+                action = latest[key]
+                result = _check(action, status, location)
+                counts[result] = counts.get(result, 0) + 1
+                if result == "ok":
+                    continue
+                self.stdout.write(
+                    f"{result}\t{key}\texpected {action.action_type}"
+                    f" {action.long_url or ''}\tgot {status} {location or ''}"
+                )
+                if repair and result in REPAIRS:
+                    repairs.append(
+                        UrlAction(
+                            action_type=REPAIRS[result],
+                            long_url=None if result == "orphaned" else action.long_url,
+                            url_key=key,
+                            user_id=action.user_id,
+                        )
+                    )
+            repaired += len(outbox.enqueue_many(repairs))
+            self.stderr.write(f"Checked {i + len(batch)}/{len(to_check)} keys")
+
+        summary = ", ".join(f"{n} {result}" for result, n in sorted(counts.items()))
+        self.stdout.write(
+            f"Checked {len(to_check)} key(s): {summary or 'nothing to check'};"
+            f" skipped {len(latest) - len(to_check)} with queued actions"
+        )
+        if repair:
+            self.stdout.write(f"Queued {repaired} repair(s) for outbox_worker")
@@ -0,0 +1,61 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from url.hits import sync_hits
+from url.models import LinkState
+from utils.url import TrackingUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def _sync(key: str, ttl: timedelta) -> int:
+    close_old_connections()
+    try:
+        return len(sync_hits(key, ttl=ttl))
+    except TrackingUnavailable as e:
+        logger.warning("Could not sync hits of %s: %s", key, e)
+        return 0
+    except Exception:
+        logger.exception("Could not sync hits of %s", key)
+        return 0
+
+
+class Command(BaseCommand):
+    help = "Fetch new hits from upstream, keeping the traffic rollups current"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "keys", nargs="*", help="url_keys to sync; defaults to every live key"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Upstream calls in flight at once",
+        )
+        parser.add_argument(
+            "--ttl",
+            type=int,
+            default=0,
+            help="Skip keys synced within this many seconds",
+        )
+
+    def handle(self, *args, keys, concurrency, ttl, **options):
+        if not keys:
+            keys = (
+                LinkState.objects.filter(
+                    action__action_type__in=["create", "update"],
+                    action__status="succeeded",
+                )
+                .values_list("url_key", flat=True)
+                .distinct()
+            )
+        keys = list(keys)
+        ttl = timedelta(seconds=ttl)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            added = sum(pool.map(lambda key: _sync(key, ttl), keys))
+        self.stdout.write(f"Added {added} hit(s) across {len(keys)} key(s)")
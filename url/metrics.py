@@ -0,0 +1,131 @@
+"""
+Request and database metrics, and the /metrics endpoint that exposes them.
+
+MetricsMiddleware times each request by view name and counts the database
+queries it makes; upstream calls are counted where they are made, in utils.
+The values are kept by utils.metrics, which adds up every worker's.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_http_methods
+
+from utils.metrics import registry
+
+requests_total = registry.counter(
+    "dynamicqr_http_requests_total", "Requests served, by view, method and status"
+)
+request_seconds = registry.histogram(
+    "dynamicqr_http_request_duration_seconds",
+    "Time to produce a response, by view; streamed bodies are not included",
+)
+db_queries = registry.counter(
+    "dynamicqr_db_queries_total", "Database queries made, by view"
+)
+db_seconds = registry.counter(
+    "dynamicqr_db_query_seconds_total", "Time spent in database queries, by view"
+)
+
+# [queries, seconds] of the request being served; a context variable, so it
+# follows the request into sync_to_async threads
+_db_stats: ContextVar[Optional[list]] = ContextVar("db_stats", default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _db_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.monotonic() - start
+
+
+@receiver(connection_created)
+def _install_query_counter(sender, connection, **kwargs):
+    # wrappers outlive reconnects, so only add it once per connection object
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _view_name(request) -> str:
+    match = request.resolver_match
+    return (match.view_name or match._func_path) if match else "unmatched"
+
+
+class MetricsMiddleware:
+    """Record each request's latency, status and database queries by view"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = self._stop(token)
+        self._record(request, response, start, stats)
+        return response
+
+    async def __acall__(self, request):
+        start, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats = self._stop(token)
+        self._record(request, response, start, stats)
+        return response
+
+    @staticmethod
+    def _start():
+        return time.monotonic(), _db_stats.set([0, 0.0])
+
+    @staticmethod
+    def _stop(token) -> list:
+        stats = _db_stats.get()
+        _db_stats.reset(token)
+        return stats
+
+    @staticmethod
+    def _record(request, response, start: float, stats: list):
+        view = _view_name(request)
+        requests_total.inc(
+            view=view, method=request.method, status=response.status_code
+        )
+        request_seconds.observe(time.monotonic() - start, view=view)
+        if stats[0]:
+            db_queries.inc(stats[0], view=view)
+            db_seconds.inc(stats[1], view=view)
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    Every worker's metrics in the Prometheus text format.
+
+    Scrapers must send METRICS_TOKEN as a bearer token; with no token set,
+    the endpoint is closed.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
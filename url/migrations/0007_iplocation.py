@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-17 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0006_urlaction_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IpLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.CharField(max_length=45, unique=True)),
+                ('data', models.JSONField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
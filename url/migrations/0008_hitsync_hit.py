@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-17 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0007_iplocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HitSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100, unique=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Hit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField()),
+                ('ip', models.CharField(blank=True, max_length=45)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['url_key', 'timestamp'], name='url_hit_url_key_8223af_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.0.2 on 2026-10-17 12:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_link_state(apps, schema_editor):
+    UrlAction = apps.get_model("url", "UrlAction")
+    LinkState = apps.get_model("url", "LinkState")
+    states = []
+    previous = None
+    actions = UrlAction.objects.order_by(
+        "user_id", "url_key", "-timestamp", "-pk"
+    ).values_list("pk", "user_id", "url_key", "timestamp")
+    for pk, user_id, url_key, timestamp in actions.iterator():
+        if (user_id, url_key) == previous:
+            continue
+        previous = (user_id, url_key)
+        states.append(
+            LinkState(
+                user_id=user_id, url_key=url_key, action_id=pk, timestamp=timestamp
+            )
+        )
+    LinkState.objects.bulk_create(states, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0008_hitsync_hit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='urlaction',
+            index=models.Index(fields=['user', 'url_key', '-timestamp'], name='url_urlacti_user_id_0e1fa1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='urlaction',
+            index=models.Index(fields=['user', 'url_key', 'long_url', '-timestamp'], name='url_urlacti_user_id_ebc2d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='urlaction',
+            index=models.Index(fields=['url_key', '-id'], name='url_urlacti_url_key_11343c_idx'),
+        ),
+        migrations.AddField(
+            model_name='linkstate',
+            name='action',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='link_state', to='url.urlaction'),
+        ),
+        migrations.AddField(
+            model_name='linkstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='linkstate',
+            constraint=models.UniqueConstraint(fields=('user', 'url_key'), name='unique_link_state_per_user_key'),
+        ),
+        migrations.RunPython(backfill_link_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-17 12:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def set_status(apps, schema_editor):
+    # earlier actions were carried out before they were saved
+    UrlAction = apps.get_model("url", "UrlAction")
+    UrlAction.objects.filter(response_code=200).update(status="succeeded")
+    UrlAction.objects.exclude(response_code=200).update(status="failed")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0009_linkstate_and_urlaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlaction',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='OutboxItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('action', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_item', to='url.urlaction')),
+            ],
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+    ]
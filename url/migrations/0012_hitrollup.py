@@ -0,0 +1,51 @@
+# Generated by Django 5.0.2 on 2026-10-17 12:37
+
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def backfill_hit_rollups(apps, schema_editor):
+    Hit = apps.get_model("url", "Hit")
+    HitRollup = apps.get_model("url", "HitRollup")
+    for period, trunc in (("hour", TruncHour), ("day", TruncDay)):
+        counts = (
+            Hit.objects.annotate(start=trunc("timestamp", tzinfo=timezone.utc))
+            .values("url_key", "start")
+            .annotate(hits=Count("pk"))
+            .order_by()
+        )
+        HitRollup.objects.bulk_create(
+            (HitRollup(period=period, **row) for row in counts.iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0011_apikey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'start'], name='url_hitroll_period_9829b5_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hitrollup',
+            constraint=models.UniqueConstraint(fields=('url_key', 'period', 'start'), name='unique_hit_rollup'),
+        ),
+        migrations.RunPython(backfill_hit_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-17 13:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_live_keys(apps, schema_editor):
+    """Keys whose latest action that didn't fail, by any user, isn't a delete"""
+    UrlAction = apps.get_model("url", "UrlAction")
+    LiveKey = apps.get_model("url", "LiveKey")
+    latest = {}
+    actions = (
+        UrlAction.objects.exclude(status="failed")
+        .order_by("url_key", "-id")
+        .values_list("url_key", "action_type")
+    )
+    for url_key, action_type in actions.iterator(chunk_size=2000):
+        latest.setdefault(url_key, action_type)
+    LiveKey.objects.bulk_create(
+        (
+            LiveKey(url_key=url_key)
+            for url_key, action_type in latest.items()
+            if action_type != "delete"
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0012_hitrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100, unique=True)),
+                ('updated', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(backfill_live_keys, migrations.RunPython.noop),
+    ]
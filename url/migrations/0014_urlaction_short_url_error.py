@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-17 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0013_livekey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlaction',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='urlaction',
+            name='short_url',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+    ]
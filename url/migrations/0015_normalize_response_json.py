@@ -0,0 +1,75 @@
+# Generated by Django 5.0.2 on 2026-10-17 13:20
+
+import json
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def _decode(value):
+    """Undo the json.dumps payloads were stored with before being put in a JSONField"""
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _fields(payload, response_code):
+    # a copy of utils.url.response_fields as of this migration
+    payloads = payload if isinstance(payload, list) else [payload]
+    payloads = [data for data in payloads if isinstance(data, dict)]
+    short_url = next((d["shortUrl"] for d in payloads if d.get("shortUrl")), "")
+    if response_code == 200 or not payloads:
+        return short_url, ""
+    error = next((d["error"] for d in payloads if d.get("error")), None)
+    return short_url, str(error or payloads[-1].get("message") or "")
+
+
+def normalize_responses(apps, schema_editor):
+    """
+    Store each payload parsed and fill short_url and error from it.
+
+    Runs in batches by pk, each committed on its own, so an interrupted run
+    can be started again: rows already done are skipped or left unchanged.
+    """
+    UrlAction = apps.get_model("url", "UrlAction")
+    actions = UrlAction.objects.filter(
+        short_url="", error="", response_json__isnull=False
+    ).only("response_code", "response_json")
+    last_pk = 0
+    while True:
+        batch = list(actions.filter(pk__gt=last_pk).order_by("pk")[:BATCH_SIZE])
+        if not batch:
+            break
+        changed = []
+        for action in batch:
+            payload = _decode(action.response_json)
+            short_url, error = _fields(payload, action.response_code)
+            if payload != action.response_json or short_url or error:
+                action.response_json = payload
+                action.short_url = short_url[:200]
+                action.error = error[:500]
+                changed.append(action)
+        with transaction.atomic():
+            UrlAction.objects.bulk_update(
+                changed, ["response_json", "short_url", "error"]
+            )
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # each batch commits separately (see normalize_responses)
+    atomic = False
+
+    dependencies = [
+        ('url', '0014_urlaction_short_url_error'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_responses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.2 on 2026-10-17 13:27
+
+import django.db.models.deletion
+import url.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_target_state(apps, schema_editor):
+    UrlAction = apps.get_model("url", "UrlAction")
+    TargetState = apps.get_model("url", "TargetState")
+    latest = {}
+    actions = UrlAction.objects.order_by("-timestamp", "-pk").values_list(
+        "pk", "user_id", "url_key", "long_url", "timestamp"
+    )
+    for pk, user_id, url_key, long_url, timestamp in actions.iterator(chunk_size=2000):
+        # a null long_url is stored as "", so keep the newest of the two
+        latest.setdefault((user_id, url_key, long_url or ""), (pk, timestamp))
+    TargetState.objects.bulk_create(
+        (
+            TargetState(
+                user_id=user_id,
+                url_key=url_key,
+                long_url=long_url,
+                action_id=pk,
+                timestamp=timestamp,
+            )
+            for (user_id, url_key, long_url), (pk, timestamp) in latest.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url', '0015_normalize_response_json'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_key', models.CharField(max_length=100)),
+                ('long_url', models.CharField(blank=True, default='', max_length=400)),
+                ('timestamp', models.DateTimeField()),
+                ('action', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='target_state', to='url.urlaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            bases=(url.models.LatestAction, models.Model),
+        ),
+        migrations.AddConstraint(
+            model_name='targetstate',
+            constraint=models.UniqueConstraint(fields=('user', 'url_key', 'long_url'), name='unique_target_state_per_user_key_url'),
+        ),
+        migrations.RunPython(backfill_target_state, migrations.RunPython.noop),
+    ]
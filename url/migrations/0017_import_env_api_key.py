@@ -0,0 +1,46 @@
+# Generated by Django 5.0.2 on 2026-10-17 15:40
+
+import hashlib
+import os
+
+from django.db import migrations
+
+
+def import_env_api_key(apps, schema_editor):
+    """
+    Keep the key from the API_KEY environment variable working.
+
+    Before per-user keys, the API accepted that one key and recorded actions
+    against API_USER_ID, or else the first superuser. The key is saved as an
+    ApiKey of that user, so existing clients carry on unchanged.
+    """
+    key = os.getenv("API_KEY")
+    if not key:
+        return
+    ApiKey = apps.get_model("url", "ApiKey")
+    User = apps.get_model("auth", "User")
+    key_hash = hashlib.sha256(key.encode()).hexdigest()
+    if ApiKey.objects.filter(key_hash=key_hash).exists():
+        return
+    user_id = os.getenv("API_USER_ID")
+    if user_id:
+        user = User.objects.filter(pk=int(user_id)).first()
+    else:
+        user = User.objects.filter(is_superuser=True).order_by("pk").first()
+    if user is None:
+        return
+    ApiKey.objects.create(
+        user=user, name="API_KEY", prefix=key[:11], key_hash=key_hash
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('url', '0016_targetstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_env_api_key, migrations.RunPython.noop),
+    ]
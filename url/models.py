@@ -1,6 +1,13 @@
+import hashlib
+import json
+import secrets
+from collections import Counter
+
 from django.db import models
 from django.urls import reverse
-from utils.qr import gen_qr
+from django.utils import timezone
+
+from utils.url import response_fields
 
 
 class UrlAction(models.Model):
@@ -9,6 +16,11 @@ class UrlAction(models.Model):
         ("update", "Update"),
         ("delete", "Delete"),
     )
+    STATUSES = (
+        ("pending", "Pending"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    )
     action_type = models.CharField(
         max_length=10, choices=ACTION_TYPES, blank=False, null=False
     )
@@ -18,13 +30,56 @@ class UrlAction(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     url_key = models.CharField(max_length=100, blank=False, null=False, default="")
     user = models.ForeignKey("auth.User", on_delete=models.CASCADE)
+    # pending until the outbox worker has made the upstream call (see url/outbox.py)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    # pulled out of response_json, so lists can leave the payload unread
+    short_url = models.CharField(max_length=200, blank=True, default="")
+    error = models.CharField(max_length=500, blank=True, default="")
+    # not stored: set by url.outbox on a finished update whose old target was
+    # removed upstream, for url.keys to tell if the key is still in use
+    target_removed = False
+
+    class Meta:
+        indexes = [
+            # latest action per key (MostRecentView) and per target (AllView,
+            # DetailView history), per user
+            models.Index(fields=["user", "url_key", "-timestamp"]),
+            models.Index(fields=["user", "url_key", "long_url", "-timestamp"]),
+            # history of a key (api.url_detail, filtered to its user)
+            models.Index(fields=["url_key", "-id"]),
+        ]
 
     def __str__(self):
         return f"{self.action_type} ({self.id}): {self.url_key}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # saving some fields, e.g. the outbox recording a result, moves no state
+        if adding or kwargs.get("update_fields") is None:
+            self.refresh_states([self])
+
+    @staticmethod
+    def refresh_states(actions):
+        """Point LinkState and TargetState at the newest of `actions`"""
+        LinkState.refresh(actions)
+        TargetState.refresh(actions)
+
     def was_successfull(self):
         return self.response_code == 200
 
+    def set_response(self, response_code, response_json):
+        """Record an upstream response, unsaved, with the fields it carries"""
+        self.response_code = response_code
+        self.response_json = response_json
+        short_url, error = response_fields(response_json, response_code)
+        self.short_url = short_url[:200]
+        self.error = error[:500]
+
+    @property
+    def response_text(self):
+        return json.dumps(self.response_json)
+
     def get_absolute_url(self):
         return reverse("detail", kwargs={"pk": self.pk})
 
@@ -37,8 +92,305 @@ class UrlAction(models.Model):
 
     @property
     def qr_url(self):
-        return gen_qr(f"https://aws3.link/{self.url_key}")
+        """QR code image served by api.url_qr_image"""
+        return reverse("api_url_qr_png", kwargs={"key": self.url_key})
 
     @property
     def qr_url_small(self):
-        return gen_qr(f"https://aws3.link/{self.url_key}", 70)
+        return self.qr_url + "?size=70"
+
+
+class LatestAction:
+    """
+    Mixin for tables holding the latest UrlAction per combination of fields.
+
+    `combo_fields` are the attnames of the fields, which a unique constraint
+    covers, and `combo` reads them off an action or a row of the table.
+    """
+
+    combo_fields = ("user_id", "url_key")
+
+    @staticmethod
+    def combo(obj) -> tuple:
+        return obj.user_id, obj.url_key
+
+    @classmethod
+    def refresh(cls, actions):
+        """Point each combination in `actions` at its newest action"""
+        latest = {}
+        for action in actions:
+            combo = cls.combo(action)
+            if combo not in latest or (action.timestamp, action.pk) > (
+                latest[combo].timestamp,
+                latest[combo].pk,
+            ):
+                latest[combo] = action
+        if not latest:
+            return
+        current = {
+            cls.combo(state): (state.timestamp, state.action_id)
+            for state in cls.objects.filter(
+                user_id__in={combo[0] for combo in latest},
+                url_key__in={combo[1] for combo in latest},
+            )
+        }
+        cls.objects.bulk_create(
+            [
+                cls(
+                    **dict(zip(cls.combo_fields, combo)),
+                    action=action,
+                    timestamp=action.timestamp,
+                )
+                for combo, action in latest.items()
+                if combo not in current
+                or (action.timestamp, action.pk) >= current[combo]
+            ],
+            update_conflicts=True,
+            unique_fields=[cls._meta.get_field(f).name for f in cls.combo_fields],
+            update_fields=["action", "timestamp"],
+        )
+
+
+class LinkState(LatestAction, models.Model):
+    """
+    The latest UrlAction for each of a user's url_keys.
+
+    Kept up to date by UrlAction.save; code that bulk creates actions must
+    call UrlAction.refresh_states itself.
+    """
+
+    user = models.ForeignKey("auth.User", on_delete=models.CASCADE)
+    url_key = models.CharField(max_length=100)
+    action = models.OneToOneField(
+        UrlAction, on_delete=models.CASCADE, related_name="link_state"
+    )
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "url_key"], name="unique_link_state_per_user_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.url_key}: {self.action_id}"
+
+
+class TargetState(LatestAction, models.Model):
+    """
+    The latest UrlAction for each target of each of a user's url_keys.
+
+    Serves AllView's one row per (url_key, long_url); kept like LinkState.
+    Actions without a long_url, i.e. deletes, are stored under "".
+    """
+
+    combo_fields = ("user_id", "url_key", "long_url")
+
+    user = models.ForeignKey("auth.User", on_delete=models.CASCADE)
+    url_key = models.CharField(max_length=100)
+    long_url = models.CharField(max_length=400, blank=True, default="")
+    action = models.OneToOneField(
+        UrlAction, on_delete=models.CASCADE, related_name="target_state"
+    )
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "url_key", "long_url"],
+                name="unique_target_state_per_user_key_url",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.url_key} -> {self.long_url}: {self.action_id}"
+
+    @staticmethod
+    def combo(obj) -> tuple:
+        return obj.user_id, obj.url_key, obj.long_url or ""
+
+
+class OutboxItem(models.Model):
+    """
+    An upstream call still to be made for a UrlAction.
+
+    Written in the same transaction as its action and deleted once the
+    action's result is saved; see url/outbox.py.
+    """
+
+    action = models.OneToOneField(
+        UrlAction, on_delete=models.CASCADE, related_name="outbox_item"
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    # when the item is next due; pushed forward while a worker holds it
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.action} (attempts: {self.attempts})"
+
+
+class LiveKey(models.Model):
+    """
+    A url_key known to be in use upstream, by any user.
+
+    Kept by url.keys from queued and finished actions and from reconcile, so
+    taken keys can be refused without calling the shortener.
+    """
+
+    url_key = models.CharField(max_length=100, unique=True)
+    # when the row was last written; url.keys reads rows changed since its last look
+    updated = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.url_key
+
+
+class ApiKey(models.Model):
+    """
+    A key for the /api/ endpoints, acting as its user.
+
+    Only a SHA-256 hash of the key is stored; keys are long random tokens, so
+    a slow password hash isn't needed. `prefix` identifies a key without
+    revealing it.
+    """
+
+    user = models.ForeignKey("auth.User", on_delete=models.CASCADE)
+    name = models.CharField(max_length=100, blank=True, default="")
+    prefix = models.CharField(max_length=12)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.prefix}... ({self.user})"
+
+    @staticmethod
+    def hash_key(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def generate(cls, user, name: str = ""):
+        """Create a key for `user`; return it and the key, which is shown only once"""
+        key = "dq_" + secrets.token_urlsafe(32)
+        api_key = cls.objects.create(
+            user=user, name=name, prefix=key[:11], key_hash=cls.hash_key(key)
+        )
+        return api_key, key
+
+    def revoke(self):
+        self.revoked_at = timezone.now()
+        self.save(update_fields=["revoked_at"])
+
+
+class IpLocation(models.Model):
+    """Cached ip-api.com lookup for an IP address seen in tracking data"""
+
+    ip = models.CharField(max_length=45, unique=True)
+    data = models.JSONField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.ip
+
+
+class Hit(models.Model):
+    """A visit to a short URL, copied from the upstream tracking data"""
+
+    url_key = models.CharField(max_length=100)
+    timestamp = models.DateTimeField()
+    ip = models.CharField(max_length=45, blank=True)
+    # hash of the upstream payload, to tell new hits from ones already stored
+    fingerprint = models.CharField(max_length=40)
+    data = models.JSONField()
+
+    class Meta:
+        indexes = [models.Index(fields=["url_key", "timestamp"])]
+
+    def __str__(self):
+        return f"{self.url_key} @ {self.timestamp}"
+
+
+class HitSync(models.Model):
+    """When the hits of a url_key were last fetched from upstream"""
+
+    url_key = models.CharField(max_length=100, unique=True)
+    synced_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.url_key} synced at {self.synced_at}"
+
+
+class HitRollup(models.Model):
+    """
+    Number of hits of a url_key per UTC hour or day.
+
+    Added to by HitRollup.add as hits are stored, so dashboards can read
+    these rows instead of the raw hits.
+    """
+
+    HOUR = "hour"
+    DAY = "day"
+    PERIOD_CHOICES = [(HOUR, "Hour"), (DAY, "Day")]
+
+    url_key = models.CharField(max_length=100)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["url_key", "period", "start"], name="unique_hit_rollup"
+            )
+        ]
+        indexes = [models.Index(fields=["period", "start"])]
+
+    def __str__(self):
+        return f"{self.url_key} {self.period} of {self.start}: {self.hits}"
+
+    @staticmethod
+    def bucket(period: str, timestamp):
+        """Start of the hour or day `timestamp` falls in"""
+        start = timestamp.replace(minute=0, second=0, microsecond=0)
+        return start.replace(hour=0) if period == HitRollup.DAY else start
+
+    @classmethod
+    def add(cls, hits):
+        """
+        Count newly stored `hits` into their hour and day rows.
+
+        Must run under the HitSync row lock of the hits' url_keys, like
+        hits._store_hits, so concurrent syncs don't lose counts.
+        """
+        counts = Counter(
+            (hit.url_key, period, cls.bucket(period, hit.timestamp))
+            for hit in hits
+            for period in (cls.HOUR, cls.DAY)
+        )
+        if not counts:
+            return
+        current = {
+            (rollup.url_key, rollup.period, rollup.start): rollup.hits
+            for rollup in cls.objects.filter(
+                url_key__in={url_key for url_key, _, _ in counts},
+                start__gte=min(start for _, _, start in counts),
+                start__lte=max(start for _, _, start in counts),
+            )
+        }
+        cls.objects.bulk_create(
+            [
+                cls(
+                    url_key=url_key,
+                    period=period,
+                    start=start,
+                    hits=current.get((url_key, period, start), 0) + count,
+                )
+                for (url_key, period, start), count in counts.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["url_key", "period", "start"],
+            update_fields=["hits"],
+        )
@@ -0,0 +1,193 @@
+"""
+Transactional outbox for shortener calls.
+
+Views save a UrlAction as pending together with an OutboxItem, in one
+transaction, and return straight away. The `outbox_worker` management command
+claims due items, makes the upstream call(s) and saves the result on the
+action. Transient failures (connection errors, timeouts, 429 and 5xx
+responses) are retried with exponential backoff until OUTBOX_MAX_ATTEMPTS.
+"""
+
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from utils.url import create, delete, update
+
+from . import keys
+from .models import OutboxItem, UrlAction
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient(response_code) -> bool:
+    return response_code is None or response_code == 429 or response_code >= 500
+
+
+def enqueue(action: UrlAction) -> UrlAction:
+    """Save a pending action and queue its upstream call"""
+    action.status = "pending"
+    with transaction.atomic():
+        action.save()
+        OutboxItem.objects.create(action=action)
+        keys.reserve([action])
+    return action
+
+
+def enqueue_many(actions: List[UrlAction]) -> List[UrlAction]:
+    """Bulk version of enqueue; sets primary keys on the given actions"""
+    for action in actions:
+        action.status = "pending"
+    with transaction.atomic():
+        actions = UrlAction.objects.bulk_create(actions)
+        UrlAction.refresh_states(actions)
+        OutboxItem.objects.bulk_create([OutboxItem(action=a) for a in actions])
+        keys.reserve(actions)
+    return actions
+
+
+def claim(batch_size: int, **filters) -> List[OutboxItem]:
+    """
+    Take up to `batch_size` due items for this worker.
+
+    Claimed items are leased for OUTBOX_LEASE, so if the worker dies they
+    become due again and another worker picks them up. Rows locked by
+    another worker's claim are skipped rather than waited on. An item waits
+    while an earlier item for the same url_key is queued or in flight.
+    `filters` narrow the items claimed, e.g. to some actions.
+    """
+    now = timezone.now()
+    # calls for a key are made one at a time, in the order they were queued
+    earlier = OutboxItem.objects.filter(
+        action__url_key=OuterRef("action__url_key"), pk__lt=OuterRef("pk")
+    )
+    with transaction.atomic():
+        items = list(
+            OutboxItem.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("action")
+            .filter(next_attempt_at__lte=now, **filters)
+            .filter(~Exists(earlier))
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboxItem.objects.filter(pk__in=[item.pk for item in items]).update(
+            next_attempt_at=now + settings.OUTBOX_LEASE
+        )
+    return items
+
+
+def perform(action: UrlAction, retrying: bool = False) -> Tuple[int, object]:
+    """
+    Make the upstream call(s) for an action; return the response code and JSON.
+
+    For an update, also sets action.target_removed: whether the delete of
+    the old target went through, on this attempt or an earlier one.
+    """
+    if action.action_type == "update":
+        results = update(action.url_key, action.long_url)
+        action.target_removed = results[0]["response_code"] == 200
+        if retrying and results[0]["response_code"] == 404:
+            # an earlier attempt already removed the old target
+            results = results[1:]
+            action.target_removed = True
+        response_code = max(r["response_code"] for r in results)
+        return response_code, [r["response_json"] for r in results]
+    if action.action_type == "create":
+        result = create(action.long_url, action.url_key)
+    else:
+        result = delete(action.url_key)
+    return result["response_code"], result["response_json"]
+
+
+# what _apply sets on a finished action
+RESPONSE_FIELDS = ["response_code", "response_json", "short_url", "error", "status"]
+
+
+def _backoff(attempts: int) -> timedelta:
+    """Exponential backoff with jitter: between half and all of base * 2**attempts"""
+    delay = min(
+        settings.OUTBOX_BACKOFF.total_seconds() * 2**attempts,
+        settings.OUTBOX_MAX_BACKOFF.total_seconds(),
+    )
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def _call(item: OutboxItem) -> Tuple[Optional[int], object, str]:
+    """Make an item's upstream call; return the response code, JSON and error"""
+    action = item.action
+    try:
+        response_code, response_json = perform(action, retrying=item.attempts > 0)
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        logger.warning("Outbox call for %s failed: %s", action, error)
+        return None, {"error": error}, error
+    return response_code, response_json, ""
+
+
+def _apply(item: OutboxItem, response_code, response_json, error: str) -> bool:
+    """
+    Update an item and its action with the outcome of a call, unsaved.
+
+    Returns:
+    bool: True if the action is finished, False if the call is to be retried.
+    """
+    item.attempts += 1
+    if _is_transient(response_code) and item.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+        item.next_attempt_at = timezone.now() + _backoff(item.attempts - 1)
+        item.last_error = error or f"HTTP {response_code}"
+        return False
+
+    action = item.action
+    action.set_response(response_code, response_json)
+    action.status = "succeeded" if action.was_successfull() else "failed"
+    if action.status == "failed":
+        logger.error("UrlAction failed after %s attempt(s): %s", item.attempts, action)
+    return True
+
+
+def process(item: OutboxItem):
+    """Make an item's upstream call and record the outcome"""
+    close_old_connections()
+    if not _apply(item, *_call(item)):
+        item.save(update_fields=["attempts", "next_attempt_at", "last_error"])
+        return
+    with transaction.atomic():
+        item.action.save(update_fields=RESPONSE_FIELDS)
+        item.delete()
+        keys.record([item.action])
+
+
+def process_many(items: List[OutboxItem], max_workers: int) -> Tuple[int, int]:
+    """
+    Make claimed items' upstream calls concurrently and record them in bulk.
+
+    Only the calls run on the thread pool; the outcomes are saved from the
+    calling thread with one bulk update per table.
+
+    Returns:
+    tuple: Numbers of finished actions and of items left to retry.
+    """
+    if not items:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        outcomes = list(pool.map(_call, items))
+    finished, retried = [], []
+    for item, outcome in zip(items, outcomes):
+        (finished if _apply(item, *outcome) else retried).append(item)
+    with transaction.atomic():
+        UrlAction.objects.bulk_update(
+            [item.action for item in finished],
+            RESPONSE_FIELDS,
+        )
+        OutboxItem.objects.filter(pk__in=[item.pk for item in finished]).delete()
+        OutboxItem.objects.bulk_update(
+            retried, ["attempts", "next_attempt_at", "last_error"]
+        )
+        keys.record([item.action for item in finished])
+    return len(finished), len(retried)
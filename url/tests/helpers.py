@@ -0,0 +1,37 @@
+"""Shared set-up for the Django tests of the API"""
+
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from url.models import ApiKey, UrlAction
+
+
+def finished(user, action_type, url_key, long_url=None, status="succeeded"):
+    """Save an action as if the outbox worker had carried it out"""
+    action = UrlAction(
+        user=user,
+        action_type=action_type,
+        url_key=url_key,
+        long_url=long_url,
+        status=status,
+        response_code=200 if status == "succeeded" else 409,
+    )
+    action.save()
+    return action
+
+
+class ApiTestCase(TestCase):
+    """A TestCase with a user and an API key to make requests as them"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        _, self.key = ApiKey.generate(self.user)
+
+    def api(self, method, path, body=None, key=None, **extra):
+        if body is not None:
+            extra.update(data=json.dumps(body), content_type="application/json")
+        return getattr(self.client, method)(
+            path, HTTP_X_API_KEY=key or self.key, **extra
+        )
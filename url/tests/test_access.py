@@ -0,0 +1,78 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import AsyncRequestFactory
+
+from url import async_api
+from url.api import KEY_NOT_FOUND
+from url.models import ApiKey, OutboxItem
+
+from .helpers import ApiTestCase, finished
+
+
+class TestAccess(ApiTestCase):
+    """Each key acts only on its own user's actions and keys"""
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user("other")
+        finished(self.user, "create", "mine", "https://example.com/mine")
+        finished(self.other, "create", "theirs", "https://example.com/theirs")
+
+    def listed(self, path):
+        response = self.api("get", path)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_list_has_only_the_users_actions(self):
+        results = self.listed("/api/urls/")["results"]
+        self.assertEqual([r["url_key"] for r in results], ["mine"])
+
+    def test_history_has_only_the_users_actions(self):
+        finished(self.user, "create", "theirs", "https://example.com", "failed")
+        history = self.listed("/api/urls/theirs/")["history"]
+        self.assertEqual([r["status"] for r in history], ["failed"])
+        _, other_key = ApiKey.generate(self.other)
+        response = self.api("get", "/api/urls/mine/", key=other_key)
+        self.assertEqual(response.status_code, 404)
+
+    def assertNotFound(self, response):
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), {"error": KEY_NOT_FOUND})
+
+    def test_another_users_key_cannot_be_changed(self):
+        self.assertNotFound(
+            self.api("put", "/api/urls/theirs/", {"long_url": "https://evil"})
+        )
+        self.assertNotFound(self.api("delete", "/api/urls/theirs/"))
+        self.assertNotFound(self.api("delete", "/api/urls/unknown/"))
+        self.assertFalse(OutboxItem.objects.exists())
+
+    def test_own_keys_can_be_changed(self):
+        response = self.api("put", "/api/urls/mine/", {"long_url": "https://new"})
+        self.assertEqual(response.status_code, 202)
+        # a pending action still leaves the key the user's
+        self.assertEqual(self.api("delete", "/api/urls/mine/").status_code, 202)
+        self.assertEqual(OutboxItem.objects.count(), 2)
+
+    def test_keys_the_user_no_longer_has(self):
+        finished(self.user, "create", "taken", "https://a.b", status="failed")
+        finished(self.user, "delete", "mine")
+        self.assertNotFound(self.api("delete", "/api/urls/taken/"))
+        self.assertNotFound(
+            self.api("put", "/api/urls/mine/", {"long_url": "https://new"})
+        )
+
+    async def test_async_views(self):
+        factory = AsyncRequestFactory()
+        headers = {"X-API-Key": self.key}
+        response = await async_api.url_list(factory.get("/api/urls/", headers=headers))
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(
+            [r["url_key"] for r in json.loads(content)["results"]], ["mine"]
+        )
+        request = factory.delete("/api/urls/theirs/", headers=headers)
+        self.assertNotFound(await async_api.url_detail(request, "theirs"))
+        request = factory.delete("/api/urls/mine/", headers=headers)
+        response = await async_api.url_detail(request, "mine")
+        self.assertEqual(response.status_code, 202)
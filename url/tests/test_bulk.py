@@ -0,0 +1,122 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+
+from url import keys
+from url.api import KEY_NOT_FOUND, KEY_TAKEN
+from url.models import OutboxItem, UrlAction
+
+from .helpers import ApiTestCase, finished
+
+BULK = "/api/urls/bulk/"
+
+
+class TestBulk(ApiTestCase):
+
+    def test_queues_every_valid_operation(self):
+        finished(self.user, "create", "old", "https://example.com/old")
+        finished(self.user, "create", "gone", "https://example.com/gone")
+        response = self.api(
+            "post",
+            BULK,
+            {
+                "operations": [
+                    {"action": "create", "key": " new ", "long_url": "https://a.b "},
+                    {"action": "update", "key": "old", "long_url": "https://c.d"},
+                    {"action": "delete", "key": "gone"},
+                ]
+            },
+        )
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual((data["queued"], data["rejected"]), (3, 0))
+        self.assertEqual([r["index"] for r in data["results"]], [0, 1, 2])
+        self.assertEqual(data["results"][0]["url_key"], "new")
+        self.assertEqual(data["results"][0]["long_url"], "https://a.b")
+        self.assertEqual(data["results"][0]["status"], "pending")
+        pending = UrlAction.objects.filter(status="pending")
+        self.assertEqual(
+            sorted(pending.values_list("action_type", "url_key")),
+            [("create", "new"), ("delete", "gone"), ("update", "old")],
+        )
+        self.assertEqual(OutboxItem.objects.count(), 3)
+
+    def test_invalid_operations_are_rejected_and_the_rest_queued(self):
+        keys.mark_live(["taken"])
+        finished(self.user, "create", "mine", "https://example.com")
+        finished(self.user, "delete", "deleted")
+        finished(User.objects.create_user("other"), "create", "theirs", "https://a.b")
+        operations = [
+            {"action": "create", "key": "ok", "long_url": "https://a.b"},
+            "create ok2",
+            {"action": "rename", "key": "a"},
+            {"action": "delete"},
+            {"action": "delete", "key": "bad key!"},
+            {"action": "create", "key": "no-url"},
+            {"action": "update", "key": "blank-url", "long_url": "  "},
+            {"action": "delete", "key": "ok"},
+            {"action": "create", "key": "taken", "long_url": "https://a.b"},
+            {"action": "delete", "key": "mine"},
+            {"action": "update", "key": "theirs", "long_url": "https://a.b"},
+            {"action": "delete", "key": "deleted"},
+            {"action": "delete", "key": "unknown"},
+        ]
+        response = self.api("post", BULK, {"operations": operations})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        # queued operations are reported as their action
+        errors = [None if "id" in r else r["error"] for r in data["results"]]
+        self.assertEqual(
+            errors,
+            [
+                None,
+                "operation must be an object",
+                "action must be one of create, update, delete",
+                "key is required",
+                "key can only contain letters, numbers, and hyphens",
+                "long_url is required",
+                "long_url is required",
+                "key appears more than once in this request",
+                KEY_TAKEN,
+                None,
+                KEY_NOT_FOUND,
+                KEY_NOT_FOUND,
+                KEY_NOT_FOUND,
+            ],
+        )
+        self.assertEqual((data["queued"], data["rejected"]), (2, 11))
+        self.assertEqual(
+            [r["success"] for r in data["results"] if "id" not in r], [False] * 11
+        )
+        pending = UrlAction.objects.filter(status="pending")
+        self.assertEqual(
+            sorted(pending.values_list("action_type", "url_key")),
+            [("create", "ok"), ("delete", "mine")],
+        )
+        self.assertEqual(OutboxItem.objects.count(), 2)
+
+    def test_all_rejected(self):
+        response = self.api("post", BULK, {"operations": [{"action": "create"}]})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["queued"], 0)
+        self.assertFalse(UrlAction.objects.exists())
+
+    def test_malformed_requests(self):
+        for body in ([], {}, {"operations": []}, {"operations": {"a": 1}}):
+            response = self.api("post", BULK, body)
+            self.assertEqual(response.status_code, 400, body)
+        response = self.client.post(
+            BULK, "{", content_type="application/json", HTTP_X_API_KEY=self.key
+        )
+        self.assertEqual(response.json(), {"error": "Invalid JSON body"})
+
+    @patch("url.api.BULK_MAX_OPERATIONS", 2)
+    def test_too_many_operations(self):
+        operations = [{"action": "delete", "key": f"k{i}"} for i in range(3)]
+        response = self.api("post", BULK, {"operations": operations})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UrlAction.objects.exists())
+
+    def test_needs_an_api_key(self):
+        response = self.api("post", BULK, {"operations": []}, key="dq_wrong")
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,77 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from url.geo import locate
+from url.models import IpLocation
+
+
+def _fake_lookup(ips):
+    return {ip: {"city": f"City of {ip}"} for ip in ips}
+
+
+class TestLocate(TestCase):
+
+    def setUp(self):
+        patcher = patch("url.geo.lookup", side_effect=_fake_lookup)
+        self.lookup = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def looked_up(self):
+        return [list(call.args[0]) for call in self.lookup.call_args_list]
+
+    def test_repeat_calls_make_no_lookups(self):
+        first = locate(["1.1.1.1", "2.2.2.2", "1.1.1.1"])
+        second = locate(["2.2.2.2", "1.1.1.1"])
+        self.assertEqual(first, second)
+        self.assertEqual(first["1.1.1.1"], {"city": "City of 1.1.1.1"})
+        self.assertEqual(self.looked_up(), [["1.1.1.1", "2.2.2.2"]])
+
+    def test_only_misses_are_looked_up(self):
+        locate(["1.1.1.1"])
+        locations = locate(["1.1.1.1", "2.2.2.2"])
+        self.assertEqual(set(locations), {"1.1.1.1", "2.2.2.2"})
+        self.assertEqual(self.looked_up(), [["1.1.1.1"], ["2.2.2.2"]])
+
+    @override_settings(GEO_CACHE_TTL=timedelta(days=30))
+    def test_expired_entries_are_looked_up_again(self):
+        locate(["1.1.1.1", "2.2.2.2"])
+        IpLocation.objects.filter(ip="1.1.1.1").update(
+            updated=timezone.now() - timedelta(days=31)
+        )
+        locate(["1.1.1.1", "2.2.2.2"])
+        self.assertEqual(self.looked_up(), [["1.1.1.1", "2.2.2.2"], ["1.1.1.1"]])
+        # refreshed, so fresh again
+        locate(["1.1.1.1"])
+        self.assertEqual(len(self.looked_up()), 2)
+        self.assertEqual(IpLocation.objects.count(), 2)
+
+    @override_settings(GEO_MAX_LOOKUPS_PER_REQUEST=2)
+    def test_lookups_per_call_are_capped(self):
+        ips = [f"10.0.0.{i}" for i in range(5)]
+        self.assertEqual(set(locate(ips)), set(ips[:2]))
+        self.assertEqual(set(locate(ips)), set(ips[:4]))
+        self.assertEqual(set(locate(ips)), set(ips))
+        self.assertEqual(self.looked_up(), [ips[:2], ips[2:4], ips[4:]])
+        locate(ips)
+        self.assertEqual(len(self.looked_up()), 3)
+
+    def test_max_lookups_argument(self):
+        locate([f"10.0.0.{i}" for i in range(5)], max_lookups=1)
+        self.assertEqual(self.looked_up(), [["10.0.0.0"]])
+
+    @patch("url.geo.QUERY_CHUNK", 2)
+    def test_cache_is_read_in_chunks(self):
+        ips = [f"10.0.0.{i}" for i in range(5)]
+        locate(ips)
+        with self.assertNumQueries(3):
+            self.assertEqual(set(locate(ips)), set(ips))
+
+    def test_failed_lookups_are_tried_again(self):
+        self.lookup.side_effect = lambda ips: {}
+        self.assertEqual(locate(["1.1.1.1"]), {})
+        self.lookup.side_effect = _fake_lookup
+        self.assertEqual(set(locate(["1.1.1.1"])), {"1.1.1.1"})
+        self.assertEqual(self.looked_up(), [["1.1.1.1"], ["1.1.1.1"]])
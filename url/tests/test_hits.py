@@ -0,0 +1,189 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase
+
+from url.hits import Refresher, hit_stats, parse_hit, sync_hits, tracking_data
+from url.models import ApiKey, Hit, HitRollup, HitSync
+from utils.url import TrackingUnavailable
+
+from .helpers import finished
+
+
+def _hit(time, ip="1.2.3.4", **data):
+    return dict(data, date="2024-05-01", time=time, ip=ip)
+
+
+def _payload(*hits):
+    return {"totalHits": len(hits), "hits": list(hits)}
+
+
+def _wait(refresher):
+    thread = refresher._thread  # None if it has already finished
+    if thread is not None:
+        thread.join(5)
+
+
+class TestSyncHits(TestCase):
+
+    def setUp(self):
+        patcher = patch("url.hits.track")
+        self.track = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self, *hits):
+        self.track.return_value = _payload(*hits)
+        return sync_hits("abc", ttl=timedelta(0))
+
+    def assertStored(self, count):
+        self.assertEqual(Hit.objects.filter(url_key="abc").count(), count)
+        # every stored hit is counted once in its hour and its day
+        for period in (HitRollup.HOUR, HitRollup.DAY):
+            rollups = HitRollup.objects.filter(url_key="abc", period=period)
+            self.assertEqual(rollups.aggregate(n=Sum("hits"))["n"] or 0, count)
+
+    def test_repeated_sync_adds_nothing(self):
+        hits = [_hit("10:00:00"), _hit("10:05:00"), _hit("11:00:00", ip="5.6.7.8")]
+        self.assertEqual(len(self.sync(*hits)), 3)
+        self.assertEqual(self.sync(*hits), [])
+        self.assertStored(3)
+
+    def test_overlapping_history_adds_only_new_hits(self):
+        self.sync(_hit("10:00:00"), _hit("10:05:00"))
+        added = self.sync(_hit("10:00:00"), _hit("10:05:00"), _hit("10:07:00"))
+        self.assertEqual([hit.data["time"] for hit in added], ["10:07:00"])
+        self.assertStored(3)
+
+    def test_hits_sharing_the_latest_timestamp(self):
+        self.sync(_hit("10:00:00"), _hit("10:05:00", ip="1.1.1.1"))
+        # another visit in the same second, and an identical repeat of one
+        added = self.sync(
+            _hit("10:00:00"),
+            _hit("10:05:00", ip="1.1.1.1"),
+            _hit("10:05:00", ip="2.2.2.2"),
+            _hit("10:05:00", ip="1.1.1.1"),
+        )
+        self.assertEqual(sorted(hit.ip for hit in added), ["1.1.1.1", "2.2.2.2"])
+        self.assertStored(4)
+        self.assertEqual(self.sync(*[_hit("10:05:00", ip="1.1.1.1")] * 2), [])
+        self.assertStored(4)
+
+    def test_hits_before_the_latest_are_not_added_again(self):
+        self.sync(_hit("10:00:00"), _hit("10:05:00"))
+        # upstream dropped the first hit from its history
+        self.assertEqual(self.sync(_hit("10:05:00")), [])
+        self.assertStored(2)
+
+    def test_fresh_keys_are_not_fetched(self):
+        self.track.return_value = _payload(_hit("10:00:00"))
+        sync_hits("abc", ttl=timedelta(hours=1))
+        self.assertEqual(sync_hits("abc", ttl=timedelta(hours=1)), [])
+        self.track.assert_called_once_with("abc")
+        self.assertIsNotNone(HitSync.objects.get(url_key="abc").synced_at)
+
+    def test_sync_finished_while_waiting_for_the_lock(self):
+        # stale when first checked, fresh once the row lock is held
+        with patch("url.hits._is_fresh", side_effect=[False, True]):
+            self.assertEqual(sync_hits("abc"), [])
+        self.track.assert_not_called()
+
+    def test_payload_without_hits(self):
+        self.track.return_value = {"message": "Not found"}
+        with self.assertLogs("url.hits", "WARNING"):
+            self.assertEqual(sync_hits("abc", ttl=timedelta(0)), [])
+        self.assertStored(0)
+
+
+class TestSyncHitsCommand(TestCase):
+
+    @patch("url.management.commands.sync_hits.sync_hits", return_value=[])
+    def test_syncs_every_live_key(self, sync):
+        user = User.objects.create_user("owner")
+        finished(user, "create", "created", "https://one")
+        finished(user, "create", "updated", "https://one")
+        finished(user, "update", "updated", "https://two")
+        finished(user, "create", "failed", "https://one", status="failed")
+        finished(user, "create", "deleted", "https://one")
+        finished(user, "delete", "deleted")
+        out = StringIO()
+        call_command("sync_hits", stdout=out)
+        self.assertEqual(
+            sorted(call.args[0] for call in sync.call_args_list), ["created", "updated"]
+        )
+        self.assertIn("across 2 key(s)", out.getvalue())
+
+
+class TestRefresher(TestCase):
+
+    @patch("url.hits.track_breaker.retry_in", return_value=0)
+    @patch("url.hits.sync_hits")
+    def test_retries_until_upstream_recovers(self, sync, retry_in):
+        unavailable = TrackingUnavailable("open")
+        sync.side_effect = [unavailable, unavailable, []]
+        refresher = Refresher(retry_delay=0)
+        refresher.schedule("abc")
+        _wait(refresher)
+        self.assertEqual(sync.call_count, 3)
+        sync.assert_called_with("abc", ttl=timedelta(0))
+        self.assertEqual(refresher.pending, set())
+        self.assertIsNone(refresher._thread)
+
+    @patch("url.hits.sync_hits", side_effect=ValueError("bad payload"))
+    def test_other_errors_are_not_retried(self, sync):
+        refresher = Refresher(retry_delay=0)
+        with self.assertLogs("url.hits", "ERROR"):
+            refresher.schedule("abc")
+            _wait(refresher)
+        sync.assert_called_once()
+        self.assertEqual(refresher.pending, set())
+
+
+class TestStaleHits(TestCase):
+
+    def setUp(self):
+        HitSync.objects.create(url_key="abc")
+        Hit.objects.bulk_create([parse_hit("abc", _hit("10:00:00"))])
+        patcher = patch("url.hits.refresher.schedule")
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("url.hits.track", side_effect=TrackingUnavailable("timed out"))
+    def test_stored_hits_are_served_when_track_fails(self, track):
+        with self.assertLogs("url.hits", "WARNING"):
+            data = tracking_data("abc")
+        self.assertEqual(data["totalHits"], 1)
+        self.assertEqual(data["hits"][0]["time"], "10:00:00")
+        self.assertTrue(data["stale"])
+        self.schedule.assert_called_once_with("abc")
+
+    @patch("url.hits.locate", return_value={})
+    @patch("url.hits.tracking_available", return_value=False)
+    @patch("url.hits.track")
+    def test_track_is_not_called_while_failing(self, track, available, locate):
+        with self.assertLogs("url.hits", "WARNING"):
+            stats = hit_stats("abc")
+        track.assert_not_called()
+        self.assertTrue(stats["stale"])
+        self.schedule.assert_called_once_with("abc")
+
+    @patch("url.hits.track", side_effect=TrackingUnavailable("timed out"))
+    def test_api_marks_the_response_stale(self, track):
+        user = User.objects.create_user("owner")
+        _, key = ApiKey.generate(user)
+        with self.assertLogs("url.hits", "WARNING"):
+            response = self.client.get("/api/urls/abc/track/", HTTP_X_API_KEY=key)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["tracking"]["stale"])
+        self.assertEqual(response.json()["tracking"]["totalHits"], 1)
+
+    @patch("url.hits.track")
+    def test_current_hits_are_not_stale(self, track):
+        track.return_value = _payload(_hit("10:00:00"), _hit("11:00:00"))
+        data = tracking_data("abc")
+        self.assertFalse(data["stale"])
+        self.assertEqual(data["totalHits"], 2)
+        self.schedule.assert_not_called()
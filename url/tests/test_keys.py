@@ -0,0 +1,132 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from url import keys
+from url.api import KEY_TAKEN
+from url.models import LiveKey, UrlAction
+from url.views import CreateForm
+
+from .helpers import ApiTestCase, finished
+
+
+def _action(action_type, url_key, status="pending", response_code=None):
+    return UrlAction(
+        action_type=action_type,
+        url_key=url_key,
+        status=status,
+        response_code=response_code,
+    )
+
+
+def _live():
+    return set(LiveKey.objects.values_list("url_key", flat=True))
+
+
+class TestRegistry(TestCase):
+
+    def test_is_taken(self):
+        self.assertFalse(keys.is_taken("a"))
+        keys.mark_live(["a", "b"])
+        self.assertTrue(keys.is_taken("a"))
+        self.assertEqual(keys.taken(["a", "b", "c"]), {"a", "b"})
+        keys.mark_gone(["a"])
+        # still in the filter, but no longer a LiveKey
+        self.assertFalse(keys.is_taken("a"))
+        self.assertEqual(keys.taken(["a", "b", "c"]), {"b"})
+
+    def test_reserve(self):
+        keys.reserve(
+            [_action("create", "a"), _action("update", "b"), _action("delete", "c")]
+        )
+        self.assertEqual(_live(), {"a", "b"})
+
+    def test_record_succeeded(self):
+        keys.mark_live(["c"])
+        keys.record(
+            [
+                _action("create", "a", "succeeded", 200),
+                _action("update", "b", "succeeded", 200),
+                _action("delete", "c", "succeeded", 200),
+            ]
+        )
+        self.assertEqual(_live(), {"a", "b"})
+
+    def test_record_failed_creates(self):
+        user = User.objects.create_user("owner")
+        other = User.objects.create_user("other")
+        finished(user, "create", "mine", "https://one")
+        finished(user, "delete", "mine")
+        finished(other, "create", "theirs", "https://two")
+        finished(other, "create", "tried", "https://two", status="failed")
+        UrlAction.objects.filter(url_key="tried").update(response_code=400)
+        keys.mark_live(["taken", "mine", "theirs", "tried", "fresh"])
+        keys.record(
+            [
+                UrlAction.objects.create(
+                    user=user,
+                    action_type="create",
+                    url_key=url_key,
+                    long_url="https://three",
+                    status="failed",
+                    response_code=response_code,
+                )
+                for url_key, response_code in (
+                    ("taken", 409),
+                    ("mine", 400),
+                    ("theirs", 400),
+                    ("tried", 400),
+                    ("fresh", 422),
+                )
+            ]
+        )
+        # released unless another user has the key
+        self.assertEqual(_live(), {"taken", "theirs"})
+
+    def test_record_failed_updates(self):
+        keys.mark_live(["a", "b", "c"])
+        a = _action("update", "a", "failed", 400)
+        b = _action("update", "b", "failed", 409)
+        c = _action("update", "c", "failed", 400)
+        # the old targets of a and b were deleted; c's delete failed
+        a.target_removed = b.target_removed = True
+        keys.record([a, b, c])
+        self.assertEqual(_live(), {"b", "c"})
+
+
+class TestTakenKeys(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        keys.mark_live(["taken"])
+
+    def test_create_of_a_taken_key(self):
+        body = {"long_url": "https://example.com", "key": "taken"}
+        response = self.api("post", "/api/urls/", body)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content), {"error": KEY_TAKEN})
+        self.assertFalse(UrlAction.objects.exists())
+        body["key"] = "free"
+        self.assertEqual(self.api("post", "/api/urls/", body).status_code, 202)
+        self.assertTrue(keys.is_taken("free"))
+
+    def test_key_available(self):
+        for key, available in (("taken", False), ("free", True)):
+            response = self.api("get", f"/api/keys/{key}/available")
+            self.assertEqual(
+                json.loads(response.content), {"key": key, "available": available}
+            )
+        response = self.api("get", "/api/keys/a_b/available")
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_form(self):
+        data = {
+            "action_type": "create",
+            "long_url": "https://example.com",
+            "url_key": "taken",
+        }
+        form = CreateForm(data)
+        self.assertEqual(form.errors["url_key"], ["This URL key is already taken."])
+        # the user's own key can still be updated
+        self.assertTrue(CreateForm(dict(data, action_type="update")).is_valid())
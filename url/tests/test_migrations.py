@@ -0,0 +1,123 @@
+import json
+import os
+from importlib import import_module
+from unittest.mock import patch
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from url.models import ApiKey, UrlAction
+
+normalize = import_module("url.migrations.0015_normalize_response_json")
+import_env_api_key = import_module(
+    "url.migrations.0017_import_env_api_key"
+).import_env_api_key
+
+
+class TestNormalizeResponses(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user("someone")
+        for action_type, url_key, response_code, response_json in (
+            ("create", "a", 200, json.dumps({"shortUrl": "https://aws3.link/a"})),
+            ("update", "b", 200, ["{}", '{"shortUrl": "https://aws3.link/b"}']),
+            ("create", "c", 409, json.dumps({"error": "taken"})),
+            ("delete", "d", 200, {}),
+            ("create", "e", 200, json.dumps({"shortUrl": "https://aws3.link/e"})),
+        ):
+            UrlAction.objects.create(
+                user=user,
+                action_type=action_type,
+                url_key=url_key,
+                status="succeeded" if response_code == 200 else "failed",
+                response_code=response_code,
+                response_json=response_json,
+            )
+        patcher = patch.object(normalize, "BATCH_SIZE", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.updated = []
+
+    def run_migration(self, fail_on_batch=None):
+        bulk_update = UrlAction.objects.bulk_update
+
+        def record(objs, fields):
+            if len(self.updated) + 1 == fail_on_batch:
+                raise KeyboardInterrupt
+            self.updated.append([action.url_key for action in objs])
+            return bulk_update(objs, fields)
+
+        with patch.object(UrlAction.objects, "bulk_update", side_effect=record):
+            normalize.normalize_responses(apps, None)
+
+    def fields(self):
+        return {
+            action.url_key: (action.response_json, action.short_url, action.error)
+            for action in UrlAction.objects.order_by("pk")
+        }
+
+    def test_interrupted_run_is_resumed(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_migration(fail_on_batch=2)
+        self.assertEqual(self.updated, [["a", "b"]])
+        self.assertEqual(self.fields()["c"][1:], ("", ""))
+
+        self.updated = []
+        self.run_migration()
+        # a and b are done; d needs no change
+        self.assertEqual(self.updated, [["c"], ["e"]])
+        self.assertEqual(
+            self.fields(),
+            {
+                "a": ({"shortUrl": "https://aws3.link/a"}, "https://aws3.link/a", ""),
+                "b": (
+                    [{}, {"shortUrl": "https://aws3.link/b"}],
+                    "https://aws3.link/b",
+                    "",
+                ),
+                "c": ({"error": "taken"}, "", "taken"),
+                "d": ({}, "", ""),
+                "e": ({"shortUrl": "https://aws3.link/e"}, "https://aws3.link/e", ""),
+            },
+        )
+
+        self.updated = []
+        self.run_migration()
+        self.assertEqual(self.updated, [[]])
+
+
+class TestImportEnvApiKey(TestCase):
+
+    def setUp(self):
+        User.objects.create_user("someone")
+        self.admin = User.objects.create_superuser("admin")
+
+    def run_migration(self, **env):
+        with patch.dict(os.environ, env):
+            import_env_api_key(apps, None)
+
+    def test_the_old_key_keeps_working(self):
+        self.run_migration(API_KEY="old-secret-key")
+        api_key = ApiKey.objects.get()
+        self.assertEqual((api_key.user, api_key.name), (self.admin, "API_KEY"))
+        self.assertEqual(api_key.prefix, "old-secret-")
+        response = self.client.get("/api/urls/", HTTP_X_API_KEY="old-secret-key")
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_user_id(self):
+        user = User.objects.create_user("api")
+        self.run_migration(API_KEY="old-secret-key", API_USER_ID=str(user.pk))
+        self.assertEqual(ApiKey.objects.get().user, user)
+
+    def test_runs_once(self):
+        self.run_migration(API_KEY="old-secret-key")
+        self.run_migration(API_KEY="old-secret-key")
+        self.assertEqual(ApiKey.objects.count(), 1)
+
+    def test_nothing_to_import(self):
+        with patch.dict(os.environ):
+            os.environ.pop("API_KEY", None)
+            import_env_api_key(apps, None)
+        self.run_migration(API_KEY="old-secret-key", API_USER_ID="999")
+        self.assertFalse(ApiKey.objects.exists())
@@ -0,0 +1,243 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from url import outbox
+from url.models import LinkState, LiveKey, OutboxItem, UrlAction
+
+
+def _result(response_code, **data):
+    return {"response_code": response_code, "response_json": data}
+
+
+def _created(long_url, key):
+    return _result(200, shortUrl=f"https://aws3.link/{key}")
+
+
+def _deleted(key):
+    return _result(200)
+
+
+class OutboxTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        for name, default in (
+            ("create", _created),
+            ("delete", _deleted),
+            ("update", lambda key, long_url: [_deleted(key), _created(long_url, key)]),
+        ):
+            patcher = patch(f"url.outbox.{name}", side_effect=default)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def queue(self, action_type, url_key, long_url=None):
+        return outbox.enqueue(
+            UrlAction(
+                user=self.user,
+                action_type=action_type,
+                url_key=url_key,
+                long_url=long_url,
+            )
+        )
+
+    def claimed(self, **filters):
+        return [item.action for item in outbox.claim(10, **filters)]
+
+    def expire_leases(self):
+        OutboxItem.objects.update(next_attempt_at=timezone.now() - timedelta(1))
+
+
+class TestEnqueue(OutboxTestCase):
+
+    def test_enqueue_many(self):
+        actions = outbox.enqueue_many(
+            [
+                UrlAction(
+                    user=self.user,
+                    action_type="create",
+                    url_key=key,
+                    long_url="https://example.com",
+                )
+                for key in ("a", "b")
+            ]
+        )
+        self.assertTrue(all(action.pk for action in actions))
+        self.assertEqual(
+            set(UrlAction.objects.values_list("url_key", "status")),
+            {("a", "pending"), ("b", "pending")},
+        )
+        self.assertEqual(
+            set(OutboxItem.objects.values_list("action", flat=True)),
+            {action.pk for action in actions},
+        )
+        self.assertEqual(
+            set(LinkState.objects.values_list("action", flat=True)),
+            {action.pk for action in actions},
+        )
+        self.assertEqual(
+            set(LiveKey.objects.values_list("url_key", flat=True)), {"a", "b"}
+        )
+
+
+class TestClaim(OutboxTestCase):
+
+    def test_calls_for_a_key_are_claimed_in_order(self):
+        first = self.queue("create", "a", "https://one")
+        second = self.queue("update", "a", "https://two")
+        third = self.queue("delete", "a")
+        other = self.queue("create", "b", "https://one")
+        self.assertEqual(self.claimed(), [first, other])
+        # leased, and the later calls for "a" still wait for the first
+        self.assertEqual(self.claimed(), [])
+        self.expire_leases()
+        self.assertEqual(self.claimed(), [first, other])
+        for item in OutboxItem.objects.filter(action__in=[first, other]):
+            outbox.process(item)
+        self.assertEqual(self.claimed(), [second])
+        outbox.process(OutboxItem.objects.get(action=second))
+        self.assertEqual(self.claimed(), [third])
+
+    def test_claimed_items_are_leased(self):
+        action = self.queue("create", "a", "https://one")
+        before = timezone.now()
+        self.assertEqual(self.claimed(), [action])
+        item = OutboxItem.objects.get()
+        self.assertGreaterEqual(item.next_attempt_at, before + settings.OUTBOX_LEASE)
+        self.assertEqual(self.claimed(), [])
+
+    @override_settings(OUTBOX_LEASE=timedelta(0))
+    def test_items_of_a_dead_worker_are_claimed_again(self):
+        action = self.queue("create", "a", "https://one")
+        self.assertEqual(self.claimed(), [action])
+        # the worker died without recording anything
+        self.assertEqual(self.claimed(), [action])
+        self.assertEqual(OutboxItem.objects.get().attempts, 0)
+
+    def test_items_waiting_for_a_retry_are_not_claimed(self):
+        self.queue("create", "a", "https://one")
+        OutboxItem.objects.update(next_attempt_at=timezone.now() + timedelta(1))
+        self.assertEqual(self.claimed(), [])
+
+    def test_filters(self):
+        self.queue("create", "a", "https://one")
+        b = self.queue("create", "b", "https://one")
+        self.assertEqual(self.claimed(action__url_key="b"), [b])
+
+    def test_batch_size(self):
+        for key in "abc":
+            self.queue("create", key, "https://one")
+        self.assertEqual(len(outbox.claim(2)), 2)
+        self.assertEqual(len(outbox.claim(2)), 1)
+
+
+class TestProcess(OutboxTestCase):
+
+    def process(self, action):
+        outbox.process(OutboxItem.objects.get(action=action))
+        action.refresh_from_db()
+        return action
+
+    def test_success(self):
+        action = self.process(self.queue("create", "a", "https://one"))
+        self.assertEqual(action.status, "succeeded")
+        self.assertEqual(action.short_url, "https://aws3.link/a")
+        self.assertFalse(OutboxItem.objects.exists())
+        self.create.assert_called_once_with("https://one", "a")
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        self.create.side_effect = [
+            _result(503, message="busy"),
+            ConnectionError("refused"),
+            _created("https://one", "a"),
+        ]
+        action = self.queue("create", "a", "https://one")
+        self.assertEqual(self.process(action).status, "pending")
+        item = OutboxItem.objects.get()
+        self.assertEqual((item.attempts, item.last_error), (1, "HTTP 503"))
+        # between half and all of OUTBOX_BACKOFF after the first attempt
+        self.assertGreater(item.next_attempt_at, timezone.now())
+        self.assertLessEqual(
+            item.next_attempt_at, timezone.now() + settings.OUTBOX_BACKOFF
+        )
+        self.assertEqual(self.claimed(), [])
+
+        self.expire_leases()
+        with self.assertLogs("url.outbox", "WARNING"):
+            self.assertEqual(self.process(action).status, "pending")
+        item = OutboxItem.objects.get()
+        self.assertEqual((item.attempts, item.last_error), (2, "refused"))
+
+        self.expire_leases()
+        self.assertEqual(self.process(action).status, "succeeded")
+        self.assertEqual(self.create.call_count, 3)
+
+    def test_other_failures_are_not_retried(self):
+        self.create.side_effect = [_result(409, error="taken")]
+        with self.assertLogs("url.outbox", "ERROR"):
+            action = self.process(self.queue("create", "a", "https://one"))
+        self.assertEqual((action.status, action.error), ("failed", "taken"))
+        self.assertFalse(OutboxItem.objects.exists())
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        self.create.side_effect = lambda long_url, key: _result(500)
+        action = self.queue("create", "a", "https://one")
+        self.process(action)
+        with self.assertLogs("url.outbox", "ERROR"):
+            action = self.process(action)
+        self.assertEqual((action.status, action.response_code), ("failed", 500))
+        self.assertFalse(OutboxItem.objects.exists())
+
+    def test_retried_update_skips_the_deleted_target(self):
+        self.update.side_effect = [
+            [_result(200), _result(503)],
+            # the old target went on the first attempt
+            [_result(404, message="Not found"), _created("https://two", "a")],
+        ]
+        action = self.queue("update", "a", "https://two")
+        self.assertEqual(self.process(action).status, "pending")
+        action = self.process(action)
+        self.assertEqual(action.status, "succeeded")
+        self.assertEqual(action.response_json, [{"shortUrl": "https://aws3.link/a"}])
+
+    def test_failed_update_releases_a_deleted_key(self):
+        self.update.side_effect = [[_result(200), _result(400, message="bad")]]
+        with self.assertLogs("url.outbox", "ERROR"):
+            action = self.process(self.queue("update", "a", "https://two"))
+        self.assertEqual(action.status, "failed")
+        self.assertFalse(LiveKey.objects.filter(url_key="a").exists())
+
+    def test_update_of_a_missing_key_fails_on_the_first_attempt(self):
+        self.update.side_effect = [[_result(404), _created("https://two", "a")]]
+        with self.assertLogs("url.outbox", "ERROR"):
+            action = self.process(self.queue("update", "a", "https://two"))
+        self.assertEqual((action.status, action.response_code), ("failed", 404))
+
+    def test_process_many(self):
+        self.create.side_effect = lambda long_url, key: (
+            _result(503) if key == "b" else _created(long_url, key)
+        )
+        a = self.queue("create", "a", "https://one")
+        b = self.queue("create", "b", "https://one")
+        self.queue("delete", "c")
+        items = outbox.claim(10)
+        self.assertEqual(outbox.process_many(items, max_workers=3), (2, 1))
+        self.assertEqual(
+            dict(UrlAction.objects.values_list("url_key", "status")),
+            {"a": "succeeded", "b": "pending", "c": "succeeded"},
+        )
+        self.assertEqual(
+            list(OutboxItem.objects.values_list("action", "attempts")), [(b.pk, 1)]
+        )
+        a.refresh_from_db()
+        self.assertEqual(a.short_url, "https://aws3.link/a")
+        self.assertEqual(
+            set(LiveKey.objects.values_list("url_key", flat=True)), {"a", "b"}
+        )
+        self.delete.assert_called_once_with("c")
+        self.assertEqual(outbox.process_many([], max_workers=3), (0, 0))
@@ -0,0 +1,106 @@
+import json
+from unittest.mock import patch
+
+from django.test import AsyncRequestFactory
+
+from url import async_api
+
+from .helpers import ApiTestCase, finished
+
+
+class TestPages(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.actions = [
+            finished(self.user, "update", "abc", f"https://example.com/{i}")
+            for i in range(5)
+        ]
+        self.pks = [action.pk for action in reversed(self.actions)]
+
+    def page(self, path):
+        response = self.api("get", path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_pages_follow_the_cursor(self):
+        data = self.page("/api/urls/?limit=2")
+        self.assertEqual([r["id"] for r in data["results"]], self.pks[:2])
+        self.assertEqual(
+            data["next"],
+            f"http://testserver/api/urls/?limit=2&before={self.pks[1]}",
+        )
+        data = self.page(data["next"])
+        self.assertEqual([r["id"] for r in data["results"]], self.pks[2:4])
+        data = self.page(data["next"])
+        self.assertEqual([r["id"] for r in data["results"]], self.pks[4:])
+        self.assertIsNone(data["next"])
+
+    def test_a_full_last_page_has_no_next(self):
+        data = self.page("/api/urls/?limit=5")
+        self.assertEqual(len(data["results"]), 5)
+        self.assertIsNone(data["next"])
+
+    def test_before_is_exclusive(self):
+        data = self.page(f"/api/urls/?before={self.pks[2]}")
+        self.assertEqual([r["id"] for r in data["results"]], self.pks[3:])
+
+    def test_serialized_actions(self):
+        result = self.page("/api/urls/?limit=1")["results"][0]
+        action = self.actions[-1]
+        self.assertEqual(
+            result,
+            {
+                "id": action.pk,
+                "action_type": "update",
+                "url_key": "abc",
+                "long_url": "https://example.com/4",
+                "response_code": 200,
+                "success": True,
+                "status": "succeeded",
+                "short_url": "",
+                "error": "",
+                "timestamp": action.timestamp.isoformat(),
+            },
+        )
+
+    @patch("url.api.PAGE_SIZE", 3)
+    def test_limits(self):
+        self.assertEqual(len(self.page("/api/urls/")["results"]), 3)
+        with patch("url.api.MAX_PAGE_SIZE", 4):
+            data = self.page("/api/urls/?limit=100")
+        self.assertEqual(len(data["results"]), 4)
+        self.assertIn("limit=4", data["next"])
+
+    def test_invalid_parameters(self):
+        for query in ("limit=0", "limit=-1", "limit=x", "before=x", "before="):
+            for path in ("/api/urls/", "/api/urls/abc/"):
+                response = self.api("get", f"{path}?{query}")
+                self.assertEqual(response.status_code, 400, (path, query))
+                self.assertEqual(
+                    response.json(),
+                    {"error": "limit and before must be positive integers"},
+                )
+
+    @patch("url.api.PAGE_SIZE", 2)
+    def test_history_is_paginated_by_default(self):
+        finished(self.user, "create", "other", "https://example.com")
+        data = self.page("/api/urls/abc/")
+        self.assertEqual(data["url_key"], "abc")
+        self.assertEqual([r["id"] for r in data["history"]], self.pks[:2])
+        data = self.page(data["next"])
+        self.assertEqual([r["id"] for r in data["history"]], self.pks[2:4])
+
+    def test_history_of_an_unknown_key(self):
+        self.assertEqual(self.api("get", "/api/urls/nope/").status_code, 404)
+
+    async def test_async_history(self):
+        request = AsyncRequestFactory().get(
+            "/api/urls/abc/", {"limit": 2}, headers={"X-API-Key": self.key}
+        )
+        response = await async_api.url_detail(request, "abc")
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        data = json.loads(content)
+        self.assertEqual([r["id"] for r in data["history"]], self.pks[:2])
+        self.assertIn(f"before={self.pks[1]}", data["next"])
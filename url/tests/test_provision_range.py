@@ -0,0 +1,64 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from url import keys
+from url.models import LinkState, UrlAction
+
+
+def _create(long_url, key):
+    if key == "k2":
+        return {"response_code": 400, "response_json": {"error": "Bad request"}}
+    return {"response_code": 200, "response_json": {"shortUrl": f"https://s/{key}"}}
+
+
+@patch("url.outbox.create", side_effect=_create)
+class TestProvisionRange(TestCase):
+
+    def setUp(self):
+        User.objects.create_user("owner")
+
+    def provision(self):
+        out = StringIO()
+        call_command(
+            "provision_range",
+            "k",
+            0,
+            4,
+            long_url="https://example.com",
+            user="owner",
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def statuses(self):
+        return dict(LinkState.objects.values_list("url_key", "action__status"))
+
+    def test_creates_the_range(self, create):
+        with self.assertLogs("url.outbox", "ERROR"):
+            output = self.provision()
+        self.assertIn("Queued 4 key(s); 3 created, 1 failed.", output)
+        self.assertEqual(
+            self.statuses(),
+            {"k0": "succeeded", "k1": "succeeded", "k2": "failed", "k3": "succeeded"},
+        )
+
+    def test_rerun_retries_only_failed_creates(self, create):
+        with self.assertLogs("url.outbox", "ERROR"):
+            self.provision()
+        create.reset_mock()
+        create.side_effect = None
+        create.return_value = {"response_code": 200, "response_json": {}}
+        self.assertIn("Queued 1 key(s); 1 created", self.provision())
+        create.assert_called_once_with("https://example.com", "k2")
+        self.assertEqual(set(self.statuses().values()), {"succeeded"})
+        self.assertEqual(UrlAction.objects.filter(url_key="k2").count(), 2)
+
+    def test_keys_someone_else_has_are_skipped(self, create):
+        keys.mark_live(["k2"])
+        self.assertIn("Skipped 1 taken by others", self.provision())
+        self.assertNotIn("k2", self.statuses())
+        self.assertEqual(create.call_count, 3)
@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from url import keys
+from url.api import QR_MAX_SIZE, QR_MIN_SIZE
+
+
+def _image(url):
+    return f"image of {url}".encode()
+
+
+@patch("url.api.qr_image", side_effect=_image)
+class TestQrImage(TestCase):
+
+    def setUp(self):
+        keys.mark_live(["abc"])
+
+    def test_image(self, qr_image):
+        response = self.client.get("/api/urls/abc/qr.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(
+            response.content,
+            b"image of https://quickchart.io/qr?size=100&text=https://aws3.link/abc",
+        )
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        response = self.client.get("/api/urls/abc/qr.svg")
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertTrue(response.content.endswith(b"&format=svg"))
+
+    def test_conditional_requests(self, qr_image):
+        etag = self.client.get("/api/urls/abc/qr.png")["ETag"]
+        self.assertRegex(etag, r'^"[0-9a-f]{32}"$')
+        response = self.client.get("/api/urls/abc/qr.png", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        # another size is another image
+        response = self.client.get(
+            "/api/urls/abc/qr.png?size=200", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_head(self, qr_image):
+        response = self.client.head("/api/urls/abc/qr.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response)
+
+    def test_size_is_clamped(self, qr_image):
+        for size, expected in (
+            ("1", QR_MIN_SIZE),
+            ("-5", QR_MIN_SIZE),
+            ("300", 300),
+            ("100000", QR_MAX_SIZE),
+        ):
+            response = self.client.get(f"/api/urls/abc/qr.png?size={size}")
+            self.assertIn(f"size={expected}&".encode(), response.content, size)
+
+    def test_invalid_size(self, qr_image):
+        response = self.client.get("/api/urls/abc/qr.png?size=big")
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_keys_in_use_have_images(self, qr_image):
+        keys.mark_live(["gone"])
+        keys.mark_gone(["gone"])
+        for key in ("unknown", "gone"):
+            response = self.client.get(f"/api/urls/{key}/qr.png")
+            self.assertEqual(response.status_code, 404, key)
+        self.assertEqual(self.client.get("/api/urls/a_b/qr.png").status_code, 400)
+        qr_image.assert_not_called()
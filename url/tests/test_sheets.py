@@ -0,0 +1,109 @@
+import re
+import tempfile
+from unittest.mock import patch
+
+from django.test import AsyncRequestFactory
+
+from url import async_api
+from url.api import SHEET_MAX_LABELS
+from utils import qr
+from utils.qrcache import QrImageCache
+
+from .helpers import ApiTestCase
+
+SHEETS = "/api/sheets/"
+
+
+def _fake_pdf(urls, descriptions):
+    """Stands in for stream_qr_pdf, yielding a line per code"""
+    for url, description in zip(urls, descriptions):
+        yield f"{description} {url}\n".encode()
+
+
+class TestSheets(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = patch.object(qr, "qr_cache", QrImageCache(cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sheet_is_streamed_a_page_at_a_time(self):
+        keys = [f"llqrv{i}" for i in range(49)]
+        response = self.api("post", SHEETS, {"keys": keys})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="qr_codes.pdf"'
+        )
+        chunks = list(response.streaming_content)
+        # the header, two pages and the trailer
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(chunks[0].startswith(b"%PDF-"))
+        self.assertEqual(len(re.findall(rb"/Subtype /Image", chunks[1])), 48)
+        self.assertEqual(len(re.findall(rb"/Subtype /Image", chunks[2])), 1)
+        self.assertIn(b"/Count 2", chunks[3])
+        self.assertTrue(chunks[3].endswith(b"%%EOF\n"))
+
+    @patch("url.api.stream_qr_pdf", side_effect=_fake_pdf)
+    def test_codes_for_a_range_of_keys(self, stream_qr_pdf):
+        body = {"prefix": "llqrv", "start": 8, "count": 3}
+        response = self.api("post", SHEETS, body)
+        self.assertEqual(
+            b"".join(response.streaming_content).decode().splitlines(),
+            [
+                f"llqrv{i} https://quickchart.io/qr?size=100&text="
+                f"https://aws3.link/llqrv{i}"
+                for i in (8, 9, 10)
+            ],
+        )
+
+    def test_invalid_requests(self):
+        too_many = SHEET_MAX_LABELS + 1
+        bad_keys = "keys can only contain letters, numbers, and hyphens"
+        no_keys = "Give keys, or a prefix with start and count"
+        bad_start = "start must be a non-negative integer"
+        bad_count = f"count must be an integer from 1 to {SHEET_MAX_LABELS}"
+        for body, error in (
+            ([], "Body must be an object"),
+            ({"keys": []}, "keys must be a non-empty list"),
+            ({"keys": "abc"}, "keys must be a non-empty list"),
+            ({"keys": ["a"] * too_many}, f"At most {SHEET_MAX_LABELS} keys per sheet"),
+            ({"keys": ["ok", "not ok"]}, bad_keys),
+            ({"keys": ["ok", 1]}, bad_keys),
+            ({}, no_keys),
+            ({"prefix": "a b", "start": 0, "count": 1}, no_keys),
+            ({"prefix": "a", "start": -1, "count": 1}, bad_start),
+            ({"prefix": "a", "start": "0", "count": 1}, bad_start),
+            ({"prefix": "a", "start": 0, "count": 0}, bad_count),
+            ({"prefix": "a", "start": 0, "count": too_many}, bad_count),
+        ):
+            response = self.api("post", SHEETS, body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(response.json(), {"error": error})
+
+    def test_invalid_json(self):
+        response = self.client.post(
+            SHEETS, "{", content_type="application/json", HTTP_X_API_KEY=self.key
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_needs_an_api_key(self):
+        response = self.api("post", SHEETS, {"keys": ["a"]}, key="dq_wrong")
+        self.assertEqual(response.status_code, 401)
+
+    @patch("url.api.stream_qr_pdf", side_effect=_fake_pdf)
+    async def test_async_sheet(self, stream_qr_pdf):
+        request = AsyncRequestFactory().post(
+            SHEETS,
+            {"keys": ["a", "b"]},
+            content_type="application/json",
+            headers={"X-API-Key": self.key},
+        )
+        response = await async_api.url_sheet(request)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[1].startswith(b"b https://quickchart.io/qr?"))
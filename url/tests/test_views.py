@@ -0,0 +1,122 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from url.models import HitRollup, LinkState, TargetState, UrlAction
+
+from .helpers import finished
+
+
+class TestListViews(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.client.force_login(self.user)
+
+    def listed(self, name):
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return [
+            (action.action_type, action.url_key, action.long_url)
+            for action in response.context["object_list"]
+        ]
+
+    def test_history_lists_the_latest_action_per_key_and_url(self):
+        finished(self.user, "create", "a", "https://one")
+        finished(self.user, "update", "a", "https://two")
+        finished(self.user, "update", "a", "https://one")
+        finished(self.user, "create", "b", "https://one")
+        finished(self.user, "delete", "b")
+        finished(User.objects.create_user("other"), "create", "c", "https://one")
+        self.assertEqual(
+            self.listed("history"),
+            [
+                ("delete", "b", None),
+                ("create", "b", "https://one"),
+                ("update", "a", "https://one"),
+                ("update", "a", "https://two"),
+            ],
+        )
+
+    def test_most_recent_lists_live_keys(self):
+        finished(self.user, "create", "a", "https://one")
+        finished(self.user, "update", "a", "https://two")
+        finished(self.user, "create", "b", "https://one")
+        finished(self.user, "delete", "b")
+        self.assertEqual(
+            self.listed("most_recent"), [("update", "a", "https://two")]
+        )
+
+    def test_saving_a_result_keeps_the_states(self):
+        first = finished(self.user, "create", "a", "https://one")
+        finished(self.user, "update", "a", "https://two")
+        first.status = "failed"
+        first.save(update_fields=["status"])
+        self.assertEqual(LinkState.objects.get().action.long_url, "https://two")
+        self.assertEqual(TargetState.objects.count(), 2)
+
+    def test_bulk_refresh_matches_saving_one_by_one(self):
+        actions = UrlAction.objects.bulk_create(
+            [
+                UrlAction(
+                    user=self.user,
+                    action_type="create",
+                    url_key="a",
+                    long_url="https://one",
+                ),
+                UrlAction(user=self.user, action_type="delete", url_key="a"),
+            ]
+        )
+        UrlAction.refresh_states(actions)
+        self.assertEqual(LinkState.objects.get().action, actions[1])
+        self.assertEqual(
+            sorted(TargetState.objects.values_list("long_url", "action")),
+            [("", actions[1].pk), ("https://one", actions[0].pk)],
+        )
+
+
+class TestPortfolio(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.client.force_login(self.user)
+
+    def test_counts_only_keys_the_user_has(self):
+        other = User.objects.create_user("other")
+        finished(self.user, "create", "mine", "https://one")
+        finished(self.user, "update", "updated", "https://one")
+        # the create failed, as the key was someone else's
+        finished(other, "create", "taken", "https://two")
+        finished(self.user, "create", "taken", "https://one", status="failed")
+        finished(self.user, "create", "deleted", "https://one")
+        finished(self.user, "delete", "deleted")
+        finished(self.user, "create", "pending", "https://one", status="pending")
+        now = timezone.now()
+        HitRollup.objects.bulk_create(
+            HitRollup(
+                url_key=key,
+                period=period,
+                start=HitRollup.bucket(period, now),
+                hits=hits,
+            )
+            for key, hits in (
+                ("mine", 3),
+                ("updated", 2),
+                ("taken", 100),
+                ("deleted", 10),
+                ("pending", 5),
+            )
+            for period in (HitRollup.HOUR, HitRollup.DAY)
+        )
+        response = self.client.get(reverse("portfolio"))
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        self.assertEqual(
+            [(row["action"].url_key, row["hits"]) for row in context["keys"]],
+            [("mine", 3), ("updated", 2)],
+        )
+        self.assertEqual(context["key_count"], 2)
+        self.assertEqual(context["total_hits"], 5)
+        self.assertEqual(context["today_hits"], 5)
+        self.assertEqual(context["hourly"][-1]["hits"], 5)
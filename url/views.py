@@ -1,20 +1,19 @@
 import logging
-from datetime import datetime
+from datetime import timedelta
 
+from django.db.models import Max, Sum
+from django.utils import timezone
 from django.views import generic
 from django.urls import reverse
 from django import forms
-import requests
+from django.http import HttpResponseRedirect
 
-
-from utils.url import create, update, delete, track
-
-from . import models
+from . import keys as live_keys, models, outbox
+from .geo import locate
+from .hits import refresh_hits
 
 logger = logging.getLogger(__name__)
 
-DT_FMT = "%Y-%m-%d %H:%M:%S"
-
 
 class DetailView(generic.DetailView):
     model = models.UrlAction
@@ -24,16 +23,19 @@ class DetailView(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        tracking_data = track(self.object.url_key)
-        logger.warning("track(%s) returned: %s", self.object.url_key, tracking_data)
-        if "hits" in tracking_data:
-            for hit in tracking_data["hits"]:
-                datetime_str = f"{hit['date']} {hit['time']}"
-                print(datetime_str)
-                hit["datetime"] = datetime.strptime(datetime_str, DT_FMT)
-                hit["ip_data"] = requests.get(
-                    f'http://ip-api.com/json/{hit["ip"]}'
-                ).json()
+        context["tracking_stale"] = not refresh_hits(self.object.url_key)
+        hits = list(
+            models.Hit.objects.filter(url_key=self.object.url_key).order_by(
+                "-timestamp", "-pk"
+            )
+        )
+        locations = locate(hit.ip for hit in hits)
+        tracking_data = {"totalHits": len(hits), "hits": []}
+        for hit in hits:
+            data = dict(hit.data, datetime=hit.timestamp)
+            if hit.ip in locations:
+                data["ip_data"] = locations[hit.ip]
+            tracking_data["hits"].append(data)
         context["tracking_data"] = tracking_data
         action_history = (
             models.UrlAction.objects.filter(
@@ -48,25 +50,18 @@ class DetailView(generic.DetailView):
         return context
 
 
-url_actions = {
-    "create": create,
-    "update": update,
-    "delete": delete,
-}
-
-
 class AllView(generic.ListView):
     model = models.UrlAction
     ordering = ["-pk"]
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(user=self.request.user)
-        latest_id_per_combo = (
-            qs.order_by("url_key", "long_url", "-timestamp")
-            .distinct("url_key", "long_url")
-            .values_list("id", flat=True)
+        # the latest action per url_key and long_url is kept in TargetState
+        return (
+            super()
+            .get_queryset()
+            .filter(user=self.request.user, target_state__isnull=False)
+            .defer("response_json")
         )
-        return qs.filter(pk__in=latest_id_per_combo)
 
 
 class MostRecentView(generic.ListView):
@@ -74,13 +69,108 @@ class MostRecentView(generic.ListView):
     ordering = ["-pk"]
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(user=self.request.user)
-        latest_id_per_url_key = (
-            qs.order_by("url_key", "-timestamp").distinct("url_key").values_list("id")
+        # the latest action per url_key is kept in LinkState
+        return (
+            super()
+            .get_queryset()
+            .filter(user=self.request.user, link_state__isnull=False)
+            .filter(action_type__in=["create", "update"])
+            .defer("response_json")
         )
-        return qs.filter(pk__in=latest_id_per_url_key).filter(
-            action_type__in=["create", "update"]
+
+
+class PortfolioView(generic.TemplateView):
+    """
+    Traffic across all of a user's url_keys.
+
+    Reads only HitRollup rows, so its cost doesn't grow with the number of
+    raw hits; counts are as of each key's last hit sync. A key counts while
+    the user's latest action on it is a create or update that succeeded, so
+    a key someone else had when the user tried it, or one the user deleted,
+    doesn't bring in another owner's traffic.
+    """
+
+    template_name = "url/portfolio.html"
+    days = 30
+    hours = 48
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        states = {
+            state.url_key: state
+            for state in models.LinkState.objects.filter(
+                user=self.request.user,
+                action__status="succeeded",
+                action__action_type__in=["create", "update"],
+            )
+            .select_related("action")
+            .defer("action__response_json")
+        }
+        rollups = models.HitRollup.objects.filter(url_key__in=states)
+        now = timezone.now()
+        today = models.HitRollup.bucket(models.HitRollup.DAY, now)
+        this_hour = models.HitRollup.bucket(models.HitRollup.HOUR, now)
+        week_start = today - timedelta(days=6)
+
+        daily = self._series(
+            rollups, models.HitRollup.DAY, today, timedelta(days=1), self.days
+        )
+        hourly = self._series(
+            rollups, models.HitRollup.HOUR, this_hour, timedelta(hours=1), self.hours
+        )
+        totals = (
+            rollups.filter(period=models.HitRollup.DAY)
+            .values("url_key")
+            .annotate(hits=Sum("hits"), last_day=Max("start"))
+        )
+        week = dict(
+            rollups.filter(period=models.HitRollup.DAY, start__gte=week_start)
+            .values("url_key")
+            .annotate(hits=Sum("hits"))
+            .values_list("url_key", "hits")
         )
+        keys = sorted(
+            (
+                {
+                    "action": states[row["url_key"]].action,
+                    "hits": row["hits"],
+                    "week_hits": week.get(row["url_key"], 0),
+                    "last_day": row["last_day"],
+                }
+                for row in totals
+            ),
+            key=lambda row: (-row["hits"], row["action"].url_key),
+        )
+        context.update(
+            key_count=len(states),
+            keys=keys,
+            total_hits=sum(row["hits"] for row in keys),
+            week_hits=sum(week.values()),
+            today_hits=daily[-1]["hits"],
+            daily=daily,
+            hourly=hourly,
+        )
+        return context
+
+    @staticmethod
+    def _series(rollups, period, last, step, count):
+        """Hits per bucket for the `count` buckets up to `last`, zero-filled"""
+        first = last - step * (count - 1)
+        hits = dict(
+            rollups.filter(period=period, start__gte=first)
+            .values("start")
+            .annotate(hits=Sum("hits"))
+            .values_list("start", "hits")
+        )
+        peak = max(hits.values(), default=0) or 1
+        return [
+            {
+                "start": first + step * i,
+                "hits": hits.get(first + step * i, 0),
+                "height": round(100 * hits.get(first + step * i, 0) / peak),
+            }
+            for i in range(count)
+        ]
 
 
 class CreateForm(forms.ModelForm):
@@ -93,6 +183,9 @@ class CreateForm(forms.ModelForm):
         url_key = self.cleaned_data.get("url_key", "")
         if url_key and not re.match(r'^[a-zA-Z0-9-]+$', url_key):
             raise forms.ValidationError("URL key can only contain letters, numbers, and hyphens.")
+        action_type = self.cleaned_data.get("action_type")
+        if action_type == "create" and live_keys.is_taken(url_key):
+            raise forms.ValidationError("This URL key is already taken.")
         return url_key
 
     def clean_long_url(self):
@@ -114,29 +207,10 @@ class Create(generic.CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user  # set user foreign key
-        return super().form_valid(form)
+        # saved as pending; the upstream call is made by the outbox worker
+        self.object = outbox.enqueue(form.save(commit=False))
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
-        # perform the url action
-        action = url_actions[self.object.action_type]
-        kwargs = {"key": self.object.url_key}
-        if action in (create, update):
-            kwargs["long_url"] = self.object.long_url
-        response = action(**kwargs)
-        logger.info("Response: %s", response)
-        if action == update:
-            # handle two sets of responses: one for create and one for delete
-            self.object.response_code = max(
-                [item["response_code"] for item in response]
-            )
-            self.object.response_json = [item["response_json"] for item in response]
-        else:
-            self.object.response_code = response["response_code"]
-            self.object.response_json = response["response_json"]
-        self.object.save()
-        if not self.object.was_successfull():
-            logger.error("Error creating UrlAction object: %s", self.object)
-
-        # get success url
         url = reverse("detail", kwargs={"pk": self.object.pk})
         return url + "?source=create"
@@ -0,0 +1,154 @@
+"""
+Hit analytics over columnar NumPy arrays.
+
+A key's hits are loaded once into parallel arrays (epoch seconds, IP, and the
+IP's country and region), and every summary is computed from them with
+vectorized passes rather than a loop over hits.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+HOUR = 3600
+DAY = 24 * HOUR
+# 1970-01-01 was a Thursday, three days after the start of its week
+EPOCH_WEEKDAY = 3
+
+
+class HitArrays:
+    """
+    A key's hits as columns.
+
+    Args:
+    timestamps (sequence): Hit times as epoch seconds, or aware datetimes.
+    ips (sequence): IP address of each hit.
+    locations (dict): Location data (ip-api.com style) by IP; IPs missing
+        from it count as unknown.
+    """
+
+    def __init__(
+        self,
+        timestamps: Sequence,
+        ips: Sequence[str],
+        locations: Optional[Dict[str, dict]] = None,
+    ):
+        if len(timestamps) and isinstance(timestamps[0], datetime):
+            timestamps = [t.timestamp() for t in timestamps]
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.ips, self.ip_index = np.unique(
+            np.asarray(ips, dtype=str), return_inverse=True
+        )
+        locations = locations or {}
+        ip_locations = [locations.get(ip) or {} for ip in self.ips]
+        self.ip_countries = np.array(
+            [loc.get("countryCode") or "unknown" for loc in ip_locations], dtype=str
+        )
+        self.ip_regions = np.array(
+            [
+                f"{loc['regionName']}, {loc.get('countryCode', '')}"
+                if loc.get("regionName")
+                else "unknown"
+                for loc in ip_locations
+            ],
+            dtype=str,
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def local_timestamps(self, tz: str) -> np.ndarray:
+        """Timestamps shifted by the UTC offset in `tz` at each hit"""
+        if not len(self):
+            return self.timestamps
+        # offsets only change on the hour, so look each hour up once
+        hours, inverse = np.unique(self.timestamps // HOUR, return_inverse=True)
+        zone = ZoneInfo(tz)
+        offsets = np.array(
+            [
+                datetime.fromtimestamp(int(hour) * HOUR, zone).utcoffset()
+                // timedelta(seconds=1)
+                for hour in hours
+            ],
+            dtype=np.int64,
+        )
+        return self.timestamps + offsets[inverse]
+
+    def ip_hits(self) -> np.ndarray:
+        """Number of hits from each of `ips`"""
+        return np.bincount(self.ip_index, minlength=len(self.ips))
+
+
+def _buckets(values: np.ndarray, width: int, start: int = 0) -> Iterable:
+    """Count values per bucket of `width`; yield (bucket start, count) in order"""
+    buckets, counts = np.unique((values - start) // width, return_counts=True)
+    return zip(buckets * width + start, counts)
+
+
+def _top(labels: np.ndarray, weights: np.ndarray, limit: int) -> list:
+    """Sum weights per label; return the `limit` largest as (label, total)"""
+    if not len(labels):
+        return []
+    unique, inverse = np.unique(labels, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights, minlength=len(unique))
+    order = np.lexsort((unique, -totals))[:limit]
+    return [(str(unique[i]), int(totals[i])) for i in order]
+
+
+def _local_iso(seconds: int, fmt: str) -> str:
+    """Format local epoch seconds, already shifted by the UTC offset"""
+    return (datetime(1970, 1, 1) + timedelta(seconds=int(seconds))).strftime(fmt)
+
+
+def summarize(hits: HitArrays, tz: str = "UTC", top: int = 10) -> dict:
+    """
+    Summarize a key's hits.
+
+    Hourly, daily and weekly counts, hours of the day and peak hours are in
+    local time in `tz`; weeks start on Monday. Periods without hits are left
+    out of the counts.
+
+    Returns:
+    dict: JSON-serializable summary.
+    """
+    local = hits.local_timestamps(tz)
+    ip_hits = hits.ip_hits()
+    hours_of_day = np.bincount((local // HOUR) % 24, minlength=24)
+    peak_hours = [
+        int(hour)
+        for hour in np.argsort(-hours_of_day, kind="stable")[:3]
+        if hours_of_day[hour]
+    ]
+    week_start = -EPOCH_WEEKDAY * DAY
+    first, last = (local.min(), local.max()) if len(hits) else (None, None)
+    return {
+        "timezone": tz,
+        "total_hits": len(hits),
+        "unique_ips": int(np.count_nonzero(ip_hits)),
+        "first_hit": None if first is None else _local_iso(first, "%Y-%m-%dT%H:%M:%S"),
+        "last_hit": None if last is None else _local_iso(last, "%Y-%m-%dT%H:%M:%S"),
+        "hourly": [
+            {"hour": _local_iso(start, "%Y-%m-%dT%H:00"), "hits": int(count)}
+            for start, count in _buckets(local, HOUR)
+        ],
+        "daily": [
+            {"date": _local_iso(start, "%Y-%m-%d"), "hits": int(count)}
+            for start, count in _buckets(local, DAY)
+        ],
+        "weekly": [
+            {"week_of": _local_iso(start, "%Y-%m-%d"), "hits": int(count)}
+            for start, count in _buckets(local, 7 * DAY, week_start)
+        ],
+        "hours_of_day": hours_of_day.tolist(),
+        "peak_hours": peak_hours,
+        "top_countries": [
+            {"country": country, "hits": count}
+            for country, count in _top(hits.ip_countries, ip_hits, top)
+        ],
+        "top_regions": [
+            {"region": region, "hits": count}
+            for region, count in _top(hits.ip_regions, ip_hits, top)
+        ],
+    }
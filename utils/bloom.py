@@ -0,0 +1,62 @@
+import hashlib
+import math
+import threading
+from typing import Iterable
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed amount of memory, with false positives.
+
+    `key in bloom` is False only for keys never added; for added keys it is
+    always True, and for others it is True at about `error_rate` once
+    `capacity` distinct keys have been added (more often past that). Keys
+    can't be removed. Adds are thread-safe; lookups take no lock.
+
+    Args:
+    capacity (int): Number of keys the error rate is sized for.
+    error_rate (float): Share of false positives at capacity.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # two 64 bit hashes, combined into `hashes` positions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "little")
+        b = int.from_bytes(digest[8:], "little") | 1
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            added = False
+            for position in positions:
+                byte, bit = position >> 3, 1 << (position & 7)
+                if not self.bits[byte] & bit:
+                    self.bits[byte] |= bit
+                    added = True
+            # keys already (or seemingly) in the filter aren't counted again
+            self.count += added
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def __len__(self):
+        """Number of distinct keys added, less a few taken for false positives"""
+        return self.count
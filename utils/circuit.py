@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Callable
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker that stops calls to a failing upstream.
+
+    Callers check `allow` before a call and report it with `succeeded` or
+    `failed`. After `failure_threshold` failures in a row the circuit opens
+    and `allow` refuses every call for `reset_timeout` seconds. Then it lets
+    a single trial call through: success closes the circuit again, failure
+    reopens it. A trial that is never reported is given up on after another
+    `reset_timeout`.
+
+    Args:
+    failure_threshold (int): Consecutive failures that open the circuit.
+    reset_timeout (float): Seconds to stay open before a trial call.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return self.CLOSED
+            if self.trial_at is None:
+                return self.OPEN
+            return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may be made now; if so, it must be reported"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = self.clock()
+            if self.trial_at is not None:
+                if now < self.trial_at + self.reset_timeout:
+                    return False  # a trial call is in flight
+            elif now < self.opened_at + self.reset_timeout:
+                return False
+            self.trial_at = now
+            return True
+
+    def retry_in(self) -> float:
+        """Seconds until `allow` may let a call through again"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            since = self.opened_at if self.trial_at is None else self.trial_at
+            return max(since + self.reset_timeout - self.clock(), 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = self.trial_at = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self.trial_at = None
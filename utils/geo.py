@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+
+import requests
+
+from .metrics import record_call
+
+logger = logging.getLogger(__name__)
+
+# overridable so a local stand-in server can be used offline
+GEO_API_URL = os.getenv("GEO_API_URL", "http://ip-api.com")
+# ip-api.com accepts at most 100 addresses per /batch request
+BATCH_SIZE = 100
+MAX_WORKERS = 4
+TIMEOUT = 10
+
+
+def lookup_batch(ips: List[str]) -> Dict[str, dict]:
+    """
+    Look up the location of a batch of IP addresses in a single request.
+
+    Args:
+    ips (list): IP addresses to look up, at most BATCH_SIZE of them.
+
+    Returns:
+    dict: Location data keyed by IP address.
+    """
+    start, status = time.monotonic(), None
+    try:
+        response = requests.post(
+            f"{GEO_API_URL}/batch", data=json.dumps(ips), timeout=TIMEOUT
+        )
+        status = response.status_code
+    finally:
+        record_call("geo", "/batch", status, time.monotonic() - start)
+    response.raise_for_status()
+    return {item["query"]: item for item in response.json()}
+
+
+def _lookup_batch_safe(ips: List[str]) -> Dict[str, dict]:
+    try:
+        return lookup_batch(ips)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.warning("Geo lookup of %s IPs failed: %s", len(ips), e)
+        return {}
+
+
+def lookup(
+    ips: Iterable[str], batch_size: int = BATCH_SIZE, max_workers: int = MAX_WORKERS
+) -> Dict[str, dict]:
+    """
+    Look up the location of many IP addresses.
+
+    Duplicate addresses are looked up once, and batches run concurrently. A
+    failing batch is logged and left out of the result rather than raised.
+
+    Args:
+    ips (iterable): IP addresses to look up.
+    batch_size (int): Number of addresses per upstream request.
+    max_workers (int): Maximum number of concurrent upstream requests.
+
+    Returns:
+    dict: Location data keyed by IP address.
+    """
+    ips = list(dict.fromkeys(ips))
+    batches = [ips[i : i + batch_size] for i in range(0, len(ips), batch_size)]
+    if not batches:
+        return {}
+    locations = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+        for result in pool.map(_lookup_batch_safe, batches):
+            locations.update(result)
+    return locations
@@ -0,0 +1,364 @@
+"""
+Counters and histograms exposed in the Prometheus text format.
+
+Each process aggregates its own metrics in memory and writes them to a JSON
+file of its own in METRICS_DIR, from a background thread every
+`flush_interval` seconds while they change and on exit, so requests never
+wait on the file. `Registry.collect` adds up the files of every process, so a scrape
+of any one gunicorn worker reports the totals of all of them. The files of
+processes that have exited are merged into one, EXITED_FILE, as part of a
+scrape, so the directory holds a file per running process plus that one.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_DIR = os.getenv(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "dynamicqr-metrics")
+)
+
+# where the counts of exited processes are kept, and the lock taken to read
+# the directory (shared) or to merge files into EXITED_FILE (exclusive)
+EXITED_FILE = "exited.json"
+LOCK_FILE = ".lock"
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(name: str, labels: Iterable[Tuple[str, str]], value: float) -> str:
+    pairs = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+    return f"{name}{{{pairs}}} {value:g}" if pairs else f"{name} {value:g}"
+
+
+def _pid_exited(name: str) -> bool:
+    """Whether the process a metrics file is named after has exited"""
+    pid = name.split("-", 1)[0]
+    if not pid.isdigit():
+        return False  # EXITED_FILE, or not one of ours
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # running, as another user
+    return False
+
+
+def _add_up(snapshots: Iterable[dict]) -> Tuple[dict, dict]:
+    """Counter values and histogram counts of `snapshots`, by (name, labels)"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, _labels(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts in snapshot["histograms"]:
+            key = (name, _labels(labels))
+            total = histograms.setdefault(key, [0] * len(counts))
+            if len(total) == len(counts):  # unless the buckets changed
+                histograms[key] = [a + b for a, b in zip(total, counts)]
+    return counters, histograms
+
+
+def _snapshot(counters: dict, histograms: dict) -> dict:
+    """The file form of values as returned by _add_up"""
+    return {
+        "counters": [
+            [name, dict(labels), value] for (name, labels), value in counters.items()
+        ],
+        "histograms": [
+            [name, dict(labels), list(counts)]
+            for (name, labels), counts in histograms.items()
+        ],
+    }
+
+
+def _read(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # removed or replaced while being read
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write(path: str, data: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class Counter:
+    def __init__(self, registry: "Registry", name: str, help: str):
+        self.registry = registry
+        self.name = name
+        self.help = help
+
+    def inc(self, amount: float = 1, **labels):
+        self.registry._add(self.name, _labels(labels), amount)
+
+
+class Histogram:
+    def __init__(
+        self,
+        registry: "Registry",
+        name: str,
+        help: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        self.registry._observe(self, _labels(labels), value)
+
+
+class Registry:
+    """
+    Thread-safe store of metric values, shared between processes on disk.
+
+    Args:
+    directory (str): Where each process keeps its file; None keeps metrics
+        in this process only.
+    flush_interval (float): Seconds between background writes of this
+        process's file.
+    """
+
+    def __init__(
+        self, directory: Optional[str] = METRICS_DIR, flush_interval: float = 1.0
+    ):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Start from zero, e.g. in a forked child, with a file of its own"""
+        self._pid = os.getpid()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # per bucket counts (not cumulative), then the sum and count
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._path = None
+        if self.directory:
+            name = f"{self._pid}-{uuid.uuid4().hex[:8]}.json"
+            self._path = os.path.join(self.directory, name)
+        self._changed = False
+        self._flusher = None  # threads don't survive a fork
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(self, name, help))
+
+    def histogram(self, name: str, help: str, **kwargs) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(self, name, help, **kwargs))
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def _add(self, name: str, labels: Labels, amount: float):
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._schedule_flush()
+
+    def _observe(self, histogram: Histogram, labels: Labels, value: float):
+        with self._lock:
+            self._check_pid()
+            key = (histogram.name, labels)
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(histogram.buckets) + 3)
+            index = next(
+                (i for i, le in enumerate(histogram.buckets) if value <= le),
+                len(histogram.buckets),
+            )
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+            self._schedule_flush()
+
+    def snapshot(self) -> dict:
+        """This process's values, in the form written to its file"""
+        with self._lock:
+            self._check_pid()
+            return _snapshot(self._counters, self._histograms)
+
+    def _schedule_flush(self):
+        """Note a change, for the flusher thread to write out; call with _lock"""
+        self._changed = True
+        if self._path and self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_changes,
+                args=(self._pid,),
+                name="metrics-flusher",
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _flush_changes(self, pid: int):
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            if self._changed and self._pid == pid:
+                self.flush()
+
+    def flush(self):
+        """Write this process's values to its file"""
+        if not self._path:
+            return
+        with self._flush_lock:
+            self._changed = False
+            data = self.snapshot()
+            os.makedirs(self.directory, exist_ok=True)
+            _write(self._path, data)
+
+    def _lock_directory(self, operation: int):
+        """Open and flock the directory's LOCK_FILE; closing the file unlocks it"""
+        f = open(os.path.join(self.directory, LOCK_FILE), "a")
+        fcntl.flock(f, operation)
+        return f
+
+    def merge_exited(self):
+        """
+        Fold the files of exited processes into EXITED_FILE and remove them.
+
+        EXITED_FILE lists the files it took in last. They are removed after
+        it is written, and again by the next merge if that didn't happen, so
+        a merge cut short neither loses nor double counts anything.
+        """
+        if not self._path:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock_directory(fcntl.LOCK_EX):
+            exited_path = os.path.join(self.directory, EXITED_FILE)
+            exited = _read(exited_path) or _snapshot({}, {})
+            for name in exited.get("merged", []):
+                _remove(os.path.join(self.directory, name))
+            merged = {}
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not _pid_exited(name):
+                    continue
+                if name.endswith(".json.tmp"):
+                    _remove(path)  # it died while flushing
+                elif name.endswith(".json"):
+                    merged[name] = _read(path) or _snapshot({}, {})
+            if not merged:
+                return
+            totals = _snapshot(*_add_up([exited, *merged.values()]))
+            _write(exited_path, dict(totals, merged=list(merged)))
+            for name in merged:
+                _remove(os.path.join(self.directory, name))
+
+    def collect(self) -> Tuple[dict, dict]:
+        """
+        Add up the values of every process, merging those of exited ones first.
+
+        Returns:
+        tuple: Counter values and histogram counts, by (name, labels).
+        """
+        if not self._path:
+            return _add_up([self.snapshot()])
+        self.flush()
+        self.merge_exited()
+        with self._lock_directory(fcntl.LOCK_SH):
+            snapshots = [
+                _read(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory)
+                if name.endswith(".json")
+            ]
+        return _add_up(snapshot for snapshot in snapshots if snapshot)
+
+    def render(self) -> str:
+        """Every registered metric in the Prometheus text format"""
+        counters, histograms = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            kind = "histogram" if isinstance(metric, Histogram) else "counter"
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(_format(name, labels, value))
+                continue
+            for (key_name, labels), counts in sorted(histograms.items()):
+                if key_name != name or len(counts) != len(metric.buckets) + 3:
+                    continue
+                cumulative = 0
+                bounds = [f"{le:g}" for le in metric.buckets] + ["+Inf"]
+                for le, count in zip(bounds, counts):
+                    cumulative += count
+                    lines.append(
+                        _format(f"{name}_bucket", labels + (("le", le),), cumulative)
+                    )
+                lines.append(_format(f"{name}_sum", labels, counts[-2]))
+                lines.append(_format(f"{name}_count", labels, counts[-1]))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+upstream_calls = registry.counter(
+    "dynamicqr_upstream_calls_total",
+    "Calls to upstream services, by upstream, endpoint and status",
+)
+upstream_call_seconds = registry.histogram(
+    "dynamicqr_upstream_call_duration_seconds",
+    "Latency of calls to upstream services, including retries",
+)
+
+
+def record_call(upstream: str, endpoint: str, status: Optional[int], seconds: float):
+    """
+    Count an upstream call and its latency.
+
+    Args:
+    upstream (str): "shortener", "quickchart" or "geo".
+    endpoint (str): The path called.
+    status (int): Response status code; None if no response was received.
+    seconds (float): How long the call took.
+    """
+    status = "error" if status is None else status
+    upstream_calls.inc(upstream=upstream, endpoint=endpoint, status=status)
+    upstream_call_seconds.observe(seconds, upstream=upstream, endpoint=endpoint)
+
+
+limiter_wait_seconds = registry.histogram(
+    "dynamicqr_rate_limiter_wait_seconds",
+    "Time calls waited for a rate limiter token, by limiter",
+)
+
+
+def record_limiter_wait(limiter: str, seconds: float):
+    """Record how long a call waited for `limiter`, e.g. "shortener"; 0 if not"""
+    limiter_wait_seconds.observe(seconds, limiter=limiter)
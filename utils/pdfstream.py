@@ -0,0 +1,222 @@
+"""
+Write a PDF a page at a time.
+
+FPDF holds the whole document until `output`; PdfStream instead returns each
+page's objects as bytes as soon as the page is written, so a document of any
+length can be sent or saved while it is being laid out, with memory bounded
+by one page. Pages are laid out as Page objects, which can be built apart
+(even in other processes) and written in order.
+
+It covers what the QR sheets need: PNG images as parsed by utils.qr.parse_png
+and text in Helvetica (FPDF's "Arial"), placed in millimetres from the top
+left of a US letter page, as FPDF does.
+"""
+
+import zlib
+from typing import List
+
+# points per millimetre
+K = 72 / 25.4
+LETTER = (612.0, 792.0)
+
+# reserved object numbers; the page tree is written last, once all pages are known
+PAGES_OBJ = 1
+FONT_OBJ = 2
+
+
+def _bytes(data) -> bytes:
+    """fpdf's parser returns some binary fields as latin-1 strings"""
+    return data.encode("latin-1") if isinstance(data, str) else data
+
+
+def _escape(text: str) -> bytes:
+    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return text.encode("latin-1", "replace")
+
+
+class Page:
+    """
+    The images and text of one page, placed in millimetres from its top left.
+
+    Written out with PdfStream.write_page; pages are picklable.
+    """
+
+    def __init__(self, page_size=LETTER):
+        self.height = page_size[1]
+        self.images = []
+        self.content = []
+
+    def __bool__(self):
+        return bool(self.content)
+
+    def image(self, info: dict, x: float, y: float, w: float):
+        """Place a PNG `w` mm wide with its top left corner at (x, y) mm"""
+        h = w * info["h"] / info["w"]
+        self.images.append(info)
+        self.content.append(
+            b"q %.2f 0 0 %.2f %.2f %.2f cm /I%d Do Q"
+            % (w * K, h * K, x * K, self.height - (y + h) * K, len(self.images))
+        )
+
+    def text(self, x: float, y: float, text: str, size: float = 8):
+        """Write `text` with its baseline starting at (x, y) mm"""
+        self.content.append(
+            b"BT /F1 %.2f Tf %.2f %.2f Td (%s) Tj ET"
+            % (size, x * K, self.height - y * K, _escape(text))
+        )
+
+
+class PdfStream:
+    """
+    Incremental PDF writer.
+
+    Call `header` first, then `write_page` for each Page, and finish with
+    `close`; each returns the bytes to write next.
+    """
+
+    def __init__(self, page_size=LETTER):
+        self.page_size = page_size
+        self.size = 0
+        self.n = FONT_OBJ
+        self.offsets = {}
+        self.page_objs: List[int] = []
+
+    def _obj(self, n: int, body: bytes, stream: bytes = None) -> bytes:
+        """Serialize object `n`, recording where it starts"""
+        self.offsets[n] = self.size
+        data = b"%d 0 obj\n" % n + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        data += b"\nendobj\n"
+        self.size += len(data)
+        return data
+
+    def _new_obj(self) -> int:
+        self.n += 1
+        return self.n
+
+    def header(self) -> bytes:
+        data = b"%PDF-1.3\n"
+        self.size += len(data)
+        return data + self._obj(
+            FONT_OBJ,
+            b"<</Type /Font /Subtype /Type1 /BaseFont /Helvetica"
+            b" /Encoding /WinAnsiEncoding>>",
+        )
+
+    def _image_objs(self, info: dict):
+        """Serialize an image after its palette and soft mask; return (number, bytes)"""
+        n = self._new_obj()
+        extra = b""
+        chunks = []
+        if info["cs"] == "Indexed":
+            palette = self._new_obj()
+            extra += b" /ColorSpace [/Indexed /DeviceRGB %d %d 0 R]" % (
+                len(info["pal"]) // 3 - 1,
+                palette,
+            )
+            pal = zlib.compress(_bytes(info["pal"]))
+            chunks.append(
+                self._obj(
+                    palette,
+                    b"<</Filter /FlateDecode /Length %d>>" % len(pal),
+                    pal,
+                )
+            )
+        else:
+            extra += b" /ColorSpace /" + info["cs"].encode()
+            if info["cs"] == "DeviceCMYK":
+                extra += b" /Decode [1 0 1 0 1 0 1 0]"
+        extra += b" /BitsPerComponent %d" % info["bpc"]
+        if "f" in info:
+            extra += b" /Filter /" + info["f"].encode()
+        if "dp" in info:
+            extra += b" /DecodeParms <<" + info["dp"].encode() + b">>"
+        if isinstance(info.get("trns"), list):
+            extra += b" /Mask [" + b"".join(b"%d %d " % (t, t) for t in info["trns"])
+            extra += b"]"
+        if "smask" in info:
+            mask, mask_data = self._image_objs(
+                {
+                    "w": info["w"],
+                    "h": info["h"],
+                    "cs": "DeviceGray",
+                    "bpc": 8,
+                    "f": info["f"],
+                    "dp": "/Predictor 15 /Colors 1 /BitsPerComponent 8 /Columns %d"
+                    % info["w"],
+                    "data": info["smask"],
+                }
+            )
+            extra += b" /SMask %d 0 R" % mask
+            chunks.append(mask_data)
+        data = _bytes(info["data"])
+        chunks.append(
+            self._obj(
+                n,
+                b"<</Type /XObject /Subtype /Image /Width %d /Height %d%s /Length %d>>"
+                % (info["w"], info["h"], extra, len(data)),
+                data,
+            )
+        )
+        return n, b"".join(chunks)
+
+    def write_page(self, page: Page) -> bytes:
+        """Serialize a page and its images"""
+        chunks = []
+        xobjects = []
+        for i, info in enumerate(page.images, 1):
+            n, data = self._image_objs(info)
+            xobjects.append(b"/I%d %d 0 R" % (i, n))
+            chunks.append(data)
+        content = zlib.compress(b"\n".join(page.content))
+        contents = self._new_obj()
+        chunks.append(
+            self._obj(
+                contents,
+                b"<</Filter /FlateDecode /Length %d>>" % len(content),
+                content,
+            )
+        )
+        page = self._new_obj()
+        self.page_objs.append(page)
+        chunks.append(
+            self._obj(
+                page,
+                b"<</Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f]"
+                b" /Resources <</ProcSet [/PDF /Text /ImageB /ImageC /ImageI]"
+                b" /Font <</F1 %d 0 R>> /XObject <<%s>>>> /Contents %d 0 R>>"
+                % (
+                    PAGES_OBJ,
+                    *self.page_size,
+                    FONT_OBJ,
+                    b" ".join(xobjects),
+                    contents,
+                ),
+            )
+        )
+        return b"".join(chunks)
+
+    def close(self) -> bytes:
+        """Write the page tree, catalog and cross-reference table"""
+        kids = b" ".join(b"%d 0 R" % n for n in self.page_objs)
+        chunks = [
+            self._obj(
+                PAGES_OBJ,
+                b"<</Type /Pages /Kids [%s] /Count %d>>" % (kids, len(self.page_objs)),
+            )
+        ]
+        catalog = self._new_obj()
+        chunks.append(
+            self._obj(catalog, b"<</Type /Catalog /Pages %d 0 R>>" % PAGES_OBJ)
+        )
+        xref = self.size
+        chunks.append(b"xref\n0 %d\n0000000000 65535 f \n" % (self.n + 1))
+        chunks.extend(
+            b"%010d 00000 n \n" % self.offsets[n] for n in range(1, self.n + 1)
+        )
+        chunks.append(
+            b"trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n"
+            % (self.n + 1, catalog, xref)
+        )
+        return b"".join(chunks)
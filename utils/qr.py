@@ -1,12 +1,45 @@
-from functools import lru_cache
+import fcntl
+import glob
+import hashlib
+import io
+import json
 import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from types import FunctionType
 from fpdf import FPDF
+import fpdf.fpdf
 import requests
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 from collections import deque
+from urllib.parse import parse_qs, urlsplit
 
+if __name__ == "__main__" and not __package__:
+    # run as a script, python utils/qr.py: import the rest of utils as a package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "utils"
 
-cache_get = lru_cache(requests.get)
+from .metrics import record_call
+from .pdfstream import Page, PdfStream
+from .qrcache import QrImageCache
+from .qrencode import encode, to_png, to_svg
+
+
+# QR images by hash of their parameters, shared by all processes on the host
+qr_cache = QrImageCache()
+
+# "local" renders quickchart.io QR URLs in-process, "quickchart" fetches them
+QR_RENDERER = os.getenv("QR_RENDERER", "local")
+# number of QR images fetched or rendered concurrently while laying out a PDF
+PDF_IMAGE_WORKERS = int(os.getenv("PDF_IMAGE_WORKERS", 8))
+# pages laid out per task when a PDF is generated on a process pool
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", 10))
+# held by the run using a directory of chunks, so no other run takes it over
+PARTS_LOCK = ".lock"
 
 
 def gen_qr(url: str, chs: int = 100) -> str:
@@ -24,6 +57,175 @@ def gen_qr(url: str, chs: int = 100) -> str:
     return base_url + url
 
 
+def render_qr(
+    text: str,
+    size: int = 150,
+    fmt: str = "png",
+    error_correction: str = "M",
+    margin: int = 4,
+) -> bytes:
+    """
+    Render a QR code image in-process.
+
+    Args:
+    text (str): The text to encode.
+    size (int): Width and height of the image. Defaults to 150.
+    fmt (str): "png" or "svg". Defaults to "png".
+    error_correction (str): One of "L", "M", "Q" or "H". Defaults to "M".
+    margin (int): Width of the quiet zone in modules. Defaults to 4.
+
+    Returns:
+    bytes: The image file contents.
+    """
+    writer = to_svg if fmt == "svg" else to_png
+    return writer(encode(text, error_correction), size, margin)
+
+
+def qr_image(url: str) -> bytes:
+    """
+    Get the image for a QR code URL.
+
+    quickchart.io QR URLs are rendered locally from the same query parameters
+    (text, size, format, ecLevel, margin) unless QR_RENDERER is "quickchart";
+    any other URL is fetched. Images are stored in `qr_cache`, by renderer.
+
+    Args:
+    url (str): The QR code URL, e.g. as returned by gen_qr.
+
+    Returns:
+    bytes: The image file contents.
+    """
+    # images of the two renderers differ, so each has entries of its own
+    return qr_cache.get_or_set(url, lambda: _make_qr_image(url), QR_RENDERER)
+
+
+def fetch_qr(url: str) -> bytes:
+    """Fetch a QR image, raising for anything but a successful response"""
+    start, status = time.monotonic(), None
+    try:
+        response = requests.get(url, timeout=30)
+        status = response.status_code
+    finally:
+        record_call("quickchart", urlsplit(url).path, status, time.monotonic() - start)
+    response.raise_for_status()
+    return response.content
+
+
+def _make_qr_image(url: str) -> bytes:
+    parts = urlsplit(url)
+    is_quickchart = parts.netloc == "quickchart.io" and parts.path == "/qr"
+    if QR_RENDERER == "local" and is_quickchart:
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        return render_qr(
+            params["text"],
+            size=int(params.get("size", 150)),
+            fmt=params.get("format", "png"),
+            error_correction=params.get("ecLevel", "M"),
+            margin=int(params.get("margin", 4)),
+        )
+    return fetch_qr(url)
+
+
+def parse_png(data: bytes) -> dict:
+    """
+    Parse PNG bytes into the image info dict FPDF embeds.
+
+    fpdf 1.7.2 can only read images from a path, so its PNG parser is run with
+    `open` bound to an in-memory buffer instead of the filesystem.
+    """
+    parser = FunctionType(
+        FPDF._parsepng.__code__,
+        dict(vars(fpdf.fpdf), open=lambda name, mode: io.BytesIO(data)),
+    )
+    return parser(FPDF(), "<memory>")
+
+
+def prefetch(
+    func: Callable, items: Iterable, max_workers: int = PDF_IMAGE_WORKERS
+) -> Iterator:
+    """
+    Map func over items on a thread pool, yielding results in order.
+
+    At most `max_workers * 2` calls are in flight or waiting to be consumed, so
+    memory stays bounded however many items there are.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _qr_png_info(url: str) -> dict:
+    return parse_png(qr_image(url))
+
+
+def stream_qr_pdf(
+    qr_code_urls: Iterable[str],
+    descriptions: Optional[Iterable[str]] = None,
+    **layout,
+) -> Iterator[bytes]:
+    """
+    Lay out QR codes in a grid on letter pages, yielding the PDF as it goes.
+
+    Each page's bytes are yielded as soon as its last code is placed, and
+    images are fetched or rendered a few ahead on a thread pool, so memory
+    stays bounded by a page however many codes there are. `qr_code_urls`
+    and `descriptions` may be lazy iterables.
+
+    Args:
+    qr_code_urls (iterable): URLs of the QR code images, e.g. from gen_qr.
+    descriptions (iterable): Text to print under each code; defaults to its URL.
+    layout: num_cols and num_rows of the grid on each page; col_offset,
+        row_offset, col_start and row_start, its spacing and top left corner
+        in mm; and size, the width of each code in mm.
+
+    Yields:
+    bytes: Consecutive parts of the PDF file.
+    """
+    pdf = PdfStream()
+    yield pdf.header()
+    for page in _layout_pages(qr_code_urls, descriptions, **layout):
+        yield pdf.write_page(page)
+    yield pdf.close()
+
+
+def _layout_pages(
+    qr_code_urls: Iterable[str],
+    descriptions: Optional[Iterable[str]] = None,
+    num_cols: int = 6,
+    num_rows: int = 8,
+    col_offset: float = 31.7,
+    row_offset: float = 31.7,
+    col_start: float = 14.8,
+    row_start: float = 14.8,
+    size: float = 30,
+) -> Iterator[Page]:
+    """Place QR codes and their descriptions on pages; yield each page when full"""
+    if descriptions is None:
+        labels = ((url, url) for url in qr_code_urls)
+    else:
+        labels = zip(qr_code_urls, descriptions)
+    per_page = num_cols * num_rows
+
+    page = Page()
+    images = prefetch(lambda label: (label[1], _qr_png_info(label[0])), labels)
+    for i, (description, info) in enumerate(images):
+        if i and i % per_page == 0:
+            yield page
+            page = Page()
+        row, col = divmod(i % per_page, num_cols)
+        x_pos = col_start + col * col_offset
+        y_pos = row_start + row * row_offset
+        page.image(info, x_pos, y_pos, size)
+        # include the description under each QR code
+        page.text(x_pos + 5, y_pos + 31, description)
+    yield page
+
+
 def generate_qr_pdf(
     qr_code_urls: List[str],
     filename: Optional[str] = "qr_codes.pdf",
@@ -35,74 +237,167 @@ def generate_qr_pdf(
     col_start: Optional[int] = 14.8,
     row_start: Optional[int] = 14.8,
     size: Optional[int] = 30,
+    workers: int = 1,
 ):
     """
     Generate a PDF containing QR codes from the given list of QR code URLs.
 
+    The file is written page by page with stream_qr_pdf, or, with more than
+    one worker, laid out in chunks on a process pool and then merged.
+
     :param qr_code_urls: A list of URLs pointing to the QR codes.
+    :param workers: Number of processes to lay out pages in.
     :return: None
     """
-    from tqdm import trange
-
-    pdf = FPDF(format="letter")
-    pdf.add_page()
+    from tqdm import tqdm
 
-    if not descriptions:
-        descriptions = deque(qr_code_urls)
-    else:
+    if descriptions:
         assert len(descriptions) == len(
             qr_code_urls
         ), "Number of descriptions should match the number of QR codes"
-        descriptions = deque(descriptions)
-
-    def add_descriptions():
-        """
-        Add descriptions underneath each QR code in the PDF. Run once per page
-        """
-        for i in range(num_rows * num_cols):
-            if not descriptions:
-                return
-            description = descriptions.popleft()
-            # include the filename under each QR code
-            row, col = divmod(i, num_cols)
-            x_pos = col_start + 5 + col * col_offset
-            y_pos = row_start + 31 + row * row_offset
-            pdf.set_font("Arial", size=8)
-            pdf.text(x_pos, y_pos, description)
-
-    # arrange the QR codes in a grid
-    row, col = 0, 0
-    temp_files = []
-    for i in trange(len(qr_code_urls)):
-        url = qr_code_urls[i]
-        if i >= num_cols * num_rows:  # reset to new page
-            add_descriptions()
-            row, col = 0, 0
-            pdf.add_page()
-        row, col = divmod(i, num_cols)
-        row %= num_rows
-        x_pos = col_start + col * col_offset
-        y_pos = row_start + row * row_offset
-        response = cache_get(url)
-        temp_file = f"temp_qr_{row}_{col}.png"
-        with open(temp_file, "wb") as f:
-            f.write(response.content)
-        pdf.image(temp_file, x=x_pos, y=y_pos, w=size)
 
-        temp_files.append(temp_file)
+    layout = dict(
+        num_cols=num_cols,
+        num_rows=num_rows,
+        col_offset=col_offset,
+        row_offset=row_offset,
+        col_start=col_start,
+        row_start=row_start,
+        size=size,
+    )
+    if workers > 1 and qr_code_urls:
+        _generate_qr_pdf_parallel(
+            qr_code_urls, descriptions or qr_code_urls, filename, workers, layout
+        )
+    else:
+        chunks = stream_qr_pdf(
+            tqdm(qr_code_urls, total=len(qr_code_urls)), descriptions or None, **layout
+        )
+        with open(filename, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    print(f"QR codes generated and saved to {filename}")
 
-    # add descriptions under qr codes for the last page
-    add_descriptions()
 
-    # clean up temporary files
-    for file in temp_files:
-        try:
-            os.remove(file)
-        except FileNotFoundError as e:
-            pass
+def _lay_out_chunk(
+    path: str, qr_code_urls: List[str], descriptions: List[str], layout: dict
+):
+    """Lay out a page-aligned chunk of codes and save its pages to `path`"""
+    pages = list(_layout_pages(qr_code_urls, descriptions, **layout))
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(pages, f)
+    # renamed once complete, so a resumed run never picks up a partial chunk
+    os.replace(f"{path}.tmp", path)
+
+
+def _lock_parts_dir(parts_dir: str, create: bool = False) -> Optional[int]:
+    """Lock a directory of chunks for this run; None if another run holds it"""
+    flags = os.O_RDWR | (os.O_CREAT if create else 0)
+    try:
+        fd = os.open(os.path.join(parts_dir, PARTS_LOCK), flags)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    # the run that held it may have finished and removed it meanwhile
+    if not os.path.isdir(parts_dir):
+        os.close(fd)
+        return None
+    return fd
+
+
+def _parts_dir(filename: str, job: bytes) -> Tuple[str, int]:
+    """
+    A directory next to `filename` for a job's chunks, and the fd locking it.
+
+    Each run gets a directory of its own, named after a hash of the job, so
+    identical jobs running at once don't remove each other's chunks. One
+    left by a run that died is taken over, so its chunks are reused.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    job_hash = hashlib.sha256(job).hexdigest()[:16]
+    prefix = f"{os.path.basename(filename)}.parts-{job_hash}-"
+    pattern = os.path.join(directory, glob.escape(prefix) + "*")
+    for leftover in sorted(glob.glob(pattern)):
+        fd = _lock_parts_dir(leftover)
+        if fd is not None:
+            return leftover, fd
+    parts_dir = tempfile.mkdtemp(prefix=prefix, dir=directory)
+    return parts_dir, _lock_parts_dir(parts_dir, create=True)
+
+
+def _generate_qr_pdf_parallel(
+    qr_code_urls: List[str],
+    descriptions: List[str],
+    filename: str,
+    workers: int,
+    layout: dict,
+):
+    """
+    Lay out chunks of PDF_CHUNK_PAGES pages on a process pool, then merge them.
+
+    Chunks are saved in a directory from _parts_dir, so running the same job
+    again after a crash only lays out the chunks that weren't finished. Pages
+    are written in order, so the file is the same as the one stream_qr_pdf
+    makes. The directory is removed once the PDF is written.
+    """
+    job = json.dumps([qr_code_urls, descriptions, layout]).encode()
+    parts_dir, lock = _parts_dir(filename, job)
+    try:
+        _lay_out_and_merge(
+            qr_code_urls, descriptions, filename, workers, layout, parts_dir
+        )
+        shutil.rmtree(parts_dir)
+    finally:
+        os.close(lock)
 
-    pdf.output(filename)
-    print(f"QR codes generated and saved to {filename}")
+
+def _lay_out_and_merge(
+    qr_code_urls: List[str],
+    descriptions: List[str],
+    filename: str,
+    workers: int,
+    layout: dict,
+    parts_dir: str,
+):
+    """Lay out the chunks not yet in `parts_dir`, then write them to `filename`"""
+    from tqdm import tqdm
+
+    per_chunk = layout["num_cols"] * layout["num_rows"] * PDF_CHUNK_PAGES
+    chunks = [
+        (os.path.join(parts_dir, f"{i:06d}.pickle"), slice(start, start + per_chunk))
+        for i, start in enumerate(range(0, len(qr_code_urls), per_chunk))
+    ]
+    todo = [(path, part) for path, part in chunks if not os.path.exists(path)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _lay_out_chunk,
+                path,
+                qr_code_urls[part],
+                descriptions[part],
+                layout,
+            )
+            for path, part in todo
+        ]
+        progress = tqdm(total=len(chunks), initial=len(chunks) - len(todo))
+        for future in as_completed(futures):
+            future.result()
+            progress.update()
+        progress.close()
+
+    pdf = PdfStream()
+    with open(filename, "wb") as f:
+        f.write(pdf.header())
+        for path, _ in chunks:
+            with open(path, "rb") as chunk:
+                for page in pickle.load(chunk):
+                    f.write(pdf.write_page(page))
+        f.write(pdf.close())
 
 
 def gen_qr_range(
@@ -111,6 +406,7 @@ def gen_qr_range(
     num_codes: int,
     filename: Optional[str],
     is_test: Optional[bool] = False,
+    workers: int = 1,
     **position_kwargs,
 ):
     # https://quickchart.io/documentation/qr-codes/
@@ -129,6 +425,7 @@ def gen_qr_range(
         base_shortened_urls,
         filename,
         descriptions=descriptions,
+        workers=workers,
         **{kwarg: val for kwarg, val in position_kwargs.items() if val is not None},
     )
 
@@ -152,8 +449,11 @@ def cli_qr_list():
         required=False,
         default="qr_codes.pdf",
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Processes to lay out pages in"
+    )
     args = parser.parse_args()
-    generate_qr_pdf(args.qr_code_urls, args.filename)
+    generate_qr_pdf(args.qr_code_urls, args.filename, workers=args.workers)
 
 
 def cli_range():
@@ -169,6 +469,7 @@ def cli_range():
         col_start (int): Starting column index
         row_start (int): Starting row index
         size (int): Size of the QR codes
+        workers (int): Number of processes to lay out pages in
     """
     import argparse
 
@@ -206,6 +507,13 @@ def cli_range():
         help="Flag to indicate if this is a test run",
         required=False,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes to lay out pages in; an interrupted run resumes "
+        "from its finished chunks when run again",
+    )
     args = parser.parse_args()
 
     gen_qr_range(
@@ -214,6 +522,7 @@ def cli_range():
         args.num_codes,
         args.filename,
         is_test=args.test,
+        workers=args.workers,
         col_offset=args.col_offset,
         row_offset=args.row_offset,
         col_start=args.col_start,
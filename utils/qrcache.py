@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from .metrics import registry
+
+QR_CACHE_DIR = os.getenv(
+    "QR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dynamicqr-qr-cache")
+)
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# other processes write to the directory too, so its size is counted again
+# at least this often (seconds) while images are being stored
+QR_CACHE_RECOUNT_INTERVAL = float(os.getenv("QR_CACHE_RECOUNT_SECONDS", 60))
+
+cache_lookups = registry.counter(
+    "dynamicqr_qr_cache_lookups_total", "QR image cache lookups, by result"
+)
+cache_evictions = registry.counter(
+    "dynamicqr_qr_cache_evictions_total", "QR images removed from the cache"
+)
+
+
+def cache_key(url: str, variant: str = "") -> str:
+    """
+    Hash the QR parameters of a URL, ignoring the order of query parameters.
+
+    Args:
+    url (str): The QR code URL.
+    variant (str): Anything else the image depends on, e.g. how it's rendered.
+
+    Returns:
+    str: A hex digest identifying the image.
+    """
+    parts = urlsplit(url)
+    params = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    normalized = repr((variant, parts.netloc.lower(), parts.path, params))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class QrImageCache:
+    """
+    LRU cache of QR images on disk, bounded by total size in bytes.
+
+    Entries are files named by cache key, so the cache is shared by every
+    process using the same directory. Files are written atomically and their
+    modification time is bumped on each hit; when the cache grows past
+    `max_bytes` the least recently used files are removed. Each process
+    tracks the directory's size from its own writes and counts it again every
+    `recount_interval` seconds, to see the other processes' writes too.
+    """
+
+    def __init__(
+        self,
+        directory: str = QR_CACHE_DIR,
+        max_bytes: int = QR_CACHE_MAX_BYTES,
+        recount_interval: float = QR_CACHE_RECOUNT_INTERVAL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.recount_interval = recount_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # bytes on disk, counted lazily
+        self._counted_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            cache_lookups.inc(result="miss")
+            return None
+        with self._lock:
+            self.hits += 1
+        cache_lookups.inc(result="hit")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process since the read
+        return data
+
+    def set(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if time.monotonic() - self._counted_at >= self.recount_interval:
+                self._size = self._disk_usage()
+                self._counted_at = time.monotonic()
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_or_set(
+        self, url: str, create: Callable[[], bytes], variant: str = ""
+    ) -> bytes:
+        """
+        Get the image for a QR code URL, creating and storing it on a miss.
+
+        Nothing is stored if `create` raises, so failed fetches are retried.
+        `variant` is passed on to cache_key.
+        """
+        key = cache_key(url, variant)
+        data = self.get(key)
+        if data is None:
+            data = create()
+            self.set(key, data)
+        return data
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                yield stat.st_mtime, stat.st_size, os.path.join(root, name)
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Remove least recently used files until 90% of max_bytes is in use"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        self._counted_at = time.monotonic()
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+                cache_evictions.inc()
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
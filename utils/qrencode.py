@@ -0,0 +1,421 @@
+"""
+Pure Python QR code encoder.
+
+Encodes text in byte mode into a module matrix (ISO/IEC 18004, versions 1-40)
+and writes it out as PNG or SVG bytes, so QR images can be produced without a
+round trip to quickchart.io.
+"""
+
+import struct
+import zlib
+from typing import List, Tuple
+
+Matrix = List[List[bool]]
+
+# error correction level -> (index into the tables below, format bits)
+ERROR_CORRECTION_LEVELS = {"L": (0, 1), "M": (1, 0), "Q": (2, 3), "H": (3, 2)}
+
+# indexed by [level][version]; version 0 is unused
+ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),  # noqa: E501
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),  # noqa: E501
+)
+NUM_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),  # noqa: E501
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),  # noqa: E501
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),  # noqa: E501
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),  # noqa: E501
+)
+
+MASK_PATTERNS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+# finder-like 1:1:3:1:1 run with 4 light modules on one side, for penalty N3
+FINDER_LIKE = ("10111010000", "00001011101")
+
+
+def _num_raw_data_modules(version: int) -> int:
+    """Number of modules available for data and ECC codewords"""
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _num_data_codewords(version: int, level: int) -> int:
+    return (
+        _num_raw_data_modules(version) // 8
+        - ECC_CODEWORDS_PER_BLOCK[level][version]
+        * NUM_ERROR_CORRECTION_BLOCKS[level][version]
+    )
+
+
+def _alignment_positions(version: int) -> List[int]:
+    if version == 1:
+        return []
+    num_align = version // 7 + 2
+    step = (version * 8 + num_align * 3 + 5) // (num_align * 4 - 4) * 2
+    size = version * 4 + 17
+    return [6] + [size - 7 - i * step for i in reversed(range(num_align - 1))]
+
+
+def _gf_multiply(x: int, y: int) -> int:
+    """Multiply two elements of GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1"""
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _reed_solomon_divisor(degree: int) -> List[int]:
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return result
+
+
+def _reed_solomon_remainder(data: List[int], divisor: List[int]) -> List[int]:
+    result = [0] * len(divisor)
+    for b in data:
+        factor = b ^ result.pop(0)
+        result.append(0)
+        for i, coef in enumerate(divisor):
+            result[i] ^= _gf_multiply(coef, factor)
+    return result
+
+
+def _encode_data(data: bytes, level: int) -> Tuple[int, List[int]]:
+    """Pick the smallest version that fits and return it with the codewords"""
+    for version in range(1, 41):
+        count_bits = 8 if version < 10 else 16
+        capacity_bits = _num_data_codewords(version, level) * 8
+        if 4 + count_bits + len(data) * 8 <= capacity_bits:
+            break
+    else:
+        raise ValueError(f"Data too long for a QR code: {len(data)} bytes")
+
+    bits = [0, 1, 0, 0]  # byte mode indicator
+    bits += [(len(data) >> i) & 1 for i in reversed(range(count_bits))]
+    for b in data:
+        bits += [(b >> i) & 1 for i in reversed(range(8))]
+    bits += [0] * min(4, capacity_bits - len(bits))  # terminator
+    bits += [0] * (-len(bits) % 8)
+
+    codewords = [
+        int("".join(map(str, bits[i : i + 8])), 2) for i in range(0, len(bits), 8)
+    ]
+    pad = (0xEC, 0x11)
+    codewords += [pad[i % 2] for i in range(capacity_bits // 8 - len(codewords))]
+    return version, codewords
+
+
+def _add_ecc_and_interleave(version: int, level: int, data: List[int]) -> List[int]:
+    num_blocks = NUM_ERROR_CORRECTION_BLOCKS[level][version]
+    block_ecc_len = ECC_CODEWORDS_PER_BLOCK[level][version]
+    raw_codewords = _num_raw_data_modules(version) // 8
+    num_short_blocks = num_blocks - raw_codewords % num_blocks
+    short_block_len = raw_codewords // num_blocks
+
+    divisor = _reed_solomon_divisor(block_ecc_len)
+    blocks = []
+    k = 0
+    for i in range(num_blocks):
+        length = short_block_len - block_ecc_len + (0 if i < num_short_blocks else 1)
+        block = data[k : k + length]
+        k += length
+        ecc = _reed_solomon_remainder(block, divisor)
+        if i < num_short_blocks:
+            block.append(0)  # placeholder, skipped when interleaving
+        blocks.append(block + ecc)
+
+    result = []
+    for i in range(len(blocks[0])):
+        for j, block in enumerate(blocks):
+            if i != short_block_len - block_ecc_len or j >= num_short_blocks:
+                result.append(block[i])
+    return result
+
+
+class _Builder:
+    """Module matrix under construction, tracking which modules are fixed"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.is_function = [[False] * self.size for _ in range(self.size)]
+
+    def set_function(self, x: int, y: int, dark: bool):
+        self.modules[y][x] = dark
+        self.is_function[y][x] = True
+
+    def draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self.set_function(6, i, i % 2 == 0)
+            self.set_function(i, 6, i % 2 == 0)
+
+        for x, y in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    if 0 <= x + dx < size and 0 <= y + dy < size:
+                        dist = max(abs(dx), abs(dy))
+                        self.set_function(x + dx, y + dy, dist not in (2, 4))
+
+        positions = _alignment_positions(self.version)
+        last = len(positions) - 1
+        for i, x in enumerate(positions):
+            for j, y in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue  # overlaps a finder pattern
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set_function(x + dx, y + dy, max(abs(dx), abs(dy)) != 1)
+
+        # reserve the format areas; the real bits are drawn once a mask is chosen
+        self.draw_format_bits(0, 0)
+        self.draw_version_bits()
+
+    def draw_format_bits(self, format_bits: int, mask: int):
+        data = format_bits << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+
+        def bit(i):
+            return (bits >> i) & 1 != 0
+
+        size = self.size
+        for i in range(6):
+            self.set_function(8, i, bit(i))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            self.set_function(14 - i, 8, bit(i))
+
+        for i in range(8):
+            self.set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.set_function(8, size - 15 + i, bit(i))
+        self.set_function(8, size - 8, True)  # always dark
+
+    def draw_version_bits(self):
+        if self.version < 7:
+            return
+        rem = self.version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = self.version << 12 | rem
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a = self.size - 11 + i % 3
+            b = i // 3
+            self.set_function(a, b, dark)
+            self.set_function(b, a, dark)
+
+    def draw_codewords(self, codewords: List[int]):
+        i = 0
+        num_bits = len(codewords) * 8
+        right = self.size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5  # skip the vertical timing pattern
+            upward = (right + 1) & 2 == 0
+            for vert in range(self.size):
+                y = self.size - 1 - vert if upward else vert
+                for j in range(2):
+                    x = right - j
+                    if not self.is_function[y][x] and i < num_bits:
+                        self.modules[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 != 0
+                        i += 1
+            right -= 2
+
+    def apply_mask(self, mask: int):
+        pattern = MASK_PATTERNS[mask]
+        for y in range(self.size):
+            row, fixed = self.modules[y], self.is_function[y]
+            for x in range(self.size):
+                if not fixed[x] and pattern(x, y):
+                    row[x] = not row[x]
+
+
+def _penalty(modules: Matrix) -> int:
+    size = len(modules)
+    result = 0
+    lines = ["".join("1" if m else "0" for m in row) for row in modules]
+    lines += ["".join(col) for col in zip(*lines)]
+    for line in lines:
+        run = 1
+        for prev, cur in zip(line, line[1:]):
+            if cur == prev:
+                run += 1
+                continue
+            if run >= 5:
+                result += run - 2
+            run = 1
+        if run >= 5:
+            result += run - 2
+        padded = "0000" + line + "0000"
+        for pattern in FINDER_LIKE:
+            start = padded.find(pattern)
+            while start != -1:
+                result += 40
+                start = padded.find(pattern, start + 1)
+
+    for y in range(size - 1):
+        for x in range(size - 1):
+            color = modules[y][x]
+            if (
+                color == modules[y][x + 1]
+                and color == modules[y + 1][x]
+                and color == modules[y + 1][x + 1]
+            ):
+                result += 3
+
+    dark = sum(map(sum, modules))
+    total = size * size
+    k = (abs(dark * 20 - total * 10) + total - 1) // total - 1
+    return result + max(k, 0) * 10
+
+
+def encode(text: str, error_correction: str = "M") -> Matrix:
+    """
+    Encode text into a QR code module matrix.
+
+    Args:
+    text (str): The text to encode, stored as UTF-8 in byte mode.
+    error_correction (str): One of "L", "M", "Q" or "H". Defaults to "M".
+
+    Returns:
+    list: Rows of booleans, True for dark modules, without a quiet zone.
+    """
+    try:
+        level, format_bits = ERROR_CORRECTION_LEVELS[error_correction.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown error correction level: {error_correction}")
+
+    version, data = _encode_data(text.encode("utf-8"), level)
+    builder = _Builder(version)
+    builder.draw_function_patterns()
+    builder.draw_codewords(_add_ecc_and_interleave(version, level, data))
+
+    best = None
+    for mask in range(len(MASK_PATTERNS)):
+        builder.apply_mask(mask)
+        builder.draw_format_bits(format_bits, mask)
+        penalty = _penalty(builder.modules)
+        if best is None or penalty < best[0]:
+            best = (penalty, mask)
+        builder.apply_mask(mask)  # masks are XOR, so this undoes it
+    builder.apply_mask(best[1])
+    builder.draw_format_bits(format_bits, best[1])
+    return builder.modules
+
+
+def _scaled_rows(modules: Matrix, size: int, border: int) -> List[List[bool]]:
+    """Nearest-neighbour scale the matrix plus quiet zone to size x size pixels"""
+    n = len(modules) + 2 * border
+    lookup = [i * n // size - border for i in range(size)]
+    rows = []
+    for y in lookup:
+        if 0 <= y < len(modules):
+            row = modules[y]
+            rows.append([0 <= x < len(row) and row[x] for x in lookup])
+        else:
+            rows.append([False] * size)
+    return rows
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    )
+
+
+def to_png(modules: Matrix, size: int = 100, border: int = 4) -> bytes:
+    """
+    Write a module matrix as a 1-bit grayscale PNG.
+
+    Args:
+    modules (list): Module matrix from `encode`.
+    size (int): Width and height of the image in pixels. Defaults to 100.
+    border (int): Width of the quiet zone in modules. Defaults to 4.
+
+    Returns:
+    bytes: The PNG file contents.
+    """
+    raw = bytearray()
+    for row in _scaled_rows(modules, size, border):
+        raw.append(0)  # no filter
+        for i in range(0, size, 8):
+            byte = 0
+            for j, dark in enumerate(row[i : i + 8]):
+                if not dark:
+                    byte |= 0x80 >> j  # 1 is white in grayscale
+            raw.append(byte)
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def to_svg(modules: Matrix, size: int = 100, border: int = 4) -> bytes:
+    """
+    Write a module matrix as an SVG image with one path of dark runs.
+
+    Args:
+    modules (list): Module matrix from `encode`.
+    size (int): Rendered width and height of the image. Defaults to 100.
+    border (int): Width of the quiet zone in modules. Defaults to 4.
+
+    Returns:
+    bytes: The SVG file contents.
+    """
+    n = len(modules) + 2 * border
+    path = []
+    for y, row in enumerate(modules):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            path.append(f"M{start + border},{y + border}h{x - start}v1h{start - x}z")
+    svg = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+        f'width="{size}" height="{size}" viewBox="0 0 {n} {n}" '
+        'shape-rendering="crispEdges">'
+        '<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path d="{"".join(path)}" fill="#000"/></svg>\n'
+    )
+    return svg.encode("utf-8")
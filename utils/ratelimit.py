@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+
+def parse_retry_after(
+    value: Optional[str], now: Optional[datetime] = None
+) -> Optional[float]:
+    """
+    Seconds to wait according to a Retry-After header.
+
+    Args:
+    value (str): The header value, either a number of seconds or an HTTP date.
+    now (datetime): Current time, for HTTP dates; defaults to now.
+
+    Returns:
+    float: Seconds to wait, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that adapts its rate to upstream throttling.
+
+    Callers take a token per request with `acquire` (or `aacquire` in async
+    code), waiting when the bucket is empty. Tokens are reserved under a lock
+    and the wait happens outside it, so waiting callers are served in order.
+    `throttled` halves the rate (down to `min_rate`) and, given a Retry-After
+    delay, holds every caller until it has passed; no tokens are earned
+    meanwhile, so the callers held are let through one at a time at the new
+    rate rather than all at once. `succeeded` raises the rate by `increase`
+    again, up to `max_rate`. Calls in flight together tend to be throttled
+    together, so the rate is halved at most once per `cooldown` seconds.
+
+    Args:
+    rate (float): Requests per second to start at, and the most allowed.
+    burst (int): Most requests that can be made at once after an idle spell.
+    min_rate (float): Lowest rate throttling can bring it down to.
+    increase (float): Rate added per successful request while recovering;
+        defaults to 5% of `rate`.
+    cooldown (float): Seconds after slowing down before doing so again.
+    on_wait (callable): Called with the seconds each acquire waits, if given.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        min_rate: float = 0.1,
+        increase: Optional[float] = None,
+        cooldown: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        on_wait: Optional[Callable[[float], None]] = None,
+    ):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.increase = rate * 0.05 if increase is None else increase
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.on_wait = on_wait
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttles = 0
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._slowed_at = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """Add the tokens earned since the last refill; called with the lock held"""
+        # _updated is the end of the pause while one lasts, so none are earned
+        if now > self._updated:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+    def _reserve(self) -> float:
+        """Take a token, possibly one not yet available; return the seconds to wait"""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self._tokens -= 1
+            # tokens count from _updated, which is later than now during a pause
+            wait = self._updated - now + max(-self._tokens / self.rate, 0.0)
+            self.acquired += 1
+            if wait:
+                self.waits += 1
+                self.wait_seconds += wait
+        if self.on_wait:
+            self.on_wait(wait)
+        return wait
+
+    def acquire(self) -> float:
+        """Wait for a token; return the seconds waited"""
+        wait = self._reserve()
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    async def aacquire(self) -> float:
+        """Async version of acquire"""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def throttled(self, retry_after: Optional[float] = None):
+        """Slow down after a 429 or 503 response"""
+        with self._lock:
+            now = self.clock()
+            self.throttles += 1
+            if self._slowed_at is None or now - self._slowed_at >= self.cooldown:
+                self.rate = max(self.rate / 2, self.min_rate)
+                self._slowed_at = now
+            if retry_after:
+                self._refill(now)
+                self._updated = max(self._updated, now + retry_after)
+                # one call may go when the pause ends, the rest follow at the rate
+                self._tokens = min(self._tokens, 1.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "throttles": self.throttles,
+            }
@@ -1,11 +1,31 @@
+import asyncio
 import requests
 import json
-from typing import Optional
+from typing import Callable, Dict, Iterable, Optional, Tuple
 import os
+import random
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import httpx
 from dotenv import load_dotenv
 import sqlite3
 from contextlib import closing
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+if __name__ == "__main__" and not __package__:
+    # run as a script, python utils/url.py: import the rest of utils as a package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "utils"
+
+from .circuit import CircuitBreaker
+from .metrics import record_call, record_limiter_wait
+from .ratelimit import TokenBucket, parse_retry_after
 
 
 load_dotenv()
@@ -15,6 +35,237 @@ HEADERS = {
     "x-api-key": AWS_API_KEY,
     "Content-Type": "application/json",
 }
+API_URL = os.getenv("SHORTENER_API_URL", "https://api.aws3.link")
+# where short links are served, i.e. SHORT_URL_BASE/<key> redirects to its target
+SHORT_URL_BASE = os.getenv("SHORT_URL_BASE", "https://aws3.link")
+CONNECT_TIMEOUT = float(os.getenv("SHORTENER_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("SHORTENER_READ_TIMEOUT", 15))
+RETRIES = int(os.getenv("SHORTENER_RETRIES", 2))
+# requests per second to the shortener from this process, and burst size
+RATE_LIMIT = float(os.getenv("SHORTENER_RATE_LIMIT", 10))
+RATE_BURST = int(os.getenv("SHORTENER_RATE_BURST", 10))
+# responses that mean the shortener wants us to slow down
+THROTTLE_CODES = (429, 503)
+# track is called while pages render, so it gets a shorter read timeout, and
+# after this many failures in a row it is not called for a reset period
+TRACK_READ_TIMEOUT = float(os.getenv("SHORTENER_TRACK_READ_TIMEOUT", 3))
+TRACK_FAILURES = int(os.getenv("SHORTENER_TRACK_FAILURES", 5))
+TRACK_RESET = float(os.getenv("SHORTENER_TRACK_RESET_SECONDS", 30))
+
+
+class TrackingUnavailable(Exception):
+    """The shortener's track endpoint failed, or isn't being called for now"""
+
+
+def _is_retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _not_sent(error: requests.ConnectionError) -> bool:
+    """Whether a connection error happened before any of the request was sent"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # refused connections and failed DNS lookups come wrapped in a MaxRetryError
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _record_status(limiter: Optional[TokenBucket], response) -> Optional[float]:
+    """
+    Let the limiter know how a call went.
+
+    Returns the Retry-After delay of a throttled response, if the limiter is
+    holding calls for it.
+    """
+    if not limiter:
+        return None
+    if response.status_code in THROTTLE_CODES:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        limiter.throttled(retry_after)
+        return retry_after
+    if response.status_code < 500:
+        limiter.succeeded()
+    return None
+
+
+class ShortenerClient:
+    """
+    HTTP client for the aws3.link shortener API.
+
+    Keeps a pooled session so keep-alive connections are reused, applies
+    connect and read timeouts to every call, and retries 429 and 5xx responses
+    and failures to connect with jittered exponential backoff. Errors once a
+    request may have been sent, such as read timeouts and reset connections,
+    are not retried, since the upstream may already have acted on it.
+
+    Given a `limiter`, every attempt first takes a token from it. 429 and 503
+    responses slow it down, and a Retry-After delay on them holds every call
+    until it has passed, in place of the backoff; other responses let it speed
+    back up.
+
+    Args:
+    base_url (str): API root URL.
+    connect_timeout (float): Seconds to wait for a connection.
+    read_timeout (float): Seconds to wait for a response once connected.
+    retries (int): Number of retries after the first attempt.
+    backoff (float): Base delay in seconds; attempt n waits up to backoff * 2**n.
+    pool_size (int): Maximum number of pooled connections.
+    on_call (callable): Called after each call with the endpoint path, status
+        code (None on error) and latency in seconds.
+    limiter (TokenBucket): Rate limiter shared by the calls, if any.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = RETRIES,
+        backoff: float = 0.5,
+        pool_size: int = 20,
+        on_call: Optional[Callable[[str, Optional[int], float], None]] = None,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_call = on_call
+        self.limiter = limiter
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._local = threading.local()
+
+    @property
+    def last_latency(self) -> Optional[float]:
+        """Latency in seconds of the last call made by the current thread"""
+        return getattr(self._local, "latency", None)
+
+    def post(self, path: str, body: dict) -> requests.Response:
+        """
+        POST a JSON body to an API endpoint, retrying transient failures.
+
+        Returns the last response, whatever its status; raises the last
+        connection error if every attempt failed to connect, or the first
+        one that may have happened after the request was sent.
+        """
+        url = self.base_url + path
+        data = json.dumps(body)
+        start = time.monotonic()
+        try:
+            for attempt in range(self.retries + 1):
+                status_code = None
+                if self.limiter:
+                    self.limiter.acquire()
+                try:
+                    response = self.session.post(url, data=data, timeout=self.timeout)
+                except requests.ConnectionError as e:
+                    if attempt == self.retries or not _not_sent(e):
+                        raise
+                else:
+                    status_code = response.status_code
+                    retry_after = _record_status(self.limiter, response)
+                    if not _is_retryable(status_code) or attempt == self.retries:
+                        return response
+                    if retry_after is not None:
+                        # the limiter holds the next attempt until then
+                        continue
+                time.sleep(random.uniform(0, self.backoff * 2**attempt))
+        finally:
+            self._local.latency = time.monotonic() - start
+            if self.on_call:
+                self.on_call(path, status_code, self._local.latency)
+
+
+class AsyncShortenerClient:
+    """
+    asyncio counterpart of ShortenerClient, built on httpx.
+
+    Takes the same arguments and applies the same timeouts and retry policy,
+    but never blocks the event loop. An httpx.AsyncClient is bound to the loop
+    it was created in, so one is kept per running loop.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = RETRIES,
+        backoff: float = 0.5,
+        pool_size: int = 100,
+        on_call: Optional[Callable[[str, Optional[int], float], None]] = None,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_call = on_call
+        self.limiter = limiter
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            # requests drops headers set to None (e.g. a missing API key), httpx raises
+            headers = {name: value for name, value in HEADERS.items() if value}
+            self._clients[loop] = httpx.AsyncClient(
+                headers=headers, timeout=self.timeout, limits=self.limits
+            )
+        return self._clients[loop]
+
+    async def post(self, path: str, body: dict) -> httpx.Response:
+        """See ShortenerClient.post"""
+        url = self.base_url + path
+        data = json.dumps(body)
+        start = time.monotonic()
+        try:
+            for attempt in range(self.retries + 1):
+                status_code = None
+                if self.limiter:
+                    await self.limiter.aacquire()
+                try:
+                    response = await self._client().post(url, content=data)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == self.retries:
+                        raise
+                else:
+                    status_code = response.status_code
+                    retry_after = _record_status(self.limiter, response)
+                    if not _is_retryable(status_code) or attempt == self.retries:
+                        return response
+                    if retry_after is not None:
+                        continue
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        finally:
+            if self.on_call:
+                self.on_call(path, status_code, time.monotonic() - start)
+
+
+# shared by both clients, so the limit applies to all calls from this process
+limiter = TokenBucket(
+    RATE_LIMIT, burst=RATE_BURST, on_wait=partial(record_limiter_wait, "shortener")
+)
+client = ShortenerClient(limiter=limiter, on_call=partial(record_call, "shortener"))
+# failures are retried by url.hits' background refresh rather than in the request
+track_client = ShortenerClient(
+    read_timeout=TRACK_READ_TIMEOUT,
+    retries=0,
+    limiter=limiter,
+    on_call=partial(record_call, "shortener"),
+)
+async_track_client = AsyncShortenerClient(
+    read_timeout=TRACK_READ_TIMEOUT,
+    retries=0,
+    limiter=limiter,
+    on_call=partial(record_call, "shortener"),
+)
+track_breaker = CircuitBreaker(TRACK_FAILURES, TRACK_RESET)
 
 
 # Log a URL deletion action
@@ -32,17 +283,8 @@ HEADERS = {
 # );
 
 
-def create(long_url: str, key: Optional[str]) -> dict:
-    """
-    Create a shortened URL.
-
-    Args:
-    long_url (str): The long URL to be shortened.
-    key (str): The custom key for the shortened URL.
-
-    Returns:
-    dict: The response containing the shortened URL information.
-    """
+def _create_body(long_url: str, key: Optional[str]) -> Tuple[str, dict]:
+    """Add tracking params to long_url and build the /shorten request body"""
     tracking_params = {
         "utm_source": "ad-shop",
         "utm_medium": "qr-sticker",
@@ -60,11 +302,58 @@ def create(long_url: str, key: Optional[str]) -> dict:
     }
     if key:
         body["customSlug"] = key
-    response = requests.post(
-        "https://api.aws3.link/shorten", headers=HEADERS, data=json.dumps(body)
-    )
-    data = response.json()
-    return dict(action_type="create", long_url=long_url, response_json=json.dumps(data), response_code=response.status_code, url_key=key)
+    return long_url, body
+
+
+def _json(response):
+    """A response's JSON, or its text under "message" if it isn't JSON"""
+    try:
+        return response.json()
+    except ValueError:
+        return {"message": response.text[:1000]}
+
+
+def _result(action_type, long_url, key, response) -> dict:
+    data = _json(response)
+    return dict(action_type=action_type, long_url=long_url, response_json=data, response_code=response.status_code, url_key=key)
+
+
+def response_fields(payload, response_code: Optional[int]) -> Tuple[str, str]:
+    """
+    The short URL and error message in a shortener response.
+
+    Args:
+    payload: The response's JSON; for an update, a list of the delete's and
+        the create's.
+    response_code (int): The response status, or the highest of an update's.
+
+    Returns:
+    tuple: The short URL and the error message, each "" if there is none.
+    """
+    payloads = payload if isinstance(payload, list) else [payload]
+    payloads = [data for data in payloads if isinstance(data, dict)]
+    short_url = next((d["shortUrl"] for d in payloads if d.get("shortUrl")), "")
+    if response_code == 200 or not payloads:
+        return short_url, ""
+    # an update's delete reports a message even when its create then fails
+    error = next((d["error"] for d in payloads if d.get("error")), None)
+    return short_url, str(error or payloads[-1].get("message") or "")
+
+
+def create(long_url: str, key: Optional[str]) -> dict:
+    """
+    Create a shortened URL.
+
+    Args:
+    long_url (str): The long URL to be shortened.
+    key (str): The custom key for the shortened URL.
+
+    Returns:
+    dict: The response containing the shortened URL information.
+    """
+    long_url, body = _create_body(long_url, key)
+    response = client.post("/shorten", body)
+    return _result("create", long_url, key, response)
 
 
 def delete(key):
@@ -78,15 +367,10 @@ def delete(key):
     dict: The JSON response from the API.
     """
     # Make a POST request to the AWS3 API to remove the specified key
-    response = requests.post(
-        "https://api.aws3.link/remove",
-        headers=HEADERS,
-        data=json.dumps({"slug": key}),
-    )
-    data = response.json()
+    response = client.post("/remove", {"slug": key})
 
     # log to db
-    return dict(action_type="delete", long_url=None, response_json=json.dumps(data), response_code=response.status_code, url_key=key)
+    return _result("delete", None, key, response)
 
 
 def update(key: str, long_url: str):
@@ -103,6 +387,25 @@ def update(key: str, long_url: str):
     return [delete(key), create(long_url, key)]
 
 
+def tracking_available() -> bool:
+    """Whether track may be called now, i.e. track_breaker isn't open"""
+    return track_breaker.retry_in() == 0
+
+
+def _tracking_payload(response) -> dict:
+    """Report a track response to the breaker and return its JSON"""
+    if _is_retryable(response.status_code):
+        track_breaker.failed()
+        raise TrackingUnavailable(f"track returned {response.status_code}")
+    try:
+        data = response.json()
+    except ValueError as e:
+        track_breaker.failed()
+        raise TrackingUnavailable("track returned a non-JSON response") from e
+    track_breaker.succeeded()
+    return data
+
+
 def track(key):
     """
     Tracks hits corresponding to the specified key from the API.
@@ -112,16 +415,73 @@ def track(key):
 
     Returns:
     dict: The JSON response from the API.
+
+    Raises:
+    TrackingUnavailable: If the call failed, timed out, got a 429, 5xx or
+        non-JSON response, or if track_breaker is open after earlier failures.
     """
-    # Make a POST request to the AWS3 API to remove the specified key
-    response = requests.post(
-        "https://api.aws3.link/track",
-        headers=HEADERS,
-        data=json.dumps({"slug": key}),
-    )
+    if not track_breaker.allow():
+        raise TrackingUnavailable("track is failing; not calling it for now")
+    try:
+        response = track_client.post("/track", {"slug": key})
+    except requests.RequestException as e:
+        track_breaker.failed()
+        raise TrackingUnavailable(f"track failed: {e!r}") from e
+    return _tracking_payload(response)
+
+
+def target_url(long_url: str) -> str:
+    """The URL a key created for long_url redirects to, tracking params included"""
+    return _create_body(long_url, None)[0]
+
+
+def resolve_many(
+    keys: Iterable[str], max_workers: int = 32
+) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+    """
+    Find where the short links of many keys redirect to.
+
+    Requests SHORT_URL_BASE/<key> for each key without following redirects,
+    with up to `max_workers` requests in flight on one pooled session.
+
+    Returns:
+    dict: The response status and Location header by key; (None, None) for
+        keys whose request failed.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def resolve(key):
+        start, status = time.monotonic(), None
+        try:
+            response = session.get(
+                f"{SHORT_URL_BASE}/{key}",
+                allow_redirects=False,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            )
+            status = response.status_code
+            return key, (status, response.headers.get("Location"))
+        except requests.RequestException:
+            return key, (None, None)
+        finally:
+            record_call("short_links", "/{key}", status, time.monotonic() - start)
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(pool.map(resolve, keys))
+
 
-    # Return the JSON response from the API
-    return response.json()
+async def atrack(key: str) -> dict:
+    """Async version of track"""
+    if not track_breaker.allow():
+        raise TrackingUnavailable("track is failing; not calling it for now")
+    try:
+        response = await async_track_client.post("/track", {"slug": key})
+    except httpx.TransportError as e:
+        track_breaker.failed()
+        raise TrackingUnavailable(f"track failed: {e!r}") from e
+    return _tracking_payload(response)
 
 
 if __name__ == "__main__":